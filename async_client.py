@@ -0,0 +1,584 @@
+"""
+Asyncio façade for the AMQP 1.0 order producer and consumer.
+
+producer.py and consumer.py are driven by Proton's blocking Container.run() loop.
+This module runs that loop in one background thread per client and bridges it to
+an asyncio event loop, so services can send and receive orders from coroutines:
+
+    async with AsyncOrderProducer() as producer:
+        await producer.send(order) # Returns once the broker has accepted the order
+        futures = [await producer.submit(order) for order in orders]
+        await asyncio.gather(*futures) # Up to max_in_flight orders on the wire at once
+
+    async with AsyncOrderConsumer() as consumer:
+        async for order in consumer:
+            ... # The order's message is accepted when the next order is requested
+
+Coroutines hand commands to the reactor thread through a deque and an
+EventInjector, and the reactor thread hands outcomes back with
+loop.call_soon_threadsafe(); both directions wake the other side once per burst
+of work rather than once per order, and no thread is started per request.
+
+Backpressure: submit() waits while `max_in_flight` orders are queued or
+unsettled, so a producing coroutine never runs ahead of the link. The consumer
+grants link credit only as its messages are settled, so at most `prefetch`
+messages wait for the `async for` loop. Leaving the loop early leaves the current
+message unsettled, and the broker redelivers it once the consumer is closed.
+
+The connection settings, certificates, codec and delivery mode are those of
+producer.py and consumer.py, read from the same environment variables.
+
+Environment variables:
+- ASYNC_MAX_IN_FLIGHT: Orders a producer may have queued or unsettled at once (default 1000).
+
+Running this module directly sends NUM_ORDERS_TO_SEND random orders, then
+consumes from SOURCE_NODE until no order arrives for a second:
+
+    python async_client.py
+"""
+import asyncio
+import collections
+import logging
+import os
+import threading
+import time
+
+from proton import Delivery, Endpoint
+from proton.handlers import MessagingHandler
+from proton.reactor import ApplicationEvent, AtMostOnce, Container, EventInjector
+
+import consumer
+import producer
+from log_setup import configure_logging
+from order_batching import decode_orders
+from order_codecs import ORDER_CODEC, PayloadError, get_codec
+from tls_context import get_tls_context
+
+log = logging.getLogger("async_client")
+
+ASYNC_MAX_IN_FLIGHT = int(os.getenv("ASYNC_MAX_IN_FLIGHT", 1000))
+
+
+class DeliveryError(Exception):
+    """
+    Raised by AsyncOrderProducer.send() when the broker rejects or releases an order.
+
+    Attributes:
+        state: The terminal delivery state (Delivery.REJECTED or Delivery.RELEASED).
+    """
+    def __init__(self, message, state):
+        super().__init__(message)
+        self.state = state
+
+
+class _LoopBridge:
+    """
+    Passes callables between an asyncio event loop and a Proton reactor thread.
+
+    Calls into the reactor are queued and run by the handler's on_bridge_commands;
+    calls into the loop are queued and run by one call_soon_threadsafe() callback.
+    A flag per direction, cleared before the queue is drained, makes sure one
+    wakeup is pending whenever the queue is not empty, and never more than one.
+    Once closed, no more calls are accepted into the reactor.
+    """
+    def __init__(self, loop):
+        """
+        Args:
+            loop (asyncio.AbstractEventLoop): The event loop of the client.
+        """
+        self.loop = loop
+        self.injector = EventInjector()
+        self.closed = False
+        self._lock = threading.Lock() # No command is queued after the injector is closed
+        self._commands = collections.deque()
+        self._commands_pending = False
+        self._callbacks = collections.deque()
+        self._callbacks_pending = False
+
+    def call_in_reactor(self, fn, *args):
+        """
+        Runs `fn(*args)` on the reactor thread. Called from the event loop.
+
+        Raises:
+            ConnectionError: If the bridge is closed.
+        """
+        with self._lock:
+            if self.closed:
+                raise ConnectionError("The connection is closed")
+            self._commands.append((fn, args))
+            if not self._commands_pending:
+                self._commands_pending = True
+                try:
+                    self.injector.trigger(ApplicationEvent("bridge_commands"))
+                except OSError as e:
+                    self._commands.pop()
+                    self._commands_pending = False
+                    raise ConnectionError(f"The connection is closed: {e}") from e
+
+    def close(self):
+        """
+        Closes the injector once the calls queued so far have been delivered to the reactor.
+        """
+        with self._lock:
+            if not self.closed:
+                self.closed = True
+                self.injector.close()
+
+    def run_commands(self):
+        """
+        Runs the queued reactor calls. Called on the reactor thread.
+        """
+        self._commands_pending = False
+        while self._commands:
+            fn, args = self._commands.popleft()
+            fn(*args)
+
+    def call_in_loop(self, fn, *args):
+        """
+        Runs `fn(*args)` on the event loop. Called from the reactor thread.
+        """
+        self._callbacks.append((fn, args))
+        if not self._callbacks_pending:
+            self._callbacks_pending = True
+            try:
+                self.loop.call_soon_threadsafe(self._run_callbacks)
+            except RuntimeError:
+                pass # The event loop is closed; nobody is waiting any more
+
+    def _run_callbacks(self):
+        self._callbacks_pending = False
+        while self._callbacks:
+            fn, args = self._callbacks.popleft()
+            fn(*args)
+
+
+def _set_result(future, result):
+    if not future.done():
+        future.set_result(result)
+
+
+def _set_exception(future, error):
+    if not future.done():
+        future.set_exception(error)
+
+
+class _ReactorHandler(MessagingHandler):
+    """
+    Reactor-side part of an asyncio client: connects, runs bridged commands and reports failures.
+
+    Subclasses create their link in `_create_link()` and resolve the client's
+    ready future once it is open.
+    """
+    def __init__(self, client, **kwargs):
+        super().__init__(**kwargs)
+        self.client = client
+        self.bridge = client._bridge
+        self.connection = None
+        self.closing = False
+        self.error = None # The failure reported to the client, if any
+
+    def on_start(self, event):
+        event.container.selectable(self.bridge.injector)
+        try:
+            tls_context = get_tls_context(*self.client._credentials)
+        except Exception as e:
+            self._fail(ConnectionError(f"Error during SSL domain configuration: {e}"))
+            return
+        self.connection = tls_context.connect(event.container, self.client.server_url,
+                                              allow_insecure_mechs=False, **self.client._connect_options)
+        self._create_link(event.container, self.connection)
+
+    def on_bridge_commands(self, event):
+        self.bridge.run_commands()
+
+    def close(self):
+        """
+        Closes the connection and the injector, so that the reactor thread ends.
+        """
+        self.closing = True
+        if self.connection is not None and self.connection.state & Endpoint.LOCAL_ACTIVE:
+            self.connection.close()
+        self.bridge.close()
+
+    def _fail(self, error):
+        """
+        Reports a connection failure to the client and shuts the reactor down.
+        """
+        log.error("%s", error)
+        self.error = error
+        self.bridge.call_in_loop(self.client._connection_failed, error)
+        self.close()
+
+    def on_transport_error(self, event):
+        condition = event.transport.condition
+        self._fail(ConnectionError(f"Transport error (mTLS?): {condition if condition else 'N/A'}"))
+
+    def on_connection_error(self, event):
+        condition = event.connection.remote_condition if event.connection else None
+        self._fail(ConnectionError(f"AMQP connection error: {condition if condition else 'N/A'}"))
+
+    def on_link_error(self, event):
+        condition = event.link.remote_condition if event.link else None
+        self._fail(ConnectionError(f"AMQP link error: {condition if condition else 'N/A'}"))
+
+    def on_disconnected(self, event):
+        if self.closing:
+            return
+        self._fail(ConnectionError(f"Disconnected from {self.client.server_url}"))
+
+
+class _AsyncClient:
+    """
+    Runs a Proton container in a background thread for an asyncio client.
+    """
+    thread_name = "proton-reactor"
+
+    def __init__(self, server_url):
+        self.server_url = server_url
+        self.error = None # Set once the connection has failed
+        self._loop = None
+        self._bridge = None
+        self._handler = None
+        self._thread = None
+        self._ready = None
+        self._finished = None
+
+    async def start(self):
+        """
+        Starts the reactor thread and waits until the link is open.
+
+        Raises:
+            ConnectionError: If the connection or the link cannot be opened.
+        """
+        self._loop = asyncio.get_running_loop()
+        self._bridge = _LoopBridge(self._loop)
+        self._ready = self._loop.create_future()
+        self._finished = self._loop.create_future()
+        self._handler = self._create_handler()
+        self._thread = threading.Thread(target=self._run, args=(Container(self._handler),),
+                                        name=self.thread_name, daemon=True)
+        self._thread.start()
+        await self._ready
+        return self
+
+    def _run(self, container):
+        try:
+            container.run()
+        except Exception as e:
+            log.exception(f"Error during container execution: {e}")
+        finally:
+            self._bridge.call_in_loop(self._reactor_finished)
+
+    def _reactor_finished(self):
+        self._bridge.close() # In case the reactor ended without closing it
+        _set_exception(self._ready, self.error or ConnectionError(f"Connection to {self.server_url} closed"))
+        _set_result(self._finished, None)
+
+    def _connection_failed(self, error):
+        if self.error is None:
+            self.error = error
+        _set_exception(self._ready, error)
+
+    async def close(self):
+        """
+        Closes the connection and waits for the reactor thread to end.
+        """
+        if self._thread is None:
+            return
+        if not self._finished.done():
+            try:
+                self._bridge.call_in_reactor(self._handler.close)
+            except ConnectionError:
+                pass # The reactor is already shutting down
+        await self._finished
+        self._thread = None
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, exc_type, exc, traceback):
+        await self.close()
+
+
+class _ProducerHandler(_ReactorHandler):
+    """
+    Sends queued orders while the sender has credit and resolves their futures on settlement.
+    """
+    def __init__(self, client):
+        super().__init__(client)
+        self.sender = None
+        self.pending = collections.deque() # (order, future) waiting for credit
+        self.unsettled = {} # Delivery -> future
+
+    def _create_link(self, container, connection):
+        options = AtMostOnce() if self.client.at_most_once else None
+        self.sender = container.create_sender(connection, self.client.target_address, options=options)
+
+    def on_link_opened(self, event):
+        if event.link == self.sender:
+            self.bridge.call_in_loop(_set_result, self.client._ready, self.client)
+
+    def enqueue(self, order, future):
+        if self.closing: # Submitted while the connection was failing or closing
+            error = self.error or ConnectionError(f"Connection to {self.client.server_url} closed")
+            self.bridge.call_in_loop(_set_exception, future, error)
+            return
+        self.pending.append((order, future))
+        self.send_pending()
+
+    def on_sendable(self, event):
+        self.send_pending()
+
+    def send_pending(self):
+        sender = self.sender
+        codec = self.client.codec
+        while self.pending and sender.credit and sender.state & Endpoint.REMOTE_ACTIVE:
+            order, future = self.pending.popleft()
+            if future.cancelled():
+                continue
+            message = codec.message(order)
+            message.creation_time = time.time()
+            delivery = sender.send(message)
+            if self.client.at_most_once:
+                self.bridge.call_in_loop(_set_result, future, None)
+            else:
+                self.unsettled[delivery] = future
+
+    def _settled(self, event, error=None):
+        future = self.unsettled.pop(event.delivery, None)
+        if future is None:
+            return
+        if error is None:
+            self.bridge.call_in_loop(_set_result, future, None)
+        else:
+            self.bridge.call_in_loop(_set_exception, future, error)
+
+    def on_accepted(self, event):
+        self._settled(event)
+
+    def on_rejected(self, event):
+        self._settled(event, DeliveryError(f"Order rejected: {event.delivery.remote_state}", Delivery.REJECTED))
+
+    def on_released(self, event):
+        self._settled(event, DeliveryError("Order released by the broker", Delivery.RELEASED))
+
+    def _fail(self, error):
+        futures = [future for _, future in self.pending] + list(self.unsettled.values())
+        self.pending.clear()
+        self.unsettled.clear()
+        for future in futures:
+            self.bridge.call_in_loop(_set_exception, future, error)
+        super()._fail(error)
+
+
+class AsyncOrderProducer(_AsyncClient):
+    """
+    Sends orders from asyncio coroutines over one mTLS connection and sender link.
+    """
+    thread_name = "async-order-producer"
+
+    def __init__(self, server_url=None, target_address=None, max_in_flight=ASYNC_MAX_IN_FLIGHT, codec=None,
+                 delivery_mode=None):
+        """
+        Args:
+            server_url (str): The AMQP connection URL (default: producer.CONNECTION_URL).
+            target_address (str): The AMQP target node address (default: producer.TARGET_NODE).
+            max_in_flight (int): Orders that may be queued or unsettled at once; submit()
+                waits for a slot beyond that.
+            codec (OrderCodec): How orders are encoded (default: ORDER_CODEC).
+            delivery_mode (str): "at-least-once" or "at-most-once" (default: producer.DELIVERY_MODE).
+                At most once, futures resolve as soon as the order is sent.
+        """
+        super().__init__(server_url or producer.CONNECTION_URL)
+        delivery_mode = delivery_mode or producer.DELIVERY_MODE
+        if delivery_mode not in ("at-least-once", "at-most-once"):
+            raise ValueError(f"Unsupported delivery mode '{delivery_mode}', expected 'at-least-once' or 'at-most-once'")
+        self.target_address = target_address or producer.TARGET_NODE
+        self.max_in_flight = max(1, max_in_flight)
+        self.codec = codec or get_codec(ORDER_CODEC)
+        self.at_most_once = delivery_mode == "at-most-once"
+        self._credentials = (producer.CA_CERT_PATH, producer.PRODUCER_CLIENT_CERT_PATH,
+                             producer.PRODUCER_CLIENT_KEY_PATH, None)
+        self._connect_options = dict(user=producer.PRODUCER_USER, password=producer.PRODUCER_PASSWORD,
+                                     virtual_host=producer.VHOST, sni=producer.RABBITMQ_HOST,
+                                     allowed_mechs=producer.SASL_MECHANISMS)
+        self._slots = None
+
+    def _create_handler(self):
+        self._slots = asyncio.Semaphore(self.max_in_flight)
+        return _ProducerHandler(self)
+
+    async def submit(self, order):
+        """
+        Queues an order for sending, waiting while `max_in_flight` orders are in flight.
+
+        Args:
+            order (dict): The order to send.
+
+        Returns:
+            asyncio.Future: Resolved once the broker accepts the order; it raises
+                DeliveryError if the order is rejected or released, and ConnectionError
+                if the connection fails first.
+
+        Raises:
+            ConnectionError: If the connection has already failed or is closed.
+        """
+        if self.error is not None:
+            raise self.error
+        await self._slots.acquire()
+        if self.error is not None: # The connection failed while waiting for a slot
+            self._slots.release()
+            raise self.error
+        future = self._loop.create_future()
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            self._bridge.call_in_reactor(self._handler.enqueue, order, future)
+        except ConnectionError as e:
+            future.cancel() # Frees the slot
+            raise self.error or e
+        return future
+
+    async def send(self, order):
+        """
+        Sends an order and waits until the broker has accepted it.
+
+        Args:
+            order (dict): The order to send.
+
+        Raises:
+            DeliveryError: If the broker rejects or releases the order.
+            ConnectionError: If the connection fails.
+        """
+        await (await self.submit(order))
+
+
+class _ConsumerHandler(_ReactorHandler):
+    """
+    Hands decoded messages to the event loop and grants one credit per settled message.
+    """
+    def __init__(self, client):
+        # Credit is granted when the link opens and replenished on settlement
+        super().__init__(client, prefetch=0, auto_accept=False)
+        self.receiver = None
+
+    def _create_link(self, container, connection):
+        self.receiver = container.create_receiver(connection, self.client.source_address)
+
+    def on_link_opened(self, event):
+        if event.link == self.receiver:
+            self.receiver.flow(self.client.prefetch)
+            self.bridge.call_in_loop(_set_result, self.client._ready, self.client)
+
+    def on_message(self, event):
+        if event.receiver != self.receiver:
+            return
+        try:
+            orders = decode_orders(event.message)
+        except PayloadError as e:
+            log.warning("Payload error, message rejected: %s", e)
+            self.settle_delivery(event.delivery, Delivery.REJECTED)
+            return
+        self.bridge.call_in_loop(self.client._messages.put_nowait, (event.delivery, orders))
+
+    def settle_delivery(self, delivery, state):
+        """
+        Settles a delivery and grants the credit back, unless the link has closed meanwhile.
+        """
+        if self.receiver is None or not self.receiver.state & Endpoint.LOCAL_ACTIVE:
+            return # The broker redelivers the unsettled messages of a closed link
+        self.settle(delivery, state)
+        self.receiver.flow(1)
+
+
+class AsyncOrderConsumer(_AsyncClient):
+    """
+    Receives orders as an asynchronous iterator over one mTLS connection and receiver link.
+
+    Every order of a batch message is yielded in turn. A message is accepted when
+    the order after its last one is requested, so an order is only acknowledged
+    once the loop body has finished with it (at-least-once).
+    """
+    thread_name = "async-order-consumer"
+
+    def __init__(self, server_url=None, source_address=None, prefetch=None):
+        """
+        Args:
+            server_url (str): The AMQP connection URL (default: consumer.CONNECTION_URL).
+            source_address (str): The AMQP source node address (default: consumer.SOURCE_NODE).
+            prefetch (int): The link credit window (default: consumer.CONSUMER_PREFETCH).
+        """
+        super().__init__(server_url or consumer.CONNECTION_URL)
+        self.source_address = source_address or consumer.SOURCE_NODE
+        self.prefetch = max(1, prefetch or consumer.CONSUMER_PREFETCH)
+        self._credentials = (consumer.CA_CERT_PATH, consumer.CONSUMER_CLIENT_CERT_PATH,
+                             consumer.CONSUMER_CLIENT_KEY_PATH, None)
+        self._connect_options = dict(user=consumer.CONSUMER_USER, password=consumer.CONSUMER_PASSWORD,
+                                     virtual_host=consumer.VHOST, sni=consumer.RABBITMQ_HOST,
+                                     allowed_mechs=consumer.SASL_MECHANISMS)
+        self._messages = None # (delivery, orders) received and not yet iterated; bounded by the credit window
+        self._delivery = None # Delivery of the orders being iterated
+        self._orders = collections.deque()
+
+    def _create_handler(self):
+        self._messages = asyncio.Queue()
+        return _ConsumerHandler(self)
+
+    def _connection_failed(self, error):
+        super()._connection_failed(error)
+        self._messages.put_nowait(error)
+
+    def _reactor_finished(self):
+        super()._reactor_finished()
+        self._messages.put_nowait(None) # Ends the iteration
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        while not self._orders:
+            if self._delivery is not None:
+                try:
+                    self._bridge.call_in_reactor(self._handler.settle_delivery, self._delivery, Delivery.ACCEPTED)
+                except ConnectionError:
+                    pass # The broker redelivers it; the failure comes next from the queue
+                self._delivery = None
+            item = await self._messages.get()
+            if item is None:
+                self._messages.put_nowait(None) # Later calls end as well
+                raise StopAsyncIteration
+            if isinstance(item, Exception):
+                raise item
+            self._delivery, orders = item
+            self._orders.extend(orders)
+        return self._orders.popleft()
+
+
+async def _demo(num_orders):
+    """
+    Sends `num_orders` random orders, then consumes orders until none arrives for a second.
+    """
+    async with AsyncOrderProducer() as order_producer:
+        started = time.perf_counter()
+        futures = [await order_producer.submit(order) for order in producer.iter_random_orders(num_orders)]
+        await asyncio.gather(*futures)
+        elapsed = time.perf_counter() - started
+        log.info(f"Sent {num_orders} order(s) in {elapsed:.3f}s ({num_orders / elapsed:.1f} orders/s)")
+
+    received = 0
+    async with AsyncOrderConsumer() as order_consumer:
+        started = time.perf_counter()
+        orders = aiter(order_consumer)
+        while True:
+            try:
+                await asyncio.wait_for(anext(orders), timeout=1.0)
+            except asyncio.TimeoutError:
+                break
+            received += 1
+        elapsed = time.perf_counter() - started - 1.0
+    log.info(f"Received {received} order(s) in {elapsed:.3f}s"
+             + (f" ({received / elapsed:.1f} orders/s)" if received and elapsed > 0 else ""))
+
+
+if __name__ == "__main__":
+    configure_logging()
+    asyncio.run(_demo(producer.NUM_ORDERS_TO_SEND))
@@ -0,0 +1,383 @@
+"""
+Reproducible load-generation and benchmark harness for the producer and consumer.
+
+Drives OrderProducer and OrderConsumer through a grid of scenarios that vary the
+number of messages, the payload size, the consumer credit window, the number of
+producer connections, the order codec, the orders packed per message and the
+producer delivery mode, and prints one row per scenario with producer and consumer throughput and latency.
+
+By default the clients run against the local stand-in broker (local_broker.py),
+started in a child process on localhost with the certificates generated by
+`make certs`, so no RabbitMQ is needed. With `--broker external` they use the
+broker configured in the environment (RABBITMQ_HOST, RABBITMQ_PORT, ...) as
+producer.py and consumer.py do.
+
+Each scenario starts a fresh consumer process, waits for its receiver link, then
+splits the messages across one producer process per connection (burst send).
+The scenario ends when the consumer has accepted every message.
+
+Columns:
+- prod msg/s: Combined confirmed orders per second of the producer connections,
+  from first send to last accept (at-most-once: sent orders, up to the broker
+  closing the connection).
+- cons msg/s: Orders per second accepted by the consumer, from first to last receipt.
+- MB/s: Encoded message bytes sent per second.
+- accept p50/p99: Send-to-accept latency in milliseconds (ProducerMetrics).
+- e2e p50/p99: Producer creation_time to consumer receipt in milliseconds (ConsumerMetrics).
+
+With `--batch` > 1 the messages scenario value and the rates count orders, which
+travel in batch messages (see order_batching.py); without it orders and messages
+are the same.
+
+With `--json FILE` the rows are also written as JSON; with `--baseline FILE`
+they are compared with a previous JSON result and the run fails (exit status 1)
+if a throughput dropped by more than `--max-regression`, so regressions on the
+hot paths show up in CI.
+
+Usage:
+
+    python benchmark.py --messages 5000 --payload 0,1024 --prefetch 10,100 --connections 1,2 --codec json,msgpack --batch 1,50
+    python benchmark.py --delivery at-least-once,at-most-once
+
+Every option taking a list runs one scenario per value (all combinations).
+"""
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+BENCHMARK_PORT = int(os.getenv("BENCHMARK_PORT", 5673)) # Local broker port, away from RabbitMQ's 5671
+SCENARIO_KEYS = ("messages", "payload", "prefetch", "connections", "codec", "batch", "delivery")
+SCENARIO_DEFAULTS = {"batch": 1, "delivery": "at-least-once"} # For results written before a key existed
+THROUGHPUT_KEYS = ("producer_rate", "consumer_rate")
+
+
+def _padded_orders(count, payload_bytes, seed, start, dataset_size=None):
+    """
+    Lazily generates random orders carrying `payload_bytes` of extra text.
+
+    Args:
+        count (int): Number of orders.
+        payload_bytes (int): Size of the "notes" field added to every order (0 for none).
+        seed (int): The dataset seed, so every run sends the same orders.
+        start (int): Position of the first order in the dataset.
+        dataset_size (int, optional): Orders in the whole dataset (default `count`).
+
+    Yields:
+        dict: An order dictionary.
+    """
+    from producer import iter_random_orders
+
+    notes = "x" * payload_bytes
+    for order in iter_random_orders(count, seed, start, dataset_size):
+        if payload_bytes:
+            order["notes"] = notes
+        yield order
+
+
+def _run_producer(count, payload_bytes, codec_name, seed, start, batch_size=1, delivery_mode="at-least-once",
+                  dataset_size=None):
+    """
+    Sends `count` orders over one producer connection. Runs in a worker process.
+
+    Args:
+        count (int): Number of orders to send.
+        payload_bytes (int): Extra payload per order (see _padded_orders).
+        codec_name (str): The order codec (see order_codecs.CODECS).
+        seed (int): The dataset seed.
+        start (int): Position of this connection's first order in the dataset.
+        batch_size (int): Orders packed per message (1 for no batching).
+        delivery_mode (str): "at-least-once" or "at-most-once" (pre-settled sends).
+        dataset_size (int, optional): Orders sent by all connections of the scenario.
+
+    Returns:
+        dict: Sent and confirmed (at most once: sent) order counts, orders per second, bytes sent and the send-to-accept histogram.
+    """
+    from proton.reactor import Container
+    import producer
+    from order_batching import MessageBatcher
+    from order_codecs import get_codec
+
+    codec = get_codec(codec_name)
+    handler = producer.OrderProducer(producer.CONNECTION_URL, producer.TARGET_NODE,
+                                     _padded_orders(count, payload_bytes, seed, start, dataset_size), burst_send=True,
+                                     total_messages=count, codec=codec, metrics=True,
+                                     batcher=MessageBatcher(batch_size, codec=codec) if batch_size > 1 else None,
+                                     delivery_mode=delivery_mode)
+    Container(handler).run()
+    return {
+        "sent": handler.orders_sent,
+        "confirmed": handler.delivered_counts()[1],
+        "rate": handler.throughput(orders=True),
+        "bytes": handler.metrics.bytes_sent.value,
+        "send_to_accept": handler.metrics.send_to_accept,
+    }
+
+
+def _run_consumer(expected, prefetch, timeout, ready, results):
+    """
+    Receives `expected` messages and puts the consumer's results on `results`. Runs in a child process.
+
+    The reported rate counts the orders of batch messages.
+
+    Args:
+        expected (int): Number of messages to accept before stopping.
+        prefetch (int): The consumer credit window.
+        timeout (float): Seconds after which the consumer stops anyway.
+        ready (multiprocessing.Event): Set once the receiver link is attached.
+        results (multiprocessing.Queue): Receives the result dict.
+    """
+    from proton.reactor import Container
+    import consumer
+
+    class _BenchmarkConsumer(consumer.OrderConsumer):
+        """
+        OrderConsumer that records its first and last receipt and stops after `expected` accepts.
+        """
+        def __init__(self):
+            super().__init__(consumer.CONNECTION_URL, consumer.SOURCE_NODE, prefetch=prefetch, metrics=True)
+            self.first_received = None
+            self.last_received = None
+
+        def on_link_opened(self, event):
+            if event.receiver:
+                ready.set()
+
+        def on_message(self, event):
+            now = time.perf_counter()
+            if self.first_received is None:
+                self.first_received = now
+            self.last_received = now
+            super().on_message(event)
+            if self.accepted_count >= expected and self.receiver:
+                # Closing lets the last dispositions reach the broker; the container then stops on its own
+                timeout_task.cancel()
+                self.receiver.connection.close()
+
+        def on_timer_task(self, event):
+            event.container.stop() # Timeout
+
+    handler = _BenchmarkConsumer()
+    container = Container(handler)
+    timeout_task = container.schedule(timeout, handler)
+    try:
+        container.run()
+    finally:
+        elapsed = (handler.last_received - handler.first_received) if handler.first_received else 0.0
+        results.put({
+            "received": handler.received_count,
+            "accepted": handler.accepted_count,
+            "orders": handler.orders_received,
+            "rate": handler.orders_received / elapsed if elapsed > 0 else None,
+            "end_to_end": handler.metrics.end_to_end,
+        })
+
+
+def run_scenario(scenario, timeout=120.0, seed=1):
+    """
+    Runs one scenario: a fresh consumer, then one producer process per connection.
+
+    Args:
+        scenario (dict): The messages (orders), payload, prefetch, connections, codec, batch size
+            and delivery mode to use.
+        timeout (float): Seconds after which the consumer gives up waiting for messages.
+        seed (int): The order dataset seed.
+
+    Returns:
+        dict: The scenario with its measured throughput (msg/s, MB/s) and latency (ms).
+
+    Raises:
+        RuntimeError: If the consumer does not attach or messages go missing.
+    """
+    from metrics import Histogram
+
+    messages, connections, batch = scenario["messages"], scenario["connections"], scenario["batch"]
+    shares = [messages // connections + (1 if index < messages % connections else 0) for index in range(connections)]
+    batch_messages = sum(-(-share // batch) for share in shares) # Each connection's last batch may be partial
+    ready = multiprocessing.Event()
+    results = multiprocessing.Queue()
+    consumer_process = multiprocessing.Process(
+        target=_run_consumer, args=(batch_messages, scenario["prefetch"], timeout, ready, results),
+        name="benchmark-consumer"
+    )
+    consumer_process.start()
+    try:
+        if not ready.wait(30):
+            raise RuntimeError("The consumer did not attach to its source within 30s")
+        # A fresh pool per scenario: every connection does a full TLS handshake, as in a new producer process
+        with ProcessPoolExecutor(max_workers=connections) as executor:
+            starts = [sum(shares[:index]) for index in range(connections)]
+            producers = list(executor.map(_run_producer, shares, [scenario["payload"]] * connections,
+                                          [scenario["codec"]] * connections, [seed] * connections, starts,
+                                          [batch] * connections, [scenario["delivery"]] * connections,
+                                          [messages] * connections))
+        consumed = results.get(timeout=timeout + 10)
+    finally:
+        consumer_process.join(5)
+        if consumer_process.is_alive():
+            consumer_process.terminate()
+
+    confirmed = sum(result["confirmed"] for result in producers)
+    if confirmed != messages or consumed["orders"] != messages or consumed["accepted"] != batch_messages:
+        raise RuntimeError(f"Expected {messages} orders, {confirmed} confirmed and {consumed['orders']} consumed "
+                           f"(was the queue empty?)")
+    send_to_accept = Histogram("send_to_accept_seconds", "")
+    for result in producers:
+        send_to_accept.merge(result["send_to_accept"])
+    send_to_accept, end_to_end = send_to_accept.summary(), consumed["end_to_end"].summary()
+    producer_rate = sum(result["rate"] or 0 for result in producers)
+    return dict(
+        scenario,
+        producer_rate=producer_rate,
+        consumer_rate=consumed["rate"] or 0.0,
+        mb_per_second=producer_rate * sum(result["bytes"] for result in producers) / messages / 1e6,
+        accept_p50_ms=_milliseconds(send_to_accept["p50"]),
+        accept_p99_ms=_milliseconds(send_to_accept["p99"]),
+        e2e_p50_ms=_milliseconds(end_to_end["p50"]),
+        e2e_p99_ms=_milliseconds(end_to_end["p99"]),
+    )
+
+
+def _milliseconds(seconds):
+    """
+    Converts a latency to milliseconds; None (nothing measured, e.g. no accepts at most once) stays None.
+    """
+    return seconds * 1000 if seconds is not None else None
+
+
+def median_result(results):
+    """
+    Combines repeated runs of a scenario into one row, taking the median of every measurement.
+
+    Args:
+        results (list): The rows returned by run_scenario for the same scenario.
+    """
+    row = {key: results[0][key] for key in SCENARIO_KEYS}
+    for key in results[0]:
+        if key not in SCENARIO_KEYS:
+            values = [result[key] for result in results if result[key] is not None]
+            row[key] = statistics.median(values) if values else None
+    return row
+
+
+def print_table(rows):
+    """
+    Prints the results as a fixed-width table, one row per scenario.
+    """
+    print(f"{'messages':>9}{'payload':>9}{'prefetch':>9}{'conns':>6}  {'codec':<8}{'batch':>6}  {'delivery':<14}{'prod msg/s':>11}"
+          f"{'cons msg/s':>11}{'MB/s':>8}{'accept p50':>11}{'p99':>8}{'e2e p50':>9}{'p99':>8}")
+    for row in rows:
+        print(f"{row['messages']:>9}{row['payload']:>9}{row['prefetch']:>9}{row['connections']:>6}  {row['codec']:<8}"
+              f"{row['batch']:>6}  {row['delivery']:<14}{row['producer_rate']:>11.1f}{row['consumer_rate']:>11.1f}{row['mb_per_second']:>8.2f}"
+              f"{_cell(row['accept_p50_ms'], 11)}{_cell(row['accept_p99_ms'], 8)}{_cell(row['e2e_p50_ms'], 9)}"
+              f"{_cell(row['e2e_p99_ms'], 8)}")
+
+
+def _cell(value, width):
+    """
+    Formats a latency for the table, "-" if it was not measured.
+    """
+    return f"{value:>{width}.2f}" if value is not None else f"{'-':>{width}}"
+
+
+def compare_with_baseline(rows, baseline_rows, max_regression):
+    """
+    Compares throughput with a previous run of the same scenarios.
+
+    Args:
+        rows (list): The rows of this run.
+        baseline_rows (list): The rows of the baseline run (scenarios missing there are skipped).
+        max_regression (float): Largest accepted throughput drop, as a fraction (0.2 = 20%).
+
+    Returns:
+        list: One message per throughput that dropped by more than `max_regression`.
+    """
+    baseline = {tuple(row.get(key, SCENARIO_DEFAULTS.get(key)) for key in SCENARIO_KEYS): row for row in baseline_rows}
+    regressions = []
+    for row in rows:
+        previous = baseline.get(tuple(row[key] for key in SCENARIO_KEYS))
+        if previous is None:
+            continue
+        for key in THROUGHPUT_KEYS:
+            if previous[key] and row[key] < previous[key] * (1 - max_regression):
+                scenario = ", ".join(f"{name}={row[name]}" for name in SCENARIO_KEYS)
+                regressions.append(f"{key} {row[key]:.1f} < baseline {previous[key]:.1f} ({scenario})")
+    return regressions
+
+
+def _int_list(value):
+    return [int(item) for item in value.split(",")]
+
+
+def _str_list(value):
+    return [item.strip() for item in value.split(",")]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the AMQP 1.0 order producer and consumer.")
+    parser.add_argument("--messages", type=_int_list, default=[5000], help="Messages per scenario (default 5000)")
+    parser.add_argument("--payload", type=_int_list, default=[0], help="Extra bytes per order (default 0)")
+    parser.add_argument("--prefetch", type=_int_list, default=[100], help="Consumer credit window (default 100)")
+    parser.add_argument("--connections", type=_int_list, default=[1], help="Producer connections (default 1)")
+    parser.add_argument("--codec", type=_str_list, default=["json"], help="Order codecs (default json)")
+    parser.add_argument("--batch", type=_int_list, default=[1],
+                        help="Orders packed per message, 1 for no batching (default 1)")
+    parser.add_argument("--delivery", type=_str_list, default=["at-least-once"],
+                        help="Producer delivery modes, at-least-once or at-most-once (default at-least-once)")
+    parser.add_argument("--seed", type=int, default=1, help="Order dataset seed (default 1)")
+    parser.add_argument("--repeat", type=int, default=1, help="Runs per scenario, the median is reported (default 1)")
+    parser.add_argument("--broker", choices=("local", "external"), default="local",
+                        help="Start the local stand-in broker (default) or use the one configured in the environment")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Seconds allowed per scenario (default 120)")
+    parser.add_argument("--json", metavar="FILE", help="Also write the results to FILE as JSON")
+    parser.add_argument("--baseline", metavar="FILE", help="Fail if throughput regressed against this JSON result")
+    parser.add_argument("--max-regression", type=float, default=0.2,
+                        help="Largest accepted throughput drop against the baseline (default 0.2)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    # The clients read their configuration from the environment when first imported
+    os.environ.setdefault("SIMULATED_PROCESSING_TIME", "0")
+    os.environ.setdefault("LOG_SUMMARY_INTERVAL", "0")
+    broker_process = None
+    if args.broker == "local":
+        from local_broker import start_broker_process
+
+        os.environ.update(RABBITMQ_HOST="localhost", RABBITMQ_PORT=str(BENCHMARK_PORT), SASL_MECHANISMS="EXTERNAL")
+        broker_process = start_broker_process(f"amqps://localhost:{BENCHMARK_PORT}")
+
+    scenarios = [dict(zip(SCENARIO_KEYS, values)) for values in itertools.product(
+        args.messages, args.payload, args.prefetch, args.connections, args.codec, args.batch, args.delivery)]
+    print(f"Benchmark: {len(scenarios)} scenario(s) x {args.repeat} run(s) against the "
+          f"{'local stand-in' if broker_process else 'configured'} broker "
+          f"(amqps://{os.getenv('RABBITMQ_HOST', 'rabbitmq.labs.dontesta.it')}:{os.getenv('RABBITMQ_PORT', 5671)})")
+    rows = []
+    try:
+        for scenario in scenarios:
+            rows.append(median_result([run_scenario(scenario, args.timeout, args.seed) for _ in range(args.repeat)]))
+    finally:
+        if broker_process:
+            broker_process.terminate()
+    print_table(rows)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as output:
+            json.dump({"scenarios": rows}, output, indent=2)
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as baseline_file:
+            regressions = compare_with_baseline(rows, json.load(baseline_file)["scenarios"], args.max_regression)
+        for regression in regressions:
+            print(f"Benchmark: Regression: {regression}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -4,6 +4,12 @@ AMQP 1.0 mTLS Consumer for RabbitMQ.
 This script connects to a RabbitMQ broker using AMQP 1.0 over mTLS,
 authenticates with a client certificate, and consumes messages from a specified queue.
 It uses the python-qpid-proton library for AMQP 1.0 communication.
+Messages carrying a batch of orders (see order_batching.py) are unpacked and every
+order is processed; the message is then accepted, rejected or released as a whole.
+With DEDUP_KEY set, redelivered orders that were already processed are accepted
+without being processed again (see order_dedup.py). With CONSUMER_SINK set, orders
+are written to a sink in micro-batches instead of being processed one by one, and
+each message is accepted once its batch is committed (see order_sinks.py).
 
 Environment variables are used for configuration, with defaults provided.
 - RABBITMQ_HOST: The hostname or IP address of the RabbitMQ broker.
@@ -11,21 +17,74 @@ Environment variables are used for configuration, with defaults provided.
 - VHOST: The virtual host to connect to, in Proton format (e.g., "vhost:my_vhost").
 - CONSUMER_USER: The username for authentication.
 - CONSUMER_PASSWORD: The password for authentication.
+- SASL_MECHANISMS: SASL mechanisms offered to the broker (default "PLAIN"); "EXTERNAL"
+  authenticates with the client certificate alone (RabbitMQ's rabbitmq_auth_mechanism_ssl).
 - SOURCE_NODE: The AMQP source address (e.g., "/queues/my_queue").
+- CONSUMER_WORKERS: Number of workers processing orders off the reactor thread
+  (default 0, process inline on the reactor thread).
+- CONSUMER_WORKER_MODE: Worker pool type, "thread" (default) or "process".
+- CONSUMER_PREFETCH: Link credit window (default 10).
+- CONSUMER_CREDIT_MODE: "auto" tops credit back up as soon as a message arrives,
+  "manual" only returns credit when deliveries are settled, bounding unsettled
+  deliveries to the prefetch window (default "manual" with workers, "auto" otherwise).
+- CONSUMER_ACK_BATCH_SIZE: Number of outcomes settled together (default 1, settle immediately).
+- CONSUMER_ACK_BATCH_TIMEOUT_MS: Maximum time an outcome waits for its batch (default 100).
+- CONSUMER_PROCESSES: Number of competing consumer processes run by a supervisor, each with
+  its own connection, receiver link and credit window (default 1, no supervisor).
+- CONSUMER_RESTART_DELAY: Seconds before the supervisor restarts a failed consumer (default 2).
+- CONSUMER_REPORT_INTERVAL: Seconds between supervisor counter reports (default 5).
+- CONSUMER_SINK, SINK_BATCH_SIZE, SINK_BATCH_TIMEOUT_MS, SINK_SQLITE_PATH: Write orders in
+  micro-batches of up to N orders, or those received within T ms, to a bulk sink such
+  as the reference SQLite sink (default: unset, orders are processed one by one; see
+  order_sinks.py). Keep CONSUMER_PREFETCH at least SINK_BATCH_SIZE messages, since
+  the credit of a message only returns once its batch is committed.
+- DEDUP_KEY, DEDUP_MAX_ENTRIES, DEDUP_TTL_SECONDS, DEDUP_DB_PATH: Skip orders already
+  processed, keyed on the order id or the AMQP message id, in a bounded cache
+  optionally persisted to SQLite (see order_dedup.py).
+- METRICS_PORT, METRICS_JSON_INTERVAL: Expose end-to-end latency, throughput, credit stall
+  (manual credit mode) and byte counters as a Prometheus endpoint or periodic JSON snapshots (see metrics.py).
+- LOG_LEVEL, LOG_MESSAGE_RATE, LOG_SUMMARY_INTERVAL, LOG_ASYNC: Log level, per-message log
+  rate limit, interval of the "N received in the last 5s" summaries and background log
+  writing (see log_setup.py).
+- SIMULATED_PROCESSING_TIME: Seconds spent "processing" each order (default 0.2).
 - Certificate paths (CA_CERT_PATH, CONSUMER_CLIENT_CERT_PATH, CONSUMER_CLIENT_KEY_PATH)
   are derived relative to this script's location, assuming a 'certs/' subdirectory.
+  The SSL domain is loaded once per process and TLS sessions are resumed on later
+  connections when the broker allows it (see tls_context.py, TLS_SESSION_RESUMPTION).
+- STARTUP_PROFILE: If "true", log how long each startup phase took, from the imports to
+  the first message received (default "false"; see startup_profile.py).
 """
-import json
+from startup_profile import startup # Imported first, so the profile's import phase covers the others
+
+import logging
 import os
+import queue
+import signal
+import sys
 import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 
-from proton import SSLDomain, Delivery
+from proton import Delivery, Endpoint
 from proton.handlers import MessagingHandler
-from proton.reactor import Container
+from proton.reactor import ApplicationEvent, Container, EventInjector
+
+from log_setup import LogSummary, configure_logging, flush_logging, get_message_logger
+from metrics import ConsumerMetrics, metrics_enabled, start_exporters
+from order_batching import decode_orders
+from order_codecs import PayloadError
+from order_dedup import create_dedup_cache
+from order_sinks import SINK_BATCH_SIZE, SINK_BATCH_TIMEOUT_MS, create_sink
+from tls_context import defer_default_ssl_domains, get_tls_context
 
+startup.mark("import")
 load_dotenv()
 
+log = logging.getLogger("consumer")
+message_log = get_message_logger("consumer.messages") # Per-message lines, rate-limited
+supervisor_log = logging.getLogger("consumer.supervisor")
+
 RABBITMQ_HOST = os.getenv("RABBITMQ_HOST", "rabbitmq.labs.dontesta.it")
 RABBITMQ_PORT = int(os.getenv("RABBITMQ_PORT", 5671))
 VHOST_NAME_ONLY = "logistics_vhost" # Pure vhost name
@@ -33,6 +92,7 @@ VHOST_PROTON_FORMAT = f"vhost:{VHOST_NAME_ONLY}" # Format for Proton
 VHOST = os.getenv("VHOST", VHOST_PROTON_FORMAT) # Use the correct format
 CONSUMER_USER = os.getenv("CONSUMER_USER", "delivery_receiver")
 CONSUMER_PASSWORD = os.getenv("CONSUMER_PASSWORD", "DeliveryReceiverP@ssw0rd")
+SASL_MECHANISMS = os.getenv("SASL_MECHANISMS", "PLAIN") # "EXTERNAL" authenticates with the client certificate
 
 # Certificate paths for mTLS (use absolute paths)
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -44,6 +104,86 @@ CONSUMER_CLIENT_KEY_PATH = os.path.join(BASE_DIR, "certs/delivery_receiver_clien
 SOURCE_NODE = os.getenv("SOURCE_NODE", "/queues/logistics_queue")
 CONNECTION_URL = f"amqps://{RABBITMQ_HOST}:{RABBITMQ_PORT}"
 
+# --- Configuration for order processing ---
+CONSUMER_WORKERS = int(os.getenv("CONSUMER_WORKERS", 0)) # 0 = process inline on the reactor thread
+CONSUMER_WORKER_MODE = os.getenv("CONSUMER_WORKER_MODE", "thread") # "thread" or "process"
+CONSUMER_PREFETCH = int(os.getenv("CONSUMER_PREFETCH", 10)) # Link credit window
+CONSUMER_CREDIT_MODE = os.getenv("CONSUMER_CREDIT_MODE") or None # "auto", "manual" or unset
+CONSUMER_ACK_BATCH_SIZE = int(os.getenv("CONSUMER_ACK_BATCH_SIZE", 1)) # 1 = settle each delivery immediately
+CONSUMER_ACK_BATCH_TIMEOUT_MS = int(os.getenv("CONSUMER_ACK_BATCH_TIMEOUT_MS", 100))
+CONSUMER_PROCESSES = int(os.getenv("CONSUMER_PROCESSES", 1)) # Competing consumer processes
+CONSUMER_RESTART_DELAY = float(os.getenv("CONSUMER_RESTART_DELAY", 2.0)) # Seconds
+CONSUMER_REPORT_INTERVAL = float(os.getenv("CONSUMER_REPORT_INTERVAL", 5.0)) # Seconds
+SIMULATED_PROCESSING_TIME = float(os.getenv("SIMULATED_PROCESSING_TIME", 0.2)) # Seconds per order
+# --- End of order processing configuration ---
+EXIT_CONFIG_ERROR = 2 # Exit status of a supervised consumer with an invalid configuration; not restarted
+startup.mark("config")
+
+class _ReactorCallback:
+    """
+    Adapts a plain callable to the Qpid Proton timer task interface.
+
+    Instances can be passed to `Container.schedule()`; the callable is invoked
+    with the timer event on the reactor thread.
+    """
+    def __init__(self, callback):
+        self.callback = callback
+
+    def on_timer_task(self, event):
+        self.callback(event)
+
+def _ignore_sigint():
+    """
+    Worker process initializer: leaves Ctrl+C handling to the main process.
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+def process_order(order_data):
+    """
+    Processes a decoded order.
+
+    Runs inline on the reactor thread or in a worker thread/process, so it must
+    not touch any Proton object. Any exception raised here releases the message.
+
+    Args:
+        order_data (dict): The decoded order.
+
+    Returns:
+        dict: The processed order.
+    """
+    time.sleep(SIMULATED_PROCESSING_TIME) # Simulate some processing time
+    return order_data
+
+def process_orders(orders):
+    """
+    Processes the orders carried by one message in turn: a single order, or every order of a batch.
+
+    Runs where process_order runs. An exception from any order releases the whole
+    message, so the orders of a released batch are processed again on redelivery.
+
+    Args:
+        orders (list): The decoded orders.
+
+    Returns:
+        list: The processed orders.
+    """
+    return [process_order(order_data) for order_data in orders]
+
+def write_to_sink(sink, orders):
+    """
+    Writes a micro-batch of orders to the sink. Runs in the sink writer thread.
+
+    Args:
+        sink: The sink (see order_sinks.py).
+        orders (list): The orders of the batch.
+
+    Returns:
+        float: The seconds the write took.
+    """
+    started = time.perf_counter()
+    sink.write(orders)
+    return time.perf_counter() - started
+
 class OrderConsumer(MessagingHandler):
     """
     A Qpid Proton MessagingHandler for consuming order messages from RabbitMQ.
@@ -51,19 +191,115 @@ class OrderConsumer(MessagingHandler):
     This class handles AMQP 1.0 events to establish an mTLS connection,
     create a receiver link, process incoming messages, and manage errors.
     """
-    def __init__(self, server_url, source_address):
+    def __init__(self, server_url, source_address, workers=0, worker_mode="thread", prefetch=10,
+                 credit_mode=None, ack_batch_size=1, ack_batch_timeout_ms=100, metrics=False,
+                 metrics_port_offset=0, dedup=None, sink=None, sink_batch_size=500, sink_batch_timeout_ms=50,
+                 startup=None):
         """
         Initializes the OrderConsumer.
 
+        Deliveries are always settled explicitly once their outcome is known.
+        With workers, each decoded order is handed off to a thread or process pool
+        and its delivery is settled back on the reactor thread through an EventInjector,
+        so an order is only accepted after it has been processed (at-least-once).
+        A batch message is handed off as one task and accepted once all its orders are processed.
+
+        Outcomes can be settled in batches: they are held until `ack_batch_size`
+        are pending or `ack_batch_timeout_ms` has elapsed, then settled together,
+        trading acknowledgement latency for fewer disposition frames.
+
+        With a deduplication cache, orders already processed are dropped before
+        processing and a message left with no orders is accepted straight away.
+        The keys of processed orders are remembered once they succeed, and
+        persisted before their deliveries are settled.
+
+        With a sink, the orders of successive messages are buffered into micro-batches
+        of up to `sink_batch_size` orders, or those received within `sink_batch_timeout_ms`,
+        and each batch is written to the sink by a dedicated writer thread while the next
+        one fills. The messages of a batch are accepted once the sink has committed it and
+        released if the write fails.
+
         Args:
             server_url (str): The AMQP connection URL (e.g., "amqps://host:port").
             source_address (str): The AMQP source node address (e.g., "/queues/my_queue").
+            workers (int): Number of pool workers; 0 processes orders inline on the reactor thread.
+            worker_mode (str): "thread" or "process", the type of worker pool.
+            prefetch (int): The link credit window.
+            credit_mode (str): "auto" to top credit up as messages arrive, "manual" to
+                replenish it only when deliveries are settled. Defaults to "manual" with
+                workers (bounding the orders in flight) and "auto" otherwise.
+            ack_batch_size (int): Number of outcomes settled together; 1 settles immediately.
+            ack_batch_timeout_ms (int): Maximum time, in milliseconds, an outcome waits for its batch.
+            metrics (bool): If True, collect ConsumerMetrics and start the exporters
+                configured in the environment.
+            metrics_port_offset (int): Added to METRICS_PORT for this consumer's endpoint.
+            dedup (order_dedup.DedupCache): Skips orders already processed; None disables deduplication.
+            sink: Writes micro-batches of orders (see order_sinks.py); None processes orders one by one.
+                Cannot be combined with workers.
+            sink_batch_size (int): Maximum orders per sink batch.
+            sink_batch_timeout_ms (float): Maximum time, in milliseconds, an order waits for its batch to fill.
+            startup (startup_profile.StartupProfile): If set, the SSL domain and connect phases
+                are recorded into it, and it is reported once the first message is received.
         """
-        super(OrderConsumer, self).__init__()
+        if worker_mode not in ("thread", "process"):
+            raise ValueError(f"Unsupported worker mode '{worker_mode}', expected 'thread' or 'process'")
+        if sink is not None and workers:
+            raise ValueError("A sink writes orders in batches and cannot be combined with workers")
+        if credit_mode is None:
+            credit_mode = "manual" if workers or sink is not None else "auto"
+        if credit_mode not in ("auto", "manual"):
+            raise ValueError(f"Unsupported credit mode '{credit_mode}', expected 'auto' or 'manual'")
+        # In manual mode credit is granted in on_start and replenished in _settle_batch,
+        # so MessagingHandler must not install its automatic flow controller
+        super(OrderConsumer, self).__init__(prefetch=prefetch if credit_mode == "auto" else 0, auto_accept=False)
         self.server_url = server_url
         self.source_address = source_address
+        self.workers = workers
+        self.worker_mode = worker_mode
+        self.prefetch = prefetch
+        self.credit_mode = credit_mode
+        self.ack_batch_size = max(1, ack_batch_size)
+        self.ack_batch_timeout_ms = ack_batch_timeout_ms
         self.receiver = None
         self.received_count = 0
+        self._delivery_bytes = 0 # Encoded size of the message being received, for the metrics
+        self.orders_received = 0 # Equal to received_count unless messages carry batches of orders
+        self.accepted_count = 0
+        self.rejected_count = 0
+        self.released_count = 0
+        self.failed = False # Set when the connection ends because of an error
+        self.executor = None
+        self.injector = None
+        self.container = None
+        self.pending_settlements = [] # (delivery, state) pairs waiting for their batch
+        self.dedup = dedup
+        self.dedup_keys = {} # delivery -> keys of the orders handed off to a worker
+        self.sink = sink
+        self.sink_batch_size = max(1, sink_batch_size)
+        self.sink_batch_timeout_ms = sink_batch_timeout_ms
+        self.sink_executor = None # Single writer thread, so batches are committed in order
+        self.sink_entries = [] # (delivery, dedup keys) of the messages in the batch being filled
+        self.sink_orders = [] # Orders of the batch being filled
+        self._sink_task = None
+        self.batches_written = 0
+        self.orders_written = 0
+        self.sink_failures = 0
+        self._flush_task = None
+        self.tls_context = None
+        self.startup = startup # Cleared once the first message is received
+        self.metrics = ConsumerMetrics(self) if metrics else None
+        self.metrics_port_offset = metrics_port_offset
+        self.metrics_server = None
+        self.metrics_writer = None
+        self.log_summary = LogSummary(log, self._summary_counters, message_log)
+
+    def _summary_counters(self):
+        counters = {"received": self.received_count, "accepted": self.accepted_count, "orders": self.orders_received}
+        if self.dedup:
+            counters["duplicates"] = self.dedup.hits
+        if self.sink is not None:
+            counters["stored"] = self.orders_written
+        return counters
 
     def on_start(self, event):
         """
@@ -76,53 +312,99 @@ class OrderConsumer(MessagingHandler):
         Args:
             event: The Qpid Proton event object.
         """
-        print(f"Consumer: Starting, connecting to {self.server_url}, source: {self.source_address}")
+        log.info(f"Starting, connecting to {self.server_url}, source: {self.source_address}")
+        self.container = event.container
+        if self.metrics:
+            self.metrics_server, self.metrics_writer = start_exporters(self.metrics.registry, event.container,
+                                                                       self.metrics_port_offset)
+        self.log_summary.start(event.container)
 
-        ssl_domain = SSLDomain(SSLDomain.MODE_CLIENT)
         try:
-            ssl_domain.set_peer_authentication(SSLDomain.VERIFY_PEER_NAME)
-            ssl_domain.set_trusted_ca_db(CA_CERT_PATH)
-            ssl_domain.set_credentials(
+            # Credentials are loaded once per process and shared by every connection
+            self.tls_context = get_tls_context(
+                CA_CERT_PATH,
                 CONSUMER_CLIENT_CERT_PATH,
                 CONSUMER_CLIENT_KEY_PATH,
                 None # Key password, if needed
             )
-            print("Consumer: SSL domain configured successfully.")
+            log.info("SSL domain configured successfully.")
+            if self.startup:
+                self.startup.mark("ssl")
         except Exception as e:
-            print(f"Consumer: Error during SSL domain configuration: {e}")
+            log.error(f"Error during SSL domain configuration: {e}")
             event.container.stop()
             return
 
-        print(f"Consumer: Attempting mTLS connection to {self.server_url} with user {CONSUMER_USER} on vhost {VHOST}")
-        conn = event.container.connect(
-            url=self.server_url,
+        if self.workers:
+            self.injector = EventInjector()
+            event.container.selectable(self.injector)
+            if self.worker_mode == "thread":
+                self.executor = ThreadPoolExecutor(max_workers=self.workers)
+            else:
+                from concurrent.futures import ProcessPoolExecutor # Imported here: only process workers need multiprocessing
+                self.executor = ProcessPoolExecutor(max_workers=self.workers, initializer=_ignore_sigint)
+            log.info(f"Started {self.workers} {self.worker_mode} worker(s)")
+        if self.sink is not None:
+            self.injector = EventInjector()
+            event.container.selectable(self.injector)
+            self.sink_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sink-writer")
+            log.info(f"Writing orders to {self.sink!r} in batches of up to {self.sink_batch_size} orders "
+                     f"/ {self.sink_batch_timeout_ms:g} ms")
+            if self.credit_mode == "manual" and self.prefetch < self.sink_batch_size:
+                log.info(f"Credit window {self.prefetch} is below the sink batch size: batches of single-order "
+                         f"messages are closed by their timeout")
+
+        log.info(f"Attempting mTLS connection to {self.server_url} with user {CONSUMER_USER} on vhost {VHOST}")
+        conn = self.tls_context.connect(
+            event.container,
+            self.server_url,
             user=CONSUMER_USER,
             password=CONSUMER_PASSWORD,
             virtual_host=VHOST,
             sni=RABBITMQ_HOST,
-            ssl_domain=ssl_domain,
             allow_insecure_mechs=False,
-            allowed_mechs="PLAIN"
+            allowed_mechs=SASL_MECHANISMS
         )
         if conn:
-            print(f"Consumer: mTLS connection initiated, vhost set to {VHOST}")
+            log.info(f"mTLS connection initiated, vhost set to {VHOST}")
             self.receiver = event.container.create_receiver(conn, self.source_address)
             if self.receiver:
-                print(f"Consumer: Receiver created for source '{self.source_address}'")
+                log.info(f"Receiver created for source '{self.source_address}'")
+                log.info(f"Credit window {self.prefetch} ({self.credit_mode}), "
+                      f"settlement batch {self.ack_batch_size} / {self.ack_batch_timeout_ms} ms")
+                if self.credit_mode == "manual":
+                    self.receiver.flow(self.prefetch) # Initial credit, replenished on settlement
             else:
-                print(f"Consumer: Error: create_receiver() returned None for source '{self.source_address}'. Verify that the source exists and is accessible.")
+                log.error(f"create_receiver() returned None for source '{self.source_address}'. Verify that the source exists and is accessible.")
                 if conn: conn.close()
+                self.close_workers()
                 event.container.stop()
         else:
-            print("Consumer: Error: connect() returned None.")
+            log.error("connect() returned None.")
+            self.close_workers()
             event.container.stop()
 
+    def on_delivery(self, event):
+        """
+        Called for every delivery update, before Proton reads the message and calls on_message.
+
+        Records the size of a complete incoming message while it is still pending on
+        the link, so the metrics count its bytes without encoding it again.
+
+        Args:
+            event: The Qpid Proton event object.
+        """
+        delivery = event.delivery
+        if self.metrics and delivery.link.is_receiver and delivery.readable and not delivery.partial:
+            self._delivery_bytes = delivery.pending
+
     def on_message(self, event):
         """
         Called when a message is received on the receiver link.
 
-        Processes the incoming message, decodes its JSON body,
-        and accepts, rejects, or releases the message based on processing outcome.
+        Decodes the body with the codec matching its content type and processes the order
+        (or every order of a batch), either inline or by handing it off to the worker pool.
+        The message is accepted, rejected, or released based on the processing outcome.
 
         Args:
             event: The Qpid Proton event object containing the message.
@@ -131,27 +413,299 @@ class OrderConsumer(MessagingHandler):
             message = event.message
             delivery = event.delivery
             self.received_count += 1
-            print("-" * 20)
-            print(f"Consumer: New message received! (Total: {self.received_count})")
+            if self.startup:
+                self.startup.finish("receive", log)
+                self.startup = None
+            if self.metrics:
+                self.metrics.message_received(message, self._delivery_bytes)
+                if self.credit_mode == "manual" and not self.receiver.credit:
+                    self.metrics.credit_exhausted(self.receiver)
             try:
-                message_body_str = message.body
-                if isinstance(message_body_str, bytes):
-                    message_body_str = message_body_str.decode('utf-8')
-                order_data = json.loads(message_body_str)
-                print(f"Consumer: Content: {order_data}")
-                time.sleep(0.2) # Simulate some processing time
-                print("Consumer: Order processed.")
-                delivery.update(Delivery.ACCEPTED)
-                print("Consumer: Message confirmed (accepted).")
-            except json.JSONDecodeError:
-                print(f"Consumer: JSON Error: {message.body}")
-                delivery.update(Delivery.REJECTED)
-                print("Consumer: Message rejected.")
+                orders = decode_orders(message)
+                self.orders_received += len(orders)
+                if len(orders) == 1:
+                    message_log.info("New message received! (Total: %d): %s", self.received_count, orders[0])
+                else:
+                    message_log.info("New message received! (Total: %d): batch of %d orders", self.received_count, len(orders))
+                keys = ()
+                if self.dedup:
+                    fresh, keys = self.dedup.filter(message, orders)
+                    if not fresh:
+                        message_log.info("Duplicate message, already processed: accepted without processing.")
+                        self._settle(delivery, Delivery.ACCEPTED)
+                        return
+                    if len(fresh) < len(orders):
+                        message_log.info("Skipping %d order(s) already processed.", len(orders) - len(fresh))
+                    orders = fresh
+                if self.sink is not None:
+                    self._buffer_orders(delivery, orders, keys)
+                elif self.executor:
+                    if keys:
+                        self.dedup_keys[delivery] = keys
+                    future = self.executor.submit(process_orders, orders)
+                    future.add_done_callback(lambda f, d=delivery: self._order_done(f, d))
+                    message_log.debug("Order handed off to a worker.")
+                else:
+                    process_orders(orders)
+                    if keys:
+                        self.dedup.add(keys)
+                    self._settle(delivery, Delivery.ACCEPTED)
+                    message_log.debug("Order processed, message confirmed (accepted).")
+            except PayloadError as e:
+                message_log.warning("Payload error, message rejected: %s: %r", e, message.body)
+                self._settle(delivery, Delivery.REJECTED)
             except Exception as e:
-                print(f"Consumer: Processing error: {e}")
-                delivery.update(Delivery.RELEASED)
-                print("Consumer: Message released.")
-            print("-" * 20)
+                message_log.warning("Processing error, message released: %s", e)
+                self._settle(delivery, Delivery.RELEASED)
+
+    def _order_done(self, future, delivery):
+        """
+        Runs in the worker thread: hands a processed order back to the reactor thread.
+        """
+        injector = self.injector
+        try:
+            if injector: # None once the consumer is shutting down
+                injector.trigger(ApplicationEvent("order_processed", delivery=delivery, subject=future))
+                return
+        except OSError:
+            pass # Closed by the reactor thread in the meantime
+        log.info("An order finished processing after shutdown; the broker redelivers its message.")
+
+    def on_order_processed(self, event):
+        """
+        Called on the reactor thread when a worker has finished processing an order.
+
+        Accepts the delivery if processing succeeded and releases it otherwise.
+        If the receiver is no longer open, the delivery is left alone: the broker
+        redelivers it once the link is gone.
+
+        Args:
+            event: The ApplicationEvent carrying the delivery and the worker's future as subject.
+        """
+        delivery = event.delivery
+        future = event.subject
+        keys = self.dedup_keys.pop(delivery, None)
+        if not self.receiver or not self.receiver.state & Endpoint.LOCAL_ACTIVE:
+            return
+        error = future.exception() if not future.cancelled() else "cancelled"
+        if error is None:
+            if keys:
+                self.dedup.add(keys)
+            self._settle(delivery, Delivery.ACCEPTED)
+            message_log.debug("Order processed by worker, message confirmed (accepted).")
+        else:
+            message_log.warning("Worker processing error, message released: %s", error)
+            self._settle(delivery, Delivery.RELEASED)
+
+    def _buffer_orders(self, delivery, orders, keys):
+        """
+        Adds the orders of a message to the sink batch being filled, and hands the batch
+        to the writer thread once it is full; otherwise a timer does after `sink_batch_timeout_ms`.
+
+        Args:
+            delivery: The Qpid Proton delivery of the message.
+            orders (list): The orders to write.
+            keys (list): Their deduplication keys, remembered once the batch is committed.
+        """
+        self.sink_entries.append((delivery, keys))
+        self.sink_orders.extend(orders)
+        if len(self.sink_orders) >= self.sink_batch_size:
+            self._write_batch()
+        elif self._sink_task is None:
+            self._sink_task = self.container.schedule(
+                self.sink_batch_timeout_ms / 1000.0, _ReactorCallback(self._on_sink_timer)
+            )
+
+    def _on_sink_timer(self, event):
+        """
+        Timer callback that writes a sink batch which did not fill up in time.
+
+        Args:
+            event: The Qpid Proton timer event object.
+        """
+        self._sink_task = None
+        self._write_batch()
+
+    def _write_batch(self):
+        """
+        Hands the batch being filled to the sink writer thread; the outcome comes back as a batch_written event.
+        """
+        if self._sink_task is not None:
+            self._sink_task.cancel()
+            self._sink_task = None
+        entries, orders = self.sink_entries, self.sink_orders
+        self.sink_entries, self.sink_orders = [], []
+        if not entries or not self.sink_executor:
+            return
+        future = self.sink_executor.submit(write_to_sink, self.sink, orders)
+        future.add_done_callback(lambda f, e=entries, n=len(orders): self._batch_done(f, e, n))
+        message_log.debug("Batch of %d order(s) from %d message(s) handed to the sink.", len(orders), len(entries))
+
+    def _batch_done(self, future, entries, orders):
+        """
+        Runs in the sink writer thread: hands a finished write back to the reactor thread.
+        """
+        injector = self.injector
+        try:
+            if injector: # None once the consumer is shutting down
+                injector.trigger(ApplicationEvent("batch_written", subject=(future, entries, orders)))
+                return
+        except OSError:
+            pass # Closed by the reactor thread in the meantime
+        log.info(f"A batch of {orders} order(s) was written after shutdown; the broker redelivers its messages.")
+
+    def on_batch_written(self, event):
+        """
+        Called on the reactor thread when the sink has written a batch.
+
+        Accepts the messages of the batch if the write succeeded and releases them otherwise.
+        If the receiver is no longer open, they are left alone: the broker redelivers them.
+
+        Args:
+            event: The ApplicationEvent carrying (future, (delivery, keys) entries, order count) as subject.
+        """
+        future, entries, orders = event.subject
+        error = future.exception() if not future.cancelled() else "cancelled"
+        if error is None:
+            self.batches_written += 1
+            self.orders_written += orders
+            if self.metrics:
+                self.metrics.sink_batch_written(future.result())
+            if self.dedup:
+                for _, keys in entries:
+                    if keys:
+                        self.dedup.add(keys)
+        else:
+            self.sink_failures += 1
+            message_log.warning("Sink error, %d message(s) released: %s", len(entries), error)
+        if not self.receiver or not self.receiver.state & Endpoint.LOCAL_ACTIVE:
+            return
+        state = Delivery.ACCEPTED if error is None else Delivery.RELEASED
+        for delivery, _ in entries:
+            self._settle(delivery, state)
+        message_log.debug("Batch of %d order(s) written, %d message(s) settled.", orders, len(entries))
+
+    def _settle(self, delivery, state):
+        """
+        Records the outcome of a delivery and settles it, alone or as part of a batch.
+
+        The batch is flushed when it reaches `ack_batch_size` outcomes; otherwise a
+        timer flushes it after `ack_batch_timeout_ms`.
+
+        Args:
+            delivery: The Qpid Proton delivery to settle.
+            state: The terminal delivery state (e.g., Delivery.ACCEPTED).
+        """
+        self.pending_settlements.append((delivery, state))
+        if len(self.pending_settlements) >= self.ack_batch_size:
+            self.flush_settlements()
+        elif self._flush_task is None and self.container:
+            self._flush_task = self.container.schedule(
+                self.ack_batch_timeout_ms / 1000.0, _ReactorCallback(self._on_flush_timer)
+            )
+
+    def _on_flush_timer(self, event):
+        """
+        Timer callback that settles a batch which did not fill up in time.
+
+        Args:
+            event: The Qpid Proton timer event object.
+        """
+        self._flush_task = None
+        self.flush_settlements()
+
+    def flush_settlements(self):
+        """
+        Settles all pending outcomes and, in manual credit mode, grants the same amount of credit back.
+
+        The deduplication keys of the processed orders are persisted first, so
+        that an order the broker no longer redelivers is known after a restart.
+        """
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        batch, self.pending_settlements = self.pending_settlements, []
+        if not batch or not self.receiver or not self.receiver.state & Endpoint.LOCAL_ACTIVE:
+            return # Unsettled deliveries of a closed link are redelivered by the broker
+        if self.dedup:
+            self.dedup.commit()
+        for delivery, state in batch:
+            self.settle(delivery, state)
+            if state == Delivery.ACCEPTED:
+                self.accepted_count += 1
+            elif state == Delivery.REJECTED:
+                self.rejected_count += 1
+            else:
+                self.released_count += 1
+        if self.credit_mode == "manual":
+            self.receiver.flow(len(batch))
+            if self.metrics:
+                self.metrics.credit_available(self.receiver)
+        if self.ack_batch_size > 1:
+            message_log.debug("Settled a batch of %d delivery(ies).", len(batch))
+
+    def stats(self):
+        """
+        Returns a snapshot of the delivery counters.
+
+        Returns:
+            dict: The received, accepted, rejected and released message counts, the orders
+                received, the duplicates skipped and the orders stored by the sink.
+        """
+        return {
+            "received": self.received_count,
+            "orders": self.orders_received,
+            "accepted": self.accepted_count,
+            "rejected": self.rejected_count,
+            "released": self.released_count,
+            "duplicates": self.dedup.hits if self.dedup else 0,
+            "stored": self.orders_written
+        }
+
+    def close_sink(self):
+        """
+        Waits for the batch being written, if any, and closes the sink. The batch being
+        filled is dropped: its messages are unsettled and redelivered by the broker.
+        """
+        if self._sink_task is not None:
+            self._sink_task.cancel()
+            self._sink_task = None
+        self.sink_entries, self.sink_orders = [], []
+        if self.sink_executor:
+            self.sink_executor.shutdown(wait=True, cancel_futures=True)
+            self.sink_executor = None
+        if self.sink is not None:
+            self.sink.close()
+
+    def close_dedup(self):
+        """
+        Persists the pending deduplication keys and closes the cache's database, if any.
+        """
+        if self.dedup:
+            self.dedup.close()
+
+    def close_metrics(self):
+        """
+        Cancels the periodic JSON snapshot, if any, and writes a final one.
+        """
+        if self.metrics_writer:
+            self.metrics_writer.stop()
+            self.metrics_writer.write()
+            self.metrics_writer = None
+
+    def close_workers(self):
+        """
+        Shuts down the worker pool and the event injector, if any.
+
+        Orders still queued are cancelled; their deliveries stay unsettled
+        and are redelivered by the broker once the connection is gone.
+        """
+        if self.executor:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+        if self.injector:
+            self.injector.close()
+            self.injector = None
 
     def on_disconnected(self, event):
         """
@@ -163,10 +717,28 @@ class OrderConsumer(MessagingHandler):
         Args:
             event: The Qpid Proton event object.
         """
-        print(f"Consumer: Disconnected from {self.server_url}")
-        print("Consumer: Attempting to stop the container.")
+        log.warning(f"Disconnected from {self.server_url}, stopping the container.")
+        self.failed = True
+        self.close_workers()
         event.container.stop()
 
+    def on_connection_opened(self, event):
+        """
+        Called when the broker has opened the AMQP connection.
+
+        Reports how long the TLS handshake and AMQP open took and whether
+        the TLS session was resumed.
+
+        Args:
+            event: The Qpid Proton event object.
+        """
+        if self.startup:
+            self.startup.mark("connect")
+        handshake = self.tls_context.handshake_completed(event.connection) if self.tls_context else None
+        if handshake:
+            latency, resume_status = handshake
+            log.info(f"mTLS connection established in {latency * 1000:.1f} ms (TLS session: {resume_status})")
+
     def on_transport_error(self, event):
         """
         Called when a transport-level error occurs (e.g., SSL/TLS handshake failure).
@@ -177,8 +749,12 @@ class OrderConsumer(MessagingHandler):
             event: The Qpid Proton event object.
         """
         condition = event.transport.condition
-        print(f"Consumer: Transport error (mTLS?): {condition if condition else 'N/A'}")
+        log.error(f"Transport error (mTLS?): {condition if condition else 'N/A'}")
+        if self.tls_context and event.connection:
+            self.tls_context.handshake_failed(event.connection, condition)
+        self.failed = True
         if event.connection: event.connection.close()
+        self.close_workers()
         event.container.stop()
 
     def on_connection_error(self, event):
@@ -191,8 +767,10 @@ class OrderConsumer(MessagingHandler):
             event: The Qpid Proton event object.
         """
         condition = event.connection.remote_condition if event.connection else None
-        print(f"Consumer: AMQP connection error (mTLS?): {condition if condition else 'N/A'}")
+        log.error(f"AMQP connection error (mTLS?): {condition if condition else 'N/A'}")
+        self.failed = True
         if event.connection: event.connection.close()
+        self.close_workers()
         event.container.stop()
 
     def on_link_error(self, event):
@@ -207,33 +785,264 @@ class OrderConsumer(MessagingHandler):
         condition = None
         if event.receiver and event.receiver.remote_condition:
             condition = event.receiver.remote_condition
-        print(f"Consumer: AMQP link error (receiver): {condition if condition else 'N/A'}")
+        log.error(f"AMQP link error (receiver): {condition if condition else 'N/A'}")
+        self.failed = True
         if event.connection: event.connection.close()
+        self.close_workers()
         event.container.stop()
 
+def create_order_consumer(metrics_port_offset=0):
+    """
+    Creates an OrderConsumer configured from the environment.
+
+    Args:
+        metrics_port_offset (int): Added to METRICS_PORT for this consumer's metrics endpoint,
+            and substituted for "{consumer}" in DEDUP_DB_PATH and SINK_SQLITE_PATH.
+
+    Returns:
+        OrderConsumer: The configured handler.
+    """
+    return OrderConsumer(CONNECTION_URL, SOURCE_NODE, workers=CONSUMER_WORKERS,
+                         worker_mode=CONSUMER_WORKER_MODE, prefetch=CONSUMER_PREFETCH,
+                         credit_mode=CONSUMER_CREDIT_MODE, ack_batch_size=CONSUMER_ACK_BATCH_SIZE,
+                         ack_batch_timeout_ms=CONSUMER_ACK_BATCH_TIMEOUT_MS, metrics=metrics_enabled(),
+                         metrics_port_offset=metrics_port_offset,
+                         dedup=create_dedup_cache(metrics_port_offset), sink=create_sink(metrics_port_offset),
+                         sink_batch_size=SINK_BATCH_SIZE, sink_batch_timeout_ms=SINK_BATCH_TIMEOUT_MS,
+                         startup=startup)
+
 def receive_order_messages_proton():
     """
     Sets up and runs the Qpid Proton container for the OrderConsumer.
 
     Initializes the OrderConsumer handler and starts the Proton reactor.
     Handles KeyboardInterrupt for graceful shutdown and other exceptions.
+    An invalid configuration is logged and nothing is started.
     """
-    handler = OrderConsumer(CONNECTION_URL, SOURCE_NODE)
+    try:
+        handler = create_order_consumer()
+    except ValueError as e:
+        log.error("%s", e)
+        return
     container = Container(handler)
     try:
-        print("Consumer: Starting container to receive messages (Ctrl+C to interrupt)...")
+        log.info("Starting container to receive messages (Ctrl+C to interrupt)...")
+        startup.mark("setup")
         container.run()
     except KeyboardInterrupt:
-        print("\nConsumer: Reception interrupted by user.")
+        log.info("Reception interrupted by user.")
         # The on_disconnected handler should be called, which will stop the container.
         # If not, ensure the container is stopped.
         container.stop()
     except Exception as e:
-        print(f"Consumer: Critical error: {e}")
-        import traceback
-        traceback.print_exc()
+        log.exception(f"Critical error: {e}")
     finally:
-        print("Consumer: Container execution finished.")
+        handler.close_workers()
+        handler.close_sink()
+        handler.close_dedup()
+        handler.close_metrics()
+        if handler.sink is not None:
+            average = handler.orders_written / handler.batches_written if handler.batches_written else 0
+            log.info(f"Sink: {handler.orders_written} order(s) stored in {handler.batches_written} batch(es) "
+                  f"({average:.1f} orders per batch), {handler.sink_failures} failed batch(es)")
+        if handler.dedup:
+            dedup = handler.dedup.stats()
+            hit_rate = f"{dedup['hit_rate'] * 100:.1f}%" if dedup["hit_rate"] is not None else "n/a"
+            log.info(f"Deduplication: {dedup['hits']} duplicate(s), {dedup['misses']} new "
+                  f"(hit rate {hit_rate}), {dedup['entries']} key(s) cached")
+        if handler.metrics:
+            latency = handler.metrics.end_to_end.summary()
+            if latency["count"]:
+                log.info(f"End-to-end latency: p50 {latency['p50'] * 1000:.2f} ms, "
+                      f"p99 {latency['p99'] * 1000:.2f} ms, max {latency['max'] * 1000:.2f} ms")
+            line = f"Bytes received {handler.metrics.bytes_received.value}"
+            if handler.metrics.stalls is not None: # Manual credit mode only
+                line += (f", credit stalls {handler.metrics.stalls.value} "
+                         f"({handler.metrics.stall_seconds.value:.3f}s without credit)")
+            log.info(line)
+        log.info("Container execution finished.")
+
+def _run_consumer_process(worker_index, stats_queue, report_interval):
+    """
+    Runs one supervised consumer. Executed in a child process of ConsumerSupervisor.
+
+    Counter snapshots are put on `stats_queue` every `report_interval` seconds and
+    when the consumer stops. The process exits with status 1 if the connection
+    ended because of an error, so that the supervisor restarts it, and with
+    EXIT_CONFIG_ERROR if the configuration is invalid, which a restart cannot fix.
+
+    Args:
+        worker_index (int): The index of this consumer in the supervisor.
+        stats_queue (multiprocessing.Queue): Queue receiving (worker_index, stats) tuples.
+        report_interval (float): Seconds between counter snapshots.
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN) # Ctrl+C is handled by the supervisor
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    configure_logging(force=True) # The parent's log writer thread does not exist in this process
+    startup.restart() # The imports and configuration happened in the parent
+    try:
+        handler = create_order_consumer(metrics_port_offset=worker_index)
+    except ValueError as e:
+        log.error(f"Consumer {worker_index}: {e}")
+        flush_logging()
+        sys.exit(EXIT_CONFIG_ERROR)
+    container = Container(handler)
+
+    def report(event):
+        stats_queue.put((worker_index, handler.stats()))
+        container.schedule(report_interval, _ReactorCallback(report))
+
+    container.schedule(report_interval, _ReactorCallback(report))
+    try:
+        startup.mark("setup")
+        container.run()
+    except Exception as e:
+        log.exception(f"Consumer {worker_index}: Critical error: {e}")
+        handler.failed = True
+    finally:
+        handler.close_workers()
+        handler.close_sink()
+        handler.close_dedup()
+        handler.close_metrics()
+        stats_queue.put((worker_index, handler.stats()))
+        flush_logging() # Child processes exit without running atexit handlers
+    sys.exit(1 if handler.failed else 0)
+
+class ConsumerSupervisor:
+    """
+    Runs several competing OrderConsumer processes against the same source node.
+
+    Each process has its own connection, receiver link and credit window, so the
+    queue drain rate scales horizontally. Consumers that stop because of a transport,
+    connection or link error are restarted after a delay; those with an invalid
+    configuration are not. Per-consumer and aggregate
+    received/accepted/rejected/released counters are reported periodically.
+    """
+    def __init__(self, processes, restart_delay=2.0, report_interval=5.0):
+        """
+        Initializes the ConsumerSupervisor.
+
+        Args:
+            processes (int): The number of consumer processes.
+            restart_delay (float): Seconds to wait before restarting a failed consumer.
+            report_interval (float): Seconds between counter reports.
+        """
+        self.processes = processes
+        self.restart_delay = restart_delay
+        self.report_interval = report_interval
+        import multiprocessing # Imported here: a single consumer does not need it
+        self.context = multiprocessing.get_context()
+        self.stats_queue = self.context.Queue()
+        self.workers = {} # worker index -> running multiprocessing.Process
+        self.restart_at = {} # worker index -> time at which it is restarted
+        self.finished_totals = {index: Counter() for index in range(processes)} # Counters of previous runs
+        self.current_stats = {index: Counter() for index in range(processes)} # Counters of the current run
+        self.restarts = Counter()
+
+    def _start_worker(self, index):
+        process = self.context.Process(
+            target=_run_consumer_process, args=(index, self.stats_queue, self.report_interval),
+            name=f"order-consumer-{index}"
+        )
+        process.start()
+        self.workers[index] = process
+        supervisor_log.info(f"Started consumer {index} (pid {process.pid})")
+
+    def _drain_stats(self, timeout=0):
+        """
+        Collects pending counter snapshots, waiting up to `timeout` seconds for the first one.
+        """
+        try:
+            while True:
+                index, stats = self.stats_queue.get(timeout=timeout)
+                self.current_stats[index] = Counter(stats)
+                timeout = 0
+        except queue.Empty:
+            pass
+
+    def _reap_workers(self):
+        """
+        Detects stopped consumers and schedules a restart for those that failed.
+        """
+        for index, process in list(self.workers.items()):
+            if process.is_alive():
+                continue
+            process.join()
+            self._drain_stats()
+            del self.workers[index]
+            self.finished_totals[index] += self.current_stats[index]
+            self.current_stats[index] = Counter()
+            if process.exitcode == 0:
+                supervisor_log.info(f"Consumer {index} stopped.")
+            elif process.exitcode == EXIT_CONFIG_ERROR:
+                supervisor_log.error(f"Consumer {index} has an invalid configuration, not restarting it.")
+            else:
+                supervisor_log.warning(f"Consumer {index} failed (exit code {process.exitcode}), "
+                      f"restarting in {self.restart_delay}s.")
+                self.restart_at[index] = time.monotonic() + self.restart_delay
+
+    def _restart_due_workers(self):
+        now = time.monotonic()
+        for index, restart_time in list(self.restart_at.items()):
+            if now >= restart_time:
+                del self.restart_at[index]
+                self.restarts[index] += 1
+                self._start_worker(index)
+
+    def totals(self):
+        """
+        Returns the counters of each consumer, including previous runs of restarted consumers.
+
+        Returns:
+            dict: worker index -> Counter of received/accepted/rejected/released.
+        """
+        return {index: self.finished_totals[index] + self.current_stats[index] for index in range(self.processes)}
+
+    def report(self):
+        """
+        Logs the per-consumer and aggregate counters.
+        """
+        aggregate = Counter()
+        for index, stats in self.totals().items():
+            aggregate += stats
+            supervisor_log.info(f"Consumer {index}: received {stats['received']}, accepted {stats['accepted']}, "
+                  f"rejected {stats['rejected']}, released {stats['released']} (restarts: {self.restarts[index]})")
+        supervisor_log.info(f"Aggregate: received {aggregate['received']}, accepted {aggregate['accepted']}, "
+              f"rejected {aggregate['rejected']}, released {aggregate['released']}"
+              + (f", duplicates skipped {aggregate['duplicates']}" if aggregate["duplicates"] else ""))
+
+    def run(self):
+        """
+        Starts the consumers and supervises them until all have stopped or Ctrl+C is pressed.
+        """
+        supervisor_log.info(f"Starting {self.processes} consumer(s) on '{SOURCE_NODE}' (Ctrl+C to interrupt)...")
+        for index in range(self.processes):
+            self._start_worker(index)
+        next_report = time.monotonic() + self.report_interval
+        try:
+            while self.workers or self.restart_at:
+                self._drain_stats(timeout=0.5)
+                self._reap_workers()
+                self._restart_due_workers()
+                if time.monotonic() >= next_report:
+                    self.report()
+                    next_report = time.monotonic() + self.report_interval
+        except KeyboardInterrupt:
+            supervisor_log.info("Interrupted by user, stopping consumers...")
+            for process in self.workers.values():
+                process.terminate()
+            for process in self.workers.values():
+                process.join()
+            self._drain_stats()
+        finally:
+            self.report()
+            supervisor_log.info("Finished.")
 
 if __name__ == "__main__":
-    receive_order_messages_proton()
\ No newline at end of file
+    configure_logging()
+    if not defer_default_ssl_domains():
+        log.warning("Cannot defer Proton's default SSL domains, containers create them up front")
+    if CONSUMER_PROCESSES > 1:
+        ConsumerSupervisor(CONSUMER_PROCESSES, CONSUMER_RESTART_DELAY, CONSUMER_REPORT_INTERVAL).run()
+    else:
+        receive_order_messages_proton()
\ No newline at end of file
@@ -0,0 +1,249 @@
+"""
+Local AMQP 1.0 stand-in broker for benchmarks and tests without RabbitMQ.
+
+A minimal Qpid Proton broker listening with mTLS on localhost. It understands
+just enough of the RabbitMQ AMQP 1.0 address model for the producer and
+consumer: messages sent to an exchange address are routed to the queue bound
+to it (BINDINGS), messages sent to any other address are queued under that
+address, and receivers attached to a queue address get its messages in order,
+shared round-robin by link credit.
+
+Every unsettled incoming message is accepted. Deliveries released or left
+unsettled by a consumer that goes away are put back at the head of their queue;
+rejected ones are dropped. Messages are kept in memory only.
+
+The broker authenticates clients by their certificate (SASL EXTERNAL or
+ANONYMOUS), so run the clients with SASL_MECHANISMS=EXTERNAL. It uses the
+certificates generated by `make certs` (the server certificate is valid for
+localhost). Given an amqp:// URL it listens without TLS instead, for tests that
+put a TLS front end of their own before it.
+
+Run it on its own with:
+
+    python local_broker.py [URL]
+
+where URL defaults to amqps://localhost:5671.
+"""
+import collections
+import multiprocessing
+import os
+import sys
+
+from proton import Delivery, SSLDomain, Url
+from proton.handlers import MessagingHandler
+from proton.reactor import Container
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CERTS_DIR = os.path.join(BASE_DIR, "certs")
+DEFAULT_URL = "amqps://localhost:5671"
+
+# Exchange address -> queue address, as set up by `make rabbitmq-setup-topology`
+BINDINGS = {
+    "/exchanges/order_exchange/new_order_event": "/queues/logistics_queue",
+}
+
+
+class LocalBroker(MessagingHandler):
+    """
+    A Qpid Proton MessagingHandler acting as an in-memory AMQP 1.0 broker.
+
+    Attributes:
+        queues (dict): Queue address -> deque of queued messages.
+        received_count (int): Messages received from producers.
+        delivered_count (int): Messages sent to consumers (including redeliveries).
+    """
+    def __init__(self, url=DEFAULT_URL, certs_dir=CERTS_DIR, bindings=None, ready=None):
+        """
+        Args:
+            url (str): The amqps URL to listen on.
+            certs_dir (str): Directory with ca.pem, server.pem and server.key.
+            bindings (dict): Exchange address -> queue address (default BINDINGS).
+            ready (multiprocessing.Event): Set once the broker is listening.
+        """
+        super(LocalBroker, self).__init__(auto_accept=False)
+        self.url = url
+        self.certs_dir = certs_dir
+        self.bindings = BINDINGS if bindings is None else bindings
+        self.ready = ready
+        self.queues = collections.defaultdict(collections.deque)
+        self.consumers = collections.defaultdict(list) # Queue address -> sender links
+        self.unsettled = {} # Sender link -> {delivery: message} awaiting the consumer's outcome
+        self.received_count = 0
+        self.delivered_count = 0
+
+    def on_start(self, event):
+        """
+        Loads the server credentials and starts listening, requiring client certificates.
+        An amqp:// URL listens without TLS (clients then authenticate with SASL ANONYMOUS).
+        """
+        if Url(self.url).scheme == "amqp":
+            event.container.listen(self.url)
+            if self.ready is not None:
+                self.ready.set()
+            return
+        ca_cert = os.path.join(self.certs_dir, "ca.pem")
+        domain = SSLDomain(SSLDomain.MODE_SERVER)
+        domain.set_credentials(os.path.join(self.certs_dir, "server.pem"),
+                               os.path.join(self.certs_dir, "server.key"), None)
+        domain.set_trusted_ca_db(ca_cert)
+        domain.set_peer_authentication(SSLDomain.VERIFY_PEER, ca_cert)
+        event.container.listen(self.url, ssl_domain=domain)
+        if self.ready is not None:
+            self.ready.set()
+
+    def on_link_opening(self, event):
+        """
+        Attaches producer links to their target and consumer links to their queue.
+        """
+        link = event.link
+        if link.is_sender:
+            address = link.remote_source.address
+            link.source.address = address
+            self.consumers[address].append(link)
+            self.unsettled[link] = {}
+        else:
+            link.target.address = link.remote_target.address
+
+    def on_message(self, event):
+        """
+        Queues an incoming message on the queue bound to its target and accepts it.
+        """
+        address = event.link.target.address or event.message.address
+        queue_address = self.bindings.get(address, address)
+        self.queues[queue_address].append(event.message)
+        self.received_count += 1
+        if not event.delivery.settled: # Pre-settled messages (settled by the sender) need no outcome
+            self.accept(event.delivery)
+        else:
+            event.delivery.settle()
+        for link in self.consumers[queue_address]:
+            self._deliver(link)
+
+    def on_sendable(self, event):
+        self._deliver(event.link)
+
+    def _deliver(self, link):
+        """
+        Sends queued messages on a consumer link while it has credit.
+
+        Args:
+            link (proton.Sender): The consumer link.
+        """
+        queue = self.queues[link.source.address]
+        unsettled = self.unsettled[link]
+        while link.credit and queue:
+            message = queue.popleft()
+            unsettled[link.send(message)] = message
+            self.delivered_count += 1
+
+    def on_settled(self, event):
+        """
+        Forgets a delivery once the consumer has accepted or rejected it.
+        """
+        self.unsettled.get(event.link, {}).pop(event.delivery, None)
+
+    def on_released(self, event):
+        """
+        Puts a released message back at the head of its queue.
+        """
+        message = self.unsettled.get(event.link, {}).pop(event.delivery, None)
+        if message is not None:
+            self._requeue(event.link, [message])
+
+    def _requeue(self, link, messages):
+        """
+        Puts messages back at the head of the link's queue and delivers them to the remaining consumers.
+
+        Args:
+            link (proton.Sender): The consumer link the messages were sent on.
+            messages (list): The messages, in their original order.
+        """
+        address = link.source.address
+        self.queues[address].extendleft(reversed(messages))
+        for consumer in self.consumers[address]:
+            if consumer is not link:
+                self._deliver(consumer)
+
+    def _detach(self, link):
+        """
+        Removes a consumer link and requeues the messages it had not accepted or rejected.
+
+        An outcome can arrive in the same batch of events as the close, so the
+        remote state is checked as well as the deliveries still being tracked.
+
+        Args:
+            link (proton.Link): The closing link.
+        """
+        unsettled = self.unsettled.pop(link, None)
+        if unsettled is None:
+            return
+        self.consumers[link.source.address].remove(link)
+        outcomes = (Delivery.ACCEPTED, Delivery.REJECTED)
+        self._requeue(link, [message for delivery, message in unsettled.items() if delivery.remote_state not in outcomes])
+
+    def on_link_closing(self, event):
+        self._detach(event.link)
+
+    def _close_connection(self, connection):
+        for link in [link for link in self.unsettled if link.connection == connection]:
+            self._detach(link)
+
+    def on_connection_closing(self, event):
+        self._close_connection(event.connection)
+
+    def on_disconnected(self, event):
+        self._close_connection(event.connection)
+
+    def on_transport_error(self, event):
+        pass # A client failing its handshake must not stop the broker
+
+
+def run_broker(url=DEFAULT_URL, certs_dir=CERTS_DIR, bindings=None, ready=None):
+    """
+    Runs a LocalBroker until the process is stopped.
+
+    Args:
+        url (str): The amqps URL to listen on.
+        certs_dir (str): Directory with ca.pem, server.pem and server.key.
+        bindings (dict): Exchange address -> queue address (default BINDINGS).
+        ready (multiprocessing.Event): Set once the broker is listening.
+    """
+    Container(LocalBroker(url, certs_dir, bindings, ready)).run()
+
+
+def start_broker_process(url=DEFAULT_URL, certs_dir=CERTS_DIR, bindings=None, timeout=10.0):
+    """
+    Starts a LocalBroker in a child process and waits until it is listening.
+
+    The broker gets its own process (and GIL), so it does not compete with the
+    clients being measured. Stop it with `process.terminate()`.
+
+    Args:
+        url (str): The amqps URL to listen on.
+        certs_dir (str): Directory with ca.pem, server.pem and server.key.
+        bindings (dict): Exchange address -> queue address (default BINDINGS).
+        timeout (float): Seconds to wait for the broker to listen.
+
+    Returns:
+        multiprocessing.Process: The running broker process.
+
+    Raises:
+        RuntimeError: If the broker is not listening within `timeout`.
+    """
+    ready = multiprocessing.Event()
+    process = multiprocessing.Process(target=run_broker, args=(url, certs_dir, bindings, ready),
+                                      name="local-broker", daemon=True)
+    process.start()
+    if not ready.wait(timeout):
+        process.terminate()
+        raise RuntimeError(f"Local broker did not start listening on {url} within {timeout}s")
+    return process
+
+
+if __name__ == "__main__":
+    listen_url = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_URL
+    print(f"Local broker: Listening on {listen_url} (Ctrl+C to stop)...")
+    try:
+        run_broker(listen_url)
+    except KeyboardInterrupt:
+        print("\nLocal broker: Stopped.")
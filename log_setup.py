@@ -0,0 +1,206 @@
+"""
+Logging setup shared by the AMQP 1.0 producer and consumer.
+
+Lifecycle events (connection, errors, reports) are logged at INFO and above on
+the "producer"/"consumer" loggers. Per-message events go to the
+"producer.messages"/"consumer.messages" child loggers, which are rate-limited so
+that high message rates do not turn terminal output into the bottleneck; the
+number of suppressed lines is reported by the periodic summary, together with
+the message counts of the last interval.
+
+By default records are handed to a queue and written by a background thread
+(QueueHandler/QueueListener), so the reactor thread never blocks on the terminal.
+
+Environment variables:
+- LOG_LEVEL: Minimum level logged (default "INFO"). DEBUG adds the consumer's
+  per-message processing steps and Proton's own connection messages.
+- LOG_MESSAGE_RATE: Maximum per-message log lines per second, per logger
+  (default 10, 0 for no limit).
+- LOG_SUMMARY_INTERVAL: Seconds between summary lines such as "N sent in the
+  last 5.0s" (default 5, 0 to disable).
+- LOG_ASYNC: If "true" (default), write log records from a background thread.
+"""
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_MESSAGE_RATE = float(os.getenv("LOG_MESSAGE_RATE", 10)) # Lines per second, 0 = no limit
+LOG_SUMMARY_INTERVAL = float(os.getenv("LOG_SUMMARY_INTERVAL", 5)) # Seconds, 0 = no summaries
+LOG_ASYNC = os.getenv("LOG_ASYNC", "true").lower() in ("1", "true", "yes")
+LOG_FORMAT = "%(asctime)s %(levelname)-7s %(name)s: %(message)s"
+
+_listener = None # QueueListener writing the records when logging is asynchronous
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Lets at most `rate` records per second through (token bucket) and counts the rest.
+    """
+    def __init__(self, rate, burst=None):
+        """
+        Args:
+            rate (float): Records allowed per second on average.
+            burst (float): Records allowed in a burst (default: one second's worth).
+        """
+        super().__init__()
+        self.rate = rate
+        self.burst = burst if burst is not None else max(1.0, rate)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.suppressed = 0
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            self.suppressed += 1
+            return False
+
+    def take_suppressed(self):
+        """
+        Returns the number of records suppressed since the last call.
+        """
+        with self._lock:
+            suppressed, self.suppressed = self.suppressed, 0
+            return suppressed
+
+
+def configure_logging(force=False):
+    """
+    Configures the root logger from the environment, once per process.
+
+    Args:
+        force (bool): Reconfigure even if logging was already set up, e.g. in a
+            forked child process whose parent's writer thread does not exist.
+    """
+    global _listener
+    root = logging.getLogger()
+    if getattr(root, "_order_logging", False) and not force:
+        return
+    if _listener is not None:
+        _listener.stop() # Returns at once in a forked child, where the thread is not running
+    _listener = None
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    if LOG_ASYNC:
+        records = queue.SimpleQueue()
+        root.addHandler(logging.handlers.QueueHandler(records))
+        _listener = logging.handlers.QueueListener(records, stream_handler, respect_handler_level=True)
+        _listener.start()
+    else:
+        root.addHandler(stream_handler)
+    root.setLevel(LOG_LEVEL)
+    # Proton logs every connect/disconnect at INFO; only show it when debugging
+    logging.getLogger("proton").setLevel(logging.WARNING if root.level > logging.DEBUG else logging.NOTSET)
+    root._order_logging = True
+
+
+def flush_logging():
+    """
+    Waits until every queued record has been written.
+
+    Call before a process exits without running atexit handlers (multiprocessing
+    children) so that its last lines are not lost.
+    """
+    if _listener is not None:
+        _listener.stop() # Drains the queue and joins the writer thread
+        _listener.start()
+
+
+@atexit.register
+def _stop_listener():
+    if _listener is not None:
+        _listener.stop()
+
+
+def get_message_logger(name, rate=LOG_MESSAGE_RATE):
+    """
+    Returns the rate-limited logger used for per-message events.
+
+    Args:
+        name (str): The logger name (e.g. "producer.messages").
+        rate (float): Maximum lines per second (0 for no limit).
+
+    Returns:
+        logging.Logger: The logger; its RateLimitFilter, if any, is `logger.rate_limit`.
+    """
+    logger = logging.getLogger(name)
+    if rate > 0 and getattr(logger, "rate_limit", None) is None:
+        logger.rate_limit = RateLimitFilter(rate)
+        logger.addFilter(logger.rate_limit)
+    return logger
+
+
+class LogSummary:
+    """
+    Reactor timer task that logs message counts for the last interval.
+
+    `counters_fn` returns a dict of running totals, e.g. {"sent": 10, "accepted": 9};
+    each summary line shows how much every total grew since the previous line,
+    the rate of the first one, and the per-message lines suppressed meanwhile.
+    """
+    def __init__(self, logger, counters_fn, message_logger=None, interval=LOG_SUMMARY_INTERVAL):
+        """
+        Args:
+            logger (logging.Logger): The logger the summary lines go to.
+            counters_fn (callable): Returns the current totals as an ordered dict.
+            message_logger (logging.Logger): The rate-limited per-message logger, if any.
+            interval (float): Seconds between summary lines.
+        """
+        self.logger = logger
+        self.counters_fn = counters_fn
+        self.message_logger = message_logger
+        self.interval = interval
+        self.task = None
+        self._last = None
+
+    def start(self, container):
+        """
+        Schedules the first summary on the container, unless summaries are disabled.
+        """
+        if self.interval > 0:
+            self._last = (time.monotonic(), self.counters_fn())
+            self.task = container.schedule(self.interval, self)
+
+    def stop(self):
+        """
+        Cancels the next summary.
+        """
+        if self.task:
+            self.task.cancel()
+            self.task = None
+
+    def log(self):
+        """
+        Logs one summary line for the time since the previous one.
+        """
+        now, counters = time.monotonic(), self.counters_fn()
+        last_time, last_counters = self._last
+        self._last = (now, counters)
+        elapsed = now - last_time
+        deltas = {name: value - last_counters.get(name, 0) for name, value in counters.items()}
+        first = next(iter(deltas), None)
+        rate = f" ({deltas[first] / elapsed:.1f} msg/s)" if first and elapsed > 0 else ""
+        counts = ", ".join(f"{value} {name}" for name, value in deltas.items())
+        rate_limit = getattr(self.message_logger, "rate_limit", None)
+        suppressed = rate_limit.take_suppressed() if rate_limit else 0
+        note = f"; {suppressed} per-message log line(s) suppressed" if suppressed else ""
+        self.logger.info("%s in the last %.1fs%s%s", counts, elapsed, rate, note)
+
+    def on_timer_task(self, event):
+        self.log()
+        self.task = event.container.schedule(self.interval, self)
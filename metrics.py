@@ -0,0 +1,507 @@
+"""
+Throughput and latency metrics for the AMQP 1.0 producer and consumer.
+
+Producer metrics: messages sent/accepted/rejected/released/resent, orders
+sent/accepted (batch messages carry several, see order_batching.py), bytes sent,
+credit stalls (time spent with orders left to send but no link credit),
+backpressure pauses (time spent with a full MAX_IN_FLIGHT/MAX_UNSETTLED_BYTES window),
+messages in flight, open sender links, spooled messages and bytes (with SPOOL_DIR)
+and a send-to-accept latency histogram keyed by delivery tag.
+
+Consumer metrics: messages received/accepted/rejected/released, orders received,
+bytes received, credit stalls (time spent with no receiver credit left; manual credit
+mode only, as in auto mode Proton grants credit again as soon as messages arrive),
+settlements waiting for their batch, deduplication hits/misses (with DEDUP_KEY), sink
+batches, orders and write time (with CONSUMER_SINK) and an end-to-end latency
+histogram, from the producer's creation_time message property to receipt by the
+consumer (this compares the wall clocks of two hosts, so keep them NTP-synchronized).
+
+The metrics can be scraped in Prometheus text format over HTTP, or written as
+periodic JSON snapshots (one JSON document per line) that also carry the
+per-second rate of every counter over the last interval.
+
+Environment variables:
+- METRICS_PORT: Serve Prometheus metrics on this port (default 0, disabled). Extra
+  producer/consumer processes use the following ports, one per process.
+- METRICS_HOST: Address the metrics endpoint listens on (default "127.0.0.1").
+- METRICS_JSON_INTERVAL: Seconds between JSON snapshots (default 0, disabled).
+- METRICS_JSON_FILE: File the JSON snapshots are appended to (default: unset, logged
+  at INFO level by the "metrics" logger, see log_setup.py).
+"""
+import bisect
+import json
+import logging
+import os
+import threading
+import time
+
+log = logging.getLogger("metrics")
+
+METRICS_PORT = int(os.getenv("METRICS_PORT", 0)) # 0 = no Prometheus endpoint
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_JSON_INTERVAL = float(os.getenv("METRICS_JSON_INTERVAL", 0)) # Seconds, 0 = no JSON snapshots
+METRICS_JSON_FILE = os.getenv("METRICS_JSON_FILE") or None # None = the "metrics" logger
+
+# Histogram bucket upper bounds in seconds, from sub-millisecond to 10 s
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Counter:
+    """
+    A monotonically increasing value.
+
+    The value is either incremented with inc() or, if `value_fn` is given,
+    read from an existing counter of the handler on every collection.
+    """
+    def __init__(self, name, help_text, value_fn=None):
+        self.name = name
+        self.help_text = help_text
+        self._value = 0
+        self._value_fn = value_fn
+
+    def inc(self, amount=1):
+        self._value += amount
+
+    @property
+    def value(self):
+        return self._value_fn() if self._value_fn else self._value
+
+
+class Gauge(Counter):
+    """
+    A value that can go up and down, read from `value_fn` on every collection.
+    """
+
+
+class Histogram:
+    """
+    Distribution of observed values in fixed, cumulative buckets (Prometheus style).
+    """
+    def __init__(self, name, help_text, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1) # Last slot counts values above the largest bucket
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        """
+        Records one observation.
+
+        Args:
+            value (float): The observed value (seconds for latency histograms).
+        """
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        """
+        Adds the observations of another histogram with the same buckets,
+        e.g. one returned by a producer or consumer process.
+
+        Args:
+            other (Histogram): The histogram to add.
+        """
+        if other.buckets != self.buckets:
+            raise ValueError(f"Cannot merge histograms with different buckets ({other.name} into {self.name})")
+        self.counts = [mine + theirs for mine, theirs in zip(self.counts, other.counts)]
+        self.count += other.count
+        self.sum += other.sum
+        self.max = max(self.max, other.max)
+
+    def quantile(self, q):
+        """
+        Estimates a quantile by linear interpolation inside the bucket that holds it.
+
+        Args:
+            q (float): The quantile, between 0 and 1.
+
+        Returns:
+            float: The estimate, or None if nothing was observed.
+        """
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            if bucket_count and seen + bucket_count >= rank:
+                lower = self.buckets[index - 1] if index else 0.0
+                upper = self.buckets[index] if index < len(self.buckets) else self.max
+                return min(self.max, lower + (upper - lower) * (rank - seen) / bucket_count)
+            seen += bucket_count
+        return self.max
+
+    def summary(self):
+        """
+        Returns count, mean, p50, p90, p99 and max (in the histogram's unit) as a dict.
+        """
+        return {
+            "count": self.count,
+            "mean": self.sum / self.count if self.count else None,
+            "p50": self.quantile(0.5),
+            "p90": self.quantile(0.9),
+            "p99": self.quantile(0.99),
+            "max": self.max if self.count else None,
+        }
+
+
+class MetricsRegistry:
+    """
+    A named set of counters, gauges and histograms with Prometheus and JSON output.
+    """
+    def __init__(self, prefix):
+        """
+        Args:
+            prefix (str): Prepended to every metric name (e.g. "order_producer").
+        """
+        self.prefix = prefix
+        self.metrics = []
+        self.started = time.time()
+        self._last_snapshot = (time.monotonic(), {})
+
+    def _add(self, metric):
+        metric.name = f"{self.prefix}_{metric.name}"
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text, value_fn=None):
+        return self._add(Counter(name, help_text, value_fn))
+
+    def gauge(self, name, help_text, value_fn):
+        return self._add(Gauge(name, help_text, value_fn))
+
+    def histogram(self, name, help_text, buckets=LATENCY_BUCKETS):
+        return self._add(Histogram(name, help_text, buckets))
+
+    def prometheus_text(self):
+        """
+        Returns all metrics in the Prometheus text exposition format.
+        """
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help_text}")
+            if isinstance(metric, Histogram):
+                lines.append(f"# TYPE {metric.name} histogram")
+                cumulative = 0
+                for bound, bucket_count in zip(metric.buckets, metric.counts):
+                    cumulative += bucket_count
+                    lines.append(f'{metric.name}_bucket{{le="{bound}"}} {cumulative}')
+                lines.append(f'{metric.name}_bucket{{le="+Inf"}} {metric.count}')
+                lines.append(f"{metric.name}_sum {metric.sum}")
+                lines.append(f"{metric.name}_count {metric.count}")
+            else:
+                kind = "gauge" if isinstance(metric, Gauge) else "counter"
+                lines.append(f"# TYPE {metric.name} {kind}")
+                lines.append(f"{metric.name} {metric.value}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self):
+        """
+        Returns the current values as a JSON-serializable dict.
+
+        Counters are reported with their per-second rate since the previous
+        snapshot; histograms with their count, mean, p50, p90, p99 and max.
+        """
+        now = time.monotonic()
+        last_time, last_values = self._last_snapshot
+        elapsed = now - last_time
+        values, rates, histograms = {}, {}, {}
+        for metric in self.metrics:
+            if isinstance(metric, Histogram):
+                histograms[metric.name] = metric.summary()
+                continue
+            values[metric.name] = metric.value
+            if type(metric) is Counter and elapsed > 0:
+                rates[metric.name] = (metric.value - last_values.get(metric.name, 0)) / elapsed
+        self._last_snapshot = (now, values)
+        return {
+            "timestamp": time.time(),
+            "uptime_seconds": time.time() - self.started,
+            "interval_seconds": elapsed,
+            "values": values,
+            "rates_per_second": rates,
+            "histograms": histograms,
+        }
+
+
+class _CreditStallTracker:
+    """
+    Times the periods a link spends without credit while it still has work to do.
+    """
+    def __init__(self, registry):
+        self.stalls = registry.counter("credit_stalls_total", "Times a link ran out of credit with work pending")
+        self.stall_seconds = registry.counter("credit_stall_seconds_total", "Time spent waiting for link credit")
+        self._stalled_since = {} # Link name -> monotonic time the stall began
+
+    def credit_exhausted(self, link):
+        """
+        Marks the start of a stall on a link, unless one is already running.
+        """
+        if link.name not in self._stalled_since:
+            self._stalled_since[link.name] = time.monotonic()
+            self.stalls.inc()
+
+    def credit_available(self, link):
+        """
+        Ends the stall running on a link, if any.
+        """
+        started = self._stalled_since.pop(link.name, None)
+        if started is not None:
+            self.stall_seconds.inc(time.monotonic() - started)
+
+
+class ProducerMetrics(_CreditStallTracker):
+    """
+    Metrics for an OrderProducer; the handler reports sends and outcomes to it.
+    """
+    def __init__(self, producer):
+        """
+        Args:
+            producer (OrderProducer): The handler whose counters are exposed.
+        """
+        self.registry = MetricsRegistry("order_producer")
+        registry = self.registry
+        registry.counter("messages_sent_total", "Messages sent (resends excluded)", lambda: producer.sent_count)
+        registry.counter("messages_accepted_total", "Messages accepted by the broker", lambda: producer.confirmed_count)
+        registry.counter("orders_sent_total", "Orders sent, counting every order of a batch message",
+                         lambda: producer.orders_sent)
+        registry.counter("orders_accepted_total", "Orders accepted by the broker, counting every order of a batch message",
+                         lambda: producer.orders_confirmed)
+        self.rejected = registry.counter("messages_rejected_total", "Messages rejected by the broker")
+        self.released = registry.counter("messages_released_total", "Messages released by the broker")
+        registry.counter("messages_resent_total", "Messages resent after a reconnect or release",
+                         lambda: producer.resent_count)
+        self.bytes_sent = registry.counter("bytes_sent_total", "Encoded message bytes handed to the sender links")
+        super().__init__(registry)
+        registry.gauge("in_flight", "Messages sent and not yet settled by the broker", lambda: len(self._sent_at))
+        registry.gauge("sender_links", "Open sender links (routes with a link, when routing)",
+                       lambda: len(producer.senders))
+        registry.gauge("unsettled_bytes", "Encoded bytes of the messages in the in-flight window (when limited)",
+                       lambda: producer.unsettled_bytes)
+        registry.counter("backpressure_pauses_total", "Times sending paused on a full in-flight window",
+                         lambda: producer.backpressure_pauses)
+        registry.counter("backpressure_seconds_total", "Time spent paused on a full in-flight window",
+                         producer.blocked_seconds)
+        if producer.spool:
+            spool = producer.spool
+            registry.counter("spool_appended_total", "Messages appended to the spool", lambda: spool.appended)
+            registry.counter("spool_removed_total", "Spooled messages removed once settled", lambda: spool.acked)
+            registry.gauge("spool_pending_bytes", "Bytes of spooled messages not settled yet",
+                           lambda: spool.pending()[1])
+        self.send_to_accept = registry.histogram("send_to_accept_seconds", "Time from send to the broker's accept")
+        self._sent_at = {} # (link name, delivery tag) -> perf_counter at send
+
+    def message_sent(self, sender, delivery, settled=False):
+        """
+        Records a message just handed to a sender link.
+
+        Args:
+            sender: The Qpid Proton sender link.
+            delivery: The delivery returned by `sender.send()`.
+            settled (bool): True for pre-settled (at-most-once) messages, which get no outcome.
+        """
+        if not settled:
+            self._sent_at[(sender.name, delivery.tag)] = time.perf_counter()
+        self.bytes_sent.inc(delivery.pending) # Still fully buffered: the transport writes it later
+
+    def message_settled(self, delivery, state):
+        """
+        Records the broker's outcome for a delivery.
+
+        Args:
+            delivery: The Qpid Proton delivery settled by the broker.
+            state: Delivery.ACCEPTED, Delivery.REJECTED or Delivery.RELEASED.
+        """
+        sent_at = self._sent_at.pop((delivery.link.name, delivery.tag), None)
+        if state == delivery.ACCEPTED:
+            if sent_at is not None:
+                self.send_to_accept.observe(time.perf_counter() - sent_at)
+        elif state == delivery.REJECTED:
+            self.rejected.inc()
+        elif state == delivery.RELEASED:
+            self.released.inc()
+
+    def connection_lost(self):
+        """
+        Forgets the send times of deliveries whose outcome will never arrive.
+        """
+        self._sent_at.clear()
+
+
+class ConsumerMetrics(_CreditStallTracker):
+    """
+    Metrics for an OrderConsumer; the handler reports receipts and credit to it.
+    """
+    def __init__(self, consumer):
+        """
+        Args:
+            consumer (OrderConsumer): The handler whose counters are exposed.
+        """
+        self.registry = MetricsRegistry("order_consumer")
+        registry = self.registry
+        registry.counter("messages_received_total", "Messages received", lambda: consumer.received_count)
+        registry.counter("orders_received_total", "Orders received, counting every order of a batch message",
+                         lambda: consumer.orders_received)
+        registry.counter("messages_accepted_total", "Messages accepted", lambda: consumer.accepted_count)
+        registry.counter("messages_rejected_total", "Messages rejected", lambda: consumer.rejected_count)
+        registry.counter("messages_released_total", "Messages released", lambda: consumer.released_count)
+        self.bytes_received = registry.counter("bytes_received_total", "Encoded message bytes received")
+        if consumer.credit_mode == "manual":
+            super().__init__(registry)
+        else:
+            # Proton's flow controller tops the credit up as transfers arrive: the link never runs out
+            self.stalls = self.stall_seconds = None
+        registry.gauge("pending_settlements", "Processed messages waiting for their settlement batch",
+                       lambda: len(consumer.pending_settlements))
+        if consumer.dedup:
+            dedup = consumer.dedup
+            registry.counter("dedup_hits_total", "Orders (or messages) skipped as already processed", lambda: dedup.hits)
+            registry.counter("dedup_misses_total", "Orders (or messages) checked and not seen before", lambda: dedup.misses)
+            registry.gauge("dedup_entries", "Keys held by the deduplication cache", lambda: dedup.size)
+        if consumer.sink is not None:
+            registry.counter("sink_batches_total", "Micro-batches written to the sink", lambda: consumer.batches_written)
+            registry.counter("sink_orders_total", "Orders written to the sink", lambda: consumer.orders_written)
+            registry.counter("sink_failures_total", "Sink batches that failed, releasing their messages",
+                             lambda: consumer.sink_failures)
+            self.sink_write = registry.histogram("sink_write_seconds", "Time the sink took to write a batch")
+        self.end_to_end = registry.histogram("end_to_end_latency_seconds",
+                                             "Time from the producer's creation_time to receipt")
+
+    def sink_batch_written(self, seconds):
+        """
+        Records how long the sink took to write a batch.
+
+        Args:
+            seconds (float): The write time.
+        """
+        self.sink_write.observe(seconds)
+
+    def message_received(self, message, size):
+        """
+        Records a received message and its end-to-end latency.
+
+        Args:
+            message (proton.Message): The received message.
+            size (int): Its encoded size in bytes, as received on the link.
+        """
+        self.bytes_received.inc(size)
+        if message.creation_time:
+            self.end_to_end.observe(max(0.0, time.time() - message.creation_time))
+
+
+def start_prometheus_server(registry, port, host=METRICS_HOST):
+    """
+    Serves the registry in Prometheus text format on a daemon thread.
+
+    The reactor thread never waits for scrapes: the server only reads the
+    current values. http.server is imported here, so processes without
+    METRICS_PORT do not pay for it at startup.
+
+    Args:
+        registry (MetricsRegistry): The metrics to expose.
+        port (int): The TCP port to listen on.
+        host (str): The address to listen on.
+
+    Returns:
+        ThreadingHTTPServer: The running server (call shutdown() to stop it).
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class PrometheusHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] not in ("/", "/metrics"):
+                self.send_error(404)
+                return
+            body = registry.prometheus_text().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass # Keep scrapes out of the application output
+
+    server = ThreadingHTTPServer((host, port), PrometheusHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
+
+
+class JsonSnapshotWriter:
+    """
+    Reactor timer task that writes a JSON snapshot of a registry every `interval` seconds.
+    """
+    def __init__(self, registry, interval, path=None):
+        """
+        Args:
+            registry (MetricsRegistry): The metrics to snapshot.
+            interval (float): Seconds between snapshots.
+            path (str): File the snapshots are appended to, one per line (None to log them).
+        """
+        self.registry = registry
+        self.interval = interval
+        self.path = path
+        self.task = None
+
+    def start(self, container):
+        """
+        Schedules the first snapshot on the container.
+        """
+        self.task = container.schedule(self.interval, self)
+
+    def stop(self):
+        """
+        Cancels the next snapshot.
+        """
+        if self.task:
+            self.task.cancel()
+            self.task = None
+
+    def write(self):
+        """
+        Writes one snapshot now.
+        """
+        line = json.dumps({"metrics": self.registry.prefix, **self.registry.snapshot()})
+        if self.path:
+            with open(self.path, "a") as f:
+                f.write(line + "\n")
+        else:
+            log.info("%s", line)
+
+    def on_timer_task(self, event):
+        self.write()
+        self.task = event.container.schedule(self.interval, self)
+
+
+def start_exporters(registry, container, port_offset=0):
+    """
+    Starts the exporters configured through the environment for a registry.
+
+    Args:
+        registry (MetricsRegistry): The metrics to export.
+        container (proton.reactor.Container): The container that runs the JSON snapshot timer.
+        port_offset (int): Added to METRICS_PORT, so several processes can each serve their own endpoint.
+
+    Returns:
+        tuple: (Prometheus server or None, JsonSnapshotWriter or None)
+    """
+    server = writer = None
+    if METRICS_PORT:
+        server = start_prometheus_server(registry, METRICS_PORT + port_offset)
+    if METRICS_JSON_INTERVAL > 0:
+        writer = JsonSnapshotWriter(registry, METRICS_JSON_INTERVAL, METRICS_JSON_FILE)
+        writer.start(container)
+    return server, writer
+
+
+def metrics_enabled():
+    """
+    Returns True if an exporter is configured through the environment.
+    """
+    return bool(METRICS_PORT or METRICS_JSON_INTERVAL > 0)
@@ -0,0 +1,334 @@
+"""
+Batching of several orders into one AMQP message.
+
+Every AMQP message costs a transfer, a disposition and a routing decision on the
+broker, which dominates for small orders. With MESSAGE_BATCH_SIZE > 1 the
+producer packs up to that many orders into one message; a batch is also closed
+once MESSAGE_BATCH_TIMEOUT_MS have passed since its first order, so slow sources
+(stdin) do not hold orders back: lazy sources are then read through an OrderFeed
+thread, so the batch is closed at its deadline even while the source waits. The
+reactor still waits for the first order of each batch, as it does without
+batching; with SPOOL_DIR set, the spool intake thread does all the waiting. The consumer unpacks the batch and processes
+every order, and the message is accepted, rejected or released as a whole: a
+released batch is processed again in full (at-least-once).
+
+Batch messages carry two application properties:
+- "x-order-batch": The batch format (see below).
+- "x-order-count": The number of orders in the batch.
+Messages without them carry a single order (see order_codecs.py).
+
+Formats (MESSAGE_BATCH_FORMAT):
+- json (default): A JSON array of orders, content type "application/json"
+  (written with orjson when ORDER_CODEC is "orjson").
+- amqp: An AMQP list of maps, with no content type.
+- frames: Each order encoded with the ORDER_CODEC codec and prefixed with its
+  length as a 4-byte big-endian integer, in a binary body. The content type is
+  the codec's, e.g. "application/msgpack"; the "amqp" codec cannot be used.
+
+Environment variables:
+- MESSAGE_BATCH_SIZE: Maximum orders per message (default 1, no batching).
+- MESSAGE_BATCH_TIMEOUT_MS: Maximum time spent collecting a batch (default 0, no limit).
+- MESSAGE_BATCH_FORMAT: "json" (default), "amqp" or "frames".
+"""
+import os
+import queue
+import struct
+import threading
+import time
+
+from proton import Message
+
+from order_codecs import CODECS, PayloadError, codec_for_content_type, decode_order
+from order_generator import EncodedMessage
+
+MESSAGE_BATCH_SIZE = int(os.getenv("MESSAGE_BATCH_SIZE", 1)) # 1 = one order per message
+MESSAGE_BATCH_TIMEOUT_MS = float(os.getenv("MESSAGE_BATCH_TIMEOUT_MS", 0)) # 0 = no time limit
+MESSAGE_BATCH_FORMAT = os.getenv("MESSAGE_BATCH_FORMAT", "json")
+
+BATCH_FORMAT_PROPERTY = "x-order-batch"
+BATCH_COUNT_PROPERTY = "x-order-count"
+BATCH_FORMATS = ("json", "amqp", "frames")
+
+_FRAME_HEADER = struct.Struct(">I")
+_FEED_END = object() # Queued by the feed thread once the source is exhausted
+
+
+class OrderFeed:
+    """
+    Reads an order source in a daemon thread, so that a batch can be closed at its
+    deadline while the source is still waiting for the next order.
+
+    Attributes:
+        exhausted (bool): Set once the end of the source has been read.
+    """
+    def __init__(self, source, maxsize=1000):
+        """
+        Args:
+            source (iterable): The order source.
+            maxsize (int): Maximum orders read ahead of the batcher.
+        """
+        self.exhausted = False
+        self._error = None
+        self._queue = queue.Queue(maxsize)
+        self._thread = threading.Thread(target=self._read, args=(source,), name="order-feed", daemon=True)
+        self._thread.start()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        order = self.get()
+        if order is None:
+            raise StopIteration
+        return order
+
+    def _read(self, source):
+        try:
+            for order in source:
+                self._queue.put(order)
+        except Exception as e:
+            self._queue.put(e) # Raised again by get(), in the reading thread
+            return
+        self._queue.put(_FEED_END)
+
+    def get(self, timeout=None):
+        """
+        Returns the next order, or None once the source is exhausted.
+
+        Args:
+            timeout (float, optional): Maximum seconds to wait (default: no limit).
+
+        Raises:
+            queue.Empty: If no order arrived within the timeout.
+            Exception: The error the source raised, after the orders it read before.
+        """
+        if self.exhausted:
+            error, self._error = self._error, None
+            if error:
+                raise error
+            return None
+        item = self._queue.get(timeout=timeout)
+        if item is _FEED_END or isinstance(item, Exception):
+            self.exhausted = True
+            if item is not _FEED_END:
+                self._error = item # Raised on the next call, once the batch so far is sent
+            return None
+        return item
+
+
+class MessageBatcher:
+    """
+    Collects orders from a source into batches and encodes each batch into one AMQP message.
+
+    Attributes:
+        size (int): Maximum orders per batch.
+        timeout (float): Maximum seconds spent collecting a batch (0 for no limit).
+        batch_format (str): One of BATCH_FORMATS.
+        codec (order_codecs.OrderCodec): The producer's codec.
+    """
+    def __init__(self, size, timeout_ms=0, batch_format="json", codec=None):
+        """
+        Args:
+            size (int): Maximum orders per batch.
+            timeout_ms (float): Maximum milliseconds spent collecting a batch (0 for no limit).
+            batch_format (str): "json", "amqp" or "frames".
+            codec (order_codecs.OrderCodec): The producer's codec (default JSON); it
+                encodes the frames, and the JSON arrays if it is orjson.
+
+        Raises:
+            ValueError: If the format is unknown or cannot be used with the codec.
+        """
+        if batch_format not in BATCH_FORMATS:
+            raise ValueError(f"Unknown batch format '{batch_format}', expected one of: {', '.join(BATCH_FORMATS)}")
+        codec = codec or CODECS["json"]
+        if batch_format == "frames" and codec.content_type is None:
+            raise ValueError(f"The frames batch format needs a serializing codec, not '{codec.name}'")
+        self.size = max(1, size)
+        self.timeout = timeout_ms / 1000.0
+        self.batch_format = batch_format
+        self.codec = codec
+        self._json_codec = codec if codec.content_type == "application/json" else CODECS["json"]
+
+    def collect(self, source, limit=None):
+        """
+        Pulls the next batch of orders from a source.
+
+        From an OrderFeed the batch is closed at its deadline even if no further order
+        arrives; from a plain iterator the deadline is only checked as orders arrive.
+
+        Args:
+            source (iterator or OrderFeed): The order source.
+            limit (int, optional): Orders left to send, if known.
+
+        Returns:
+            list: Up to `size` orders; empty once the source is exhausted.
+        """
+        size = self.size if limit is None else min(self.size, limit)
+        if isinstance(source, OrderFeed):
+            return self._collect_feed(source, size)
+        orders = []
+        deadline = None
+        for order in source:
+            orders.append(order)
+            if len(orders) >= size:
+                break
+            if self.timeout:
+                now = time.monotonic()
+                if deadline is None:
+                    deadline = now + self.timeout
+                elif now >= deadline:
+                    break
+        return orders
+
+    def _collect_feed(self, feed, size):
+        order = feed.get() # No deadline before the batch has its first order
+        if order is None:
+            return []
+        orders = [order]
+        deadline = time.monotonic() + self.timeout if self.timeout else None
+        while len(orders) < size:
+            timeout = None if deadline is None else deadline - time.monotonic()
+            if timeout is not None and timeout <= 0:
+                break
+            try:
+                order = feed.get(timeout)
+            except queue.Empty:
+                break
+            if order is None:
+                break
+            orders.append(order)
+        return orders
+
+    def encode(self, orders):
+        """
+        Returns the message body for a batch of orders.
+
+        Args:
+            orders (list): The orders of the batch.
+        """
+        if self.batch_format == "json":
+            return self._json_codec.encode(orders)
+        if self.batch_format == "amqp":
+            return list(orders)
+        frames = []
+        for order in orders:
+            body = self.codec.encode(order)
+            if isinstance(body, str):
+                body = body.encode("utf-8")
+            frames.append(_FRAME_HEADER.pack(len(body)))
+            frames.append(body)
+        return b"".join(frames)
+
+    def message(self, orders):
+        """
+        Returns an AMQP message carrying a batch of orders and the batch properties.
+
+        Args:
+            orders (list): The orders of the batch.
+        """
+        message = Message(body=self.encode(orders))
+        content_type = self._json_codec.content_type if self.batch_format == "json" else self.codec.content_type
+        if content_type and self.batch_format != "amqp":
+            message.content_type = content_type
+        message.properties = {BATCH_FORMAT_PROPERTY: self.batch_format, BATCH_COUNT_PROPERTY: len(orders)}
+        return message
+
+
+def create_batcher(codec=None):
+    """
+    Returns the MessageBatcher configured through the environment, or None if batching is disabled.
+
+    Args:
+        codec (order_codecs.OrderCodec): The producer's codec.
+
+    Raises:
+        ValueError: If the configured format is unknown or cannot be used with the codec.
+    """
+    if MESSAGE_BATCH_SIZE <= 1:
+        return None
+    return MessageBatcher(MESSAGE_BATCH_SIZE, MESSAGE_BATCH_TIMEOUT_MS, MESSAGE_BATCH_FORMAT, codec)
+
+
+def encode_batches(orders, batcher):
+    """
+    Packs orders into batches and encodes them into complete AMQP messages ahead of sending.
+
+    Batches are closed by size only. Like encode_orders(), the messages carry no creation_time.
+
+    Args:
+        orders (iterable): The order dictionaries.
+        batcher (MessageBatcher): How orders are batched and encoded.
+
+    Returns:
+        list: One EncodedMessage per batch.
+    """
+    source = iter(orders)
+    messages = []
+    while True:
+        batch = batcher.collect(source)
+        if not batch:
+            return messages
+        messages.append(EncodedMessage(batcher.message(batch).encode(), len(batch)))
+
+
+def _split_frames(body):
+    """
+    Returns the payloads of a length-prefixed frame body.
+
+    Raises:
+        PayloadError: If a frame is truncated.
+    """
+    if isinstance(body, str):
+        body = body.encode("utf-8")
+    frames = []
+    offset, end = 0, len(body)
+    while offset < end:
+        if offset + _FRAME_HEADER.size > end:
+            raise PayloadError("Invalid frames batch payload: truncated frame header")
+        (length,) = _FRAME_HEADER.unpack_from(body, offset)
+        offset += _FRAME_HEADER.size
+        if offset + length > end:
+            raise PayloadError("Invalid frames batch payload: truncated frame")
+        frames.append(body[offset:offset + length])
+        offset += length
+    return frames
+
+
+def decode_orders(message):
+    """
+    Decodes the orders carried by a message: every order of a batch, or the single order of any other message.
+
+    Args:
+        message (proton.Message): The received message.
+
+    Returns:
+        list: The decoded orders.
+
+    Raises:
+        PayloadError: If the batch format or content type is not supported, the body
+            cannot be decoded or the number of orders does not match the batch header.
+    """
+    properties = message.properties
+    batch_format = properties.get(BATCH_FORMAT_PROPERTY) if properties else None
+    if batch_format is None:
+        return [decode_order(message)]
+    content_type = message.content_type
+    if not content_type or content_type == "None": # Proton reports a missing content type as "None"
+        content_type = None
+    if batch_format == "json":
+        orders = codec_for_content_type(content_type or "application/json").decode_batch(message.body)
+    elif batch_format == "amqp":
+        orders = message.body
+        if not isinstance(orders, list) or not all(isinstance(order, dict) for order in orders):
+            raise PayloadError("Invalid amqp batch payload: expected a list of maps")
+    elif batch_format == "frames":
+        if content_type is None:
+            raise PayloadError("Frames batch without a content type")
+        codec = codec_for_content_type(content_type)
+        orders = [codec.decode(frame) for frame in _split_frames(message.body)]
+    else:
+        raise PayloadError(f"Unsupported batch format '{batch_format}'")
+    count = properties.get(BATCH_COUNT_PROPERTY)
+    if count is not None and count != len(orders):
+        raise PayloadError(f"Batch header announces {count} order(s), the body carries {len(orders)}")
+    return orders
@@ -0,0 +1,276 @@
+"""
+Order payload codecs for the AMQP 1.0 producer and consumer.
+
+The producer encodes each order with the codec selected through ORDER_CODEC and
+stamps the message with the codec's content type. The consumer picks the decoder
+from the content type of each message, so producers using different codecs can
+share a queue and no consumer configuration is needed.
+
+Codecs:
+- json (default): JSON text in an AMQP string body, content type "application/json".
+- orjson: The same JSON wire format produced by the orjson library (optional
+  dependency) as a binary body. Consumers decode "application/json" with orjson
+  when it is installed, whichever codec the producer used.
+- msgpack: MessagePack in a binary body, content type "application/msgpack"
+  (requires the optional msgpack library on both sides).
+- amqp: The order as a native AMQP map body, with no content type; Proton encodes
+  and decodes it without a separate serialization step.
+
+Environment variables:
+- ORDER_CODEC: The codec used by the producer (default "json").
+
+Running this module directly prints the encode/decode cost and wire size per
+order for every available codec:
+
+    python order_codecs.py [ORDERS]
+"""
+import json
+import os
+import sys
+import time
+
+from proton import Message
+
+try:
+    import orjson
+except ImportError: # Optional dependency
+    orjson = None
+
+try:
+    import msgpack
+except ImportError: # Optional dependency
+    msgpack = None
+
+ORDER_CODEC = os.getenv("ORDER_CODEC", "json")
+
+
+class PayloadError(ValueError):
+    """
+    Raised when a message body cannot be decoded into an order.
+    """
+
+
+class OrderCodec:
+    """
+    Encodes orders into AMQP message bodies and back.
+
+    Attributes:
+        name (str): The name used to select the codec (ORDER_CODEC).
+        content_type (str): The message content type, or None for native AMQP bodies.
+        available (bool): Whether the libraries the codec needs are installed.
+    """
+    def __init__(self, name, content_type, encode, decode, available=True):
+        self.name = name
+        self.content_type = content_type
+        self.available = available
+        self._encode = encode
+        self._decode = decode
+
+    def encode(self, order):
+        """
+        Returns the message body for an order.
+
+        Args:
+            order (dict): The order to encode.
+        """
+        return self._encode(order)
+
+    def message(self, order):
+        """
+        Returns an AMQP message carrying the encoded order and the codec's content type.
+
+        Args:
+            order (dict): The order to encode.
+        """
+        message = Message(body=self._encode(order))
+        if self.content_type:
+            message.content_type = self.content_type
+        return message
+
+    def decode(self, body):
+        """
+        Returns the order carried by a message body.
+
+        Args:
+            body: The message body.
+
+        Raises:
+            PayloadError: If the body is not a valid payload for this codec.
+        """
+        try:
+            order = self._decode(body)
+        except Exception as e:
+            raise PayloadError(f"Invalid {self.name} payload: {e}") from e
+        if not isinstance(order, dict):
+            raise PayloadError(f"Invalid {self.name} payload: expected an object, got {type(order).__name__}")
+        return order
+
+    def decode_batch(self, body):
+        """
+        Returns the orders carried by a message body holding an array of orders.
+
+        Args:
+            body: The message body.
+
+        Raises:
+            PayloadError: If the body is not a valid array of orders for this codec.
+        """
+        try:
+            orders = self._decode(body)
+        except Exception as e:
+            raise PayloadError(f"Invalid {self.name} batch payload: {e}") from e
+        if not isinstance(orders, list) or not all(isinstance(order, dict) for order in orders):
+            raise PayloadError(f"Invalid {self.name} batch payload: expected an array of objects")
+        return orders
+
+
+def _decode_json(body):
+    if orjson is not None:
+        return orjson.loads(body)
+    if isinstance(body, bytes):
+        body = body.decode("utf-8")
+    return json.loads(body)
+
+
+CODECS = {
+    codec.name: codec for codec in (
+        OrderCodec("json", "application/json", json.dumps, _decode_json),
+        OrderCodec("orjson", "application/json", orjson.dumps if orjson else None, _decode_json,
+                   available=orjson is not None),
+        OrderCodec("msgpack", "application/msgpack", msgpack.packb if msgpack else None,
+                   msgpack.unpackb if msgpack else None, available=msgpack is not None),
+        OrderCodec("amqp", None, dict, dict),
+    )
+}
+
+# Decoder used for each content type; orjson and json share a wire format
+_DECODERS = {
+    "application/json": CODECS["json"],
+    "application/msgpack": CODECS["msgpack"],
+}
+
+
+def get_codec(name):
+    """
+    Returns the codec registered under the given name.
+
+    Args:
+        name (str): The codec name (see CODECS).
+
+    Raises:
+        ValueError: If the codec is unknown or its library is not installed.
+    """
+    codec = CODECS.get(name)
+    if codec is None:
+        raise ValueError(f"Unknown order codec '{name}', expected one of: {', '.join(CODECS)}")
+    if not codec.available:
+        raise ValueError(f"Order codec '{name}' needs the {name} package (pip install {name})")
+    return codec
+
+
+def codec_for_content_type(content_type):
+    """
+    Returns the codec decoding bodies of the given content type.
+
+    Args:
+        content_type (str): The message content type (parameters such as charset are ignored).
+
+    Raises:
+        PayloadError: If the content type is not supported or its library is not installed.
+    """
+    codec = _DECODERS.get(content_type.split(";")[0].strip().lower())
+    if codec is None:
+        raise PayloadError(f"Unsupported content type '{content_type}'")
+    if not codec.available:
+        raise PayloadError(f"Content type '{content_type}' needs the {codec.name} package")
+    return codec
+
+
+def decode_order(message):
+    """
+    Decodes the order carried by a message, choosing the codec from its content type.
+
+    Messages without a content type are expected to carry a native AMQP map,
+    or JSON text as sent by older producers.
+
+    Args:
+        message (proton.Message): The received message.
+
+    Returns:
+        dict: The decoded order.
+
+    Raises:
+        PayloadError: If the content type is not supported or the body cannot be decoded.
+    """
+    content_type = message.content_type
+    if not content_type or content_type == "None": # Proton reports a missing content type as "None"
+        codec = CODECS["amqp"] if isinstance(message.body, dict) else CODECS["json"]
+    else:
+        codec = codec_for_content_type(content_type)
+    return codec.decode(message.body)
+
+
+def benchmark(num_orders):
+    """
+    Measures encode/decode cost and wire size per order for every available codec.
+
+    The codec alone is timed on the message body, then each order is encoded into
+    a complete AMQP message (codec plus Proton message encoding) and decoded back,
+    as the producer and consumer do.
+
+    Args:
+        num_orders (int): Number of random orders to encode and decode per codec.
+
+    Returns:
+        list: One dict per codec with the codec and full message encode/decode
+            times in microseconds per order and the encoded message size in bytes.
+    """
+    from producer import generate_random_orders
+
+    orders = generate_random_orders(num_orders)
+    results = []
+    for codec in CODECS.values():
+        if not codec.available:
+            continue
+        started = time.perf_counter()
+        bodies = [codec.encode(order) for order in orders]
+        body_encode_time = time.perf_counter() - started
+        started = time.perf_counter()
+        for body in bodies:
+            codec.decode(body)
+        body_decode_time = time.perf_counter() - started
+
+        started = time.perf_counter()
+        encoded = []
+        for order in orders:
+            encoded.append(codec.message(order).encode())
+        encode_time = time.perf_counter() - started
+
+        started = time.perf_counter()
+        for data in encoded:
+            message = Message()
+            message.decode(data)
+            decode_order(message)
+        decode_time = time.perf_counter() - started
+
+        results.append({
+            "codec": codec.name,
+            "body_encode_us": body_encode_time / num_orders * 1e6,
+            "body_decode_us": body_decode_time / num_orders * 1e6,
+            "message_encode_us": encode_time / num_orders * 1e6,
+            "message_decode_us": decode_time / num_orders * 1e6,
+            "message_bytes": sum(len(data) for data in encoded) / num_orders,
+        })
+    return results
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    print(f"Order codecs: {count} orders per codec, microseconds per order (body only / complete AMQP message)")
+    print(f"{'codec':<10}{'body enc':>10}{'body dec':>10}{'msg enc':>10}{'msg dec':>10}{'msg bytes':>11}")
+    for result in benchmark(count):
+        print(f"{result['codec']:<10}{result['body_encode_us']:>10.2f}{result['body_decode_us']:>10.2f}"
+              f"{result['message_encode_us']:>10.2f}{result['message_decode_us']:>10.2f}{result['message_bytes']:>11.1f}")
+    missing = [codec.name for codec in CODECS.values() if not codec.available]
+    if missing:
+        print(f"Not installed: {', '.join(missing)}")
@@ -0,0 +1,233 @@
+"""
+Bounded deduplication of redelivered orders for the AMQP 1.0 consumer.
+
+RabbitMQ redelivers every message that was not settled, e.g. after a release,
+a consumer crash or a lost connection, so at-least-once delivery means an order
+can reach the consumer more than once. With DEDUP_KEY set, the consumer
+remembers the keys of the orders it has processed and accepts duplicates
+without processing them again.
+
+Keys:
+- order_id: The "order_id" field of every order; the orders of a batch message
+  are checked one by one, and orders without an order_id are always processed.
+- message_id: The AMQP message id, for producers that set one (the whole message
+  is a duplicate or not); messages without an id fall back to their order ids.
+
+The cache keeps at most DEDUP_MAX_ENTRIES keys, evicting the least recently seen
+ones, and with DEDUP_TTL_SECONDS it also forgets keys not seen for that long, so
+memory stays bounded however long the consumer runs. A key is remembered once its
+order has been processed, so an order redelivered while it is still being
+processed is processed twice.
+
+With DEDUP_DB_PATH the keys are also written to a SQLite database, committed
+before the consumer settles the deliveries, and loaded again on startup, so
+duplicates are detected across restarts. The database holds about twice
+DEDUP_MAX_ENTRIES rows at most; older keys are deleted.
+
+Environment variables:
+- DEDUP_KEY: "order_id" or "message_id" (default: unset, no deduplication).
+- DEDUP_MAX_ENTRIES: Keys kept (default 100000).
+- DEDUP_TTL_SECONDS: Forget keys not seen for this long (default 0, only the size bound).
+- DEDUP_DB_PATH: SQLite file persisting the keys (default: unset, memory only);
+  "{consumer}" is replaced by the consumer index, so supervised consumer
+  processes each get their own file.
+"""
+import collections
+import os
+import sqlite3
+import time
+
+DEDUP_KEY = os.getenv("DEDUP_KEY") or None # None = no deduplication
+DEDUP_MAX_ENTRIES = int(os.getenv("DEDUP_MAX_ENTRIES", 100000))
+DEDUP_TTL_SECONDS = float(os.getenv("DEDUP_TTL_SECONDS", 0)) # 0 = keys only leave the cache when evicted
+DEDUP_DB_PATH = os.getenv("DEDUP_DB_PATH") or None # None = memory only
+DEDUP_KEYS = ("order_id", "message_id")
+
+
+class DedupCache:
+    """
+    LRU (and optionally time-windowed) set of processed order keys, optionally persisted to SQLite.
+
+    Used from the reactor thread only.
+
+    Attributes:
+        hits (int): Orders (or messages) found to be duplicates.
+        misses (int): Orders (or messages) not seen before.
+    """
+    def __init__(self, key="order_id", max_entries=100000, ttl_seconds=0, path=None):
+        """
+        Args:
+            key (str): "order_id" or "message_id" (see the module docstring).
+            max_entries (int): Keys kept; the least recently seen are evicted beyond that.
+            ttl_seconds (float): Forget keys not seen for this many seconds (0 for no time limit).
+            path (str): SQLite file persisting the keys, or None to keep them in memory only.
+
+        Raises:
+            ValueError: If the key is not supported.
+        """
+        if key not in DEDUP_KEYS:
+            raise ValueError(f"Unsupported deduplication key '{key}', expected one of: {', '.join(DEDUP_KEYS)}")
+        self.key = key
+        self.max_entries = max(1, max_entries)
+        self.ttl_seconds = ttl_seconds
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict() # key -> time last seen, least recent first
+        self._unsaved = [] # (key, time) not yet written to the database
+        self._saved_since_prune = 0
+        self._db = None
+        if path:
+            self._open(path)
+
+    def _open(self, path):
+        """
+        Opens (or creates) the database and loads the most recently seen keys.
+        """
+        self._db = sqlite3.connect(path)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL") # Durable across process crashes; commits do not fsync
+        self._db.execute("CREATE TABLE IF NOT EXISTS processed_keys (key TEXT PRIMARY KEY, seen_at REAL NOT NULL)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS processed_keys_seen_at ON processed_keys (seen_at)")
+        cutoff = time.time() - self.ttl_seconds if self.ttl_seconds else 0
+        rows = self._db.execute("SELECT key, seen_at FROM processed_keys WHERE seen_at >= ? ORDER BY seen_at DESC LIMIT ?",
+                                (cutoff, self.max_entries)).fetchall()
+        for key, seen_at in reversed(rows):
+            self._entries[key] = seen_at
+        self._prune()
+
+    def _prune(self):
+        """
+        Deletes the database rows of keys older than the oldest key in memory.
+        """
+        oldest = next(iter(self._entries.values()), None)
+        if oldest is not None:
+            self._db.execute("DELETE FROM processed_keys WHERE seen_at < ?", (oldest,))
+        self._db.commit()
+        self._saved_since_prune = 0
+
+    @property
+    def size(self):
+        """
+        int: Number of keys currently cached.
+        """
+        return len(self._entries)
+
+    def _seen(self, key, now):
+        """
+        Returns True if a key was seen within the time window, refreshing it; counts the hit or miss.
+
+        A refreshed key is written again on the next commit, with its new time.
+        """
+        seen_at = self._entries.get(key)
+        if seen_at is not None and (not self.ttl_seconds or now - seen_at <= self.ttl_seconds):
+            self._entries[key] = now
+            self._entries.move_to_end(key)
+            if self._db is not None:
+                self._unsaved.append((key, now)) # Otherwise pruning by age deletes a key still being seen
+            self.hits += 1
+            return True
+        self.misses += 1
+        return False
+
+    def filter(self, message, orders):
+        """
+        Drops the orders of a message that were already processed.
+
+        Args:
+            message (proton.Message): The received message.
+            orders (list): The orders decoded from it.
+
+        Returns:
+            tuple: (orders to process, their keys to pass to `add()` once processed).
+        """
+        now = time.time()
+        message_id = message.id if self.key == "message_id" else None
+        if message_id is not None:
+            key = f"message:{message_id}"
+            return ([], []) if self._seen(key, now) else (orders, [key])
+        fresh, keys = [], []
+        for order in orders:
+            order_id = order.get("order_id")
+            if order_id is None:
+                fresh.append(order)
+            elif not self._seen(f"order:{order_id}", now):
+                fresh.append(order)
+                keys.append(f"order:{order_id}")
+        return fresh, keys
+
+    def add(self, keys):
+        """
+        Remembers the keys of processed orders, evicting the least recently seen and expired keys.
+
+        Args:
+            keys (list): Keys returned by `filter()`.
+        """
+        now = time.time()
+        entries = self._entries
+        for key in keys:
+            entries[key] = now
+            entries.move_to_end(key)
+            if self._db is not None:
+                self._unsaved.append((key, now))
+        while len(entries) > self.max_entries:
+            entries.popitem(last=False)
+        if self.ttl_seconds:
+            cutoff = now - self.ttl_seconds
+            while entries and next(iter(entries.values())) < cutoff:
+                entries.popitem(last=False)
+
+    def commit(self):
+        """
+        Writes the keys added since the last commit to the database, if any.
+
+        The consumer calls this before settling deliveries, so that a processed
+        order is on disk before the broker forgets its message.
+        """
+        if self._db is None or not self._unsaved:
+            return
+        self._db.executemany("INSERT OR REPLACE INTO processed_keys (key, seen_at) VALUES (?, ?)", self._unsaved)
+        self._saved_since_prune += len(self._unsaved)
+        self._unsaved = []
+        if self._saved_since_prune >= self.max_entries:
+            self._prune() # Also commits
+        else:
+            self._db.commit()
+
+    def close(self):
+        """
+        Commits the pending keys and closes the database.
+        """
+        if self._db is not None:
+            self.commit()
+            self._db.close()
+            self._db = None
+
+    def hit_rate(self):
+        """
+        Returns the fraction of checked keys that were duplicates, or None if nothing was checked.
+        """
+        checked = self.hits + self.misses
+        return self.hits / checked if checked else None
+
+    def stats(self):
+        """
+        Returns the hit and miss counts, the hit rate and the number of keys kept.
+        """
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hit_rate(), "entries": self.size}
+
+
+def create_dedup_cache(consumer_index=0):
+    """
+    Returns the DedupCache configured through the environment, or None if deduplication is disabled.
+
+    Args:
+        consumer_index (int): Replaces "{consumer}" in DEDUP_DB_PATH.
+
+    Raises:
+        ValueError: If DEDUP_KEY is not supported.
+    """
+    if DEDUP_KEY is None:
+        return None
+    path = DEDUP_DB_PATH.replace("{consumer}", str(consumer_index)) if DEDUP_DB_PATH else None
+    return DedupCache(DEDUP_KEY, DEDUP_MAX_ENTRIES, DEDUP_TTL_SECONDS, path)
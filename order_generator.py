@@ -0,0 +1,211 @@
+"""
+Bulk generation of random test orders for the AMQP 1.0 producer.
+
+Orders are generated in batches: the items, item numbers and quantities of a
+whole batch are drawn at once, and order ids come from a counter, so they never
+collide within a dataset. Datasets of NUMPY_MIN_ORDERS orders or more are drawn
+with NumPy when it is installed, smaller ones with the standard random module:
+importing NumPy takes longer than it saves below that size, which would delay
+the first message of short producer runs (see startup_profile.py). The ids keep the "ORD_MTLS_XXXXXXXX" format:
+8 hex digits counting up from a base derived from the seed, wrapping after
+2**32 orders.
+
+With a seed the same dataset is generated on every run, for a given number of
+orders, batch size and number of producer shards. Without one a new seed is drawn for each dataset.
+
+Orders can also be encoded into complete AMQP messages ahead of time
+(EncodedMessage), so the producer streams the bytes without encoding them again.
+
+Environment variables:
+- ORDER_SEED: Seed for reproducible datasets (default: unset, a new dataset every run).
+- ORDER_BATCH_SIZE: Orders generated per batch (default 10000).
+
+Running this module directly prints the generation cost per order for the
+available backends:
+
+    python order_generator.py [ORDERS]
+"""
+import os
+import random
+import secrets
+import sys
+import time
+
+from proton import Link
+
+ORDER_SEED = int(os.environ["ORDER_SEED"]) if os.getenv("ORDER_SEED") else None
+ORDER_BATCH_SIZE = int(os.getenv("ORDER_BATCH_SIZE", 10000))
+ORDER_ID_FORMAT = "ORD_MTLS_{:08X}"
+NUMPY_MIN_ORDERS = 100000 # Smallest dataset drawn with NumPy, which takes ~0.1s to import
+
+_numpy = None # The numpy module once imported, False if it is not installed
+
+
+def load_numpy():
+    """
+    Imports NumPy on first use, so producers that do not need it start faster.
+
+    Returns:
+        module: The numpy module, or None if it is not installed.
+    """
+    global _numpy
+    if _numpy is None:
+        try:
+            import numpy
+        except ImportError: # Optional dependency
+            numpy = False
+        _numpy = numpy
+    return _numpy or None
+
+
+class EncodedMessage:
+    """
+    An AMQP message encoded ahead of time.
+
+    Has the `send()` method Proton's Sender.send() looks for, so it can be sent
+    like a proton.Message; the bytes are streamed as they are.
+    """
+    __slots__ = ("data", "orders")
+
+    def __init__(self, data, orders=1):
+        """
+        Args:
+            data (bytes): The encoded message (proton.Message.encode()).
+            orders (int): The number of orders the message carries (see order_batching.py).
+        """
+        self.data = data
+        self.orders = orders
+
+    def send(self, sender, tag=None):
+        """
+        Sends the encoded message on a sender link, as proton.Message.send() does.
+
+        Args:
+            sender (proton.Sender): The sender link.
+            tag (str, optional): The delivery tag (default: the link's next tag).
+
+        Returns:
+            proton.Delivery: The delivery of the message.
+        """
+        delivery = sender.delivery(tag or sender.delivery_tag())
+        sender.stream(self.data)
+        sender.advance()
+        if sender.snd_settle_mode == Link.SND_SETTLED:
+            delivery.settle()
+        return delivery
+
+    def __len__(self):
+        return len(self.data)
+
+    def __repr__(self):
+        return f"<EncodedMessage {len(self.data)} bytes>"
+
+
+def new_seed():
+    """
+    Returns a random seed, for datasets shared by several producer shards.
+    """
+    return secrets.randbits(63)
+
+
+def generate_order_batch(count, items, max_quantity, seed, start=0, use_numpy=None):
+    """
+    Generates a batch of random orders.
+
+    Args:
+        count (int): Number of orders.
+        items (list): Item templates with "id_prefix" and "description" keys.
+        max_quantity (int): Largest quantity per order.
+        seed (int): Dataset seed; together with `start` it fixes the batch contents.
+        start (int): Position of the batch's first order in the dataset, which
+            also numbers its order ids.
+        use_numpy (bool): Draw with NumPy (default: if it is installed and the
+            batch has at least NUMPY_MIN_ORDERS orders).
+
+    Returns:
+        list: The order dictionaries.
+    """
+    if use_numpy is None:
+        use_numpy = count >= NUMPY_MIN_ORDERS
+    numpy = load_numpy() if use_numpy else None
+    if numpy is not None:
+        rng = numpy.random.default_rng([seed, start])
+        item_indexes = rng.integers(0, len(items), count).tolist()
+        numbers = rng.integers(100, 1000, count).tolist()
+        quantities = rng.integers(1, max_quantity + 1, count).tolist()
+    else:
+        rng = random.Random(f"{seed}:{start}")
+        item_indexes = rng.choices(range(len(items)), k=count)
+        numbers = rng.choices(range(100, 1000), k=count)
+        quantities = rng.choices(range(1, max_quantity + 1), k=count)
+
+    id_base = random.Random(seed).getrandbits(32) # The same for every batch of the dataset
+    order_ids = [ORDER_ID_FORMAT.format((id_base + position) & 0xFFFFFFFF) for position in range(start, start + count)]
+    prefixes = [f"{item['id_prefix']}_" for item in items]
+    descriptions = [item["description"] for item in items]
+    return [
+        {"order_id": order_id, "item_id": f"{prefixes[index]}{number}",
+         "description": descriptions[index], "quantity": quantity}
+        for order_id, index, number, quantity in zip(order_ids, item_indexes, numbers, quantities)
+    ]
+
+
+def iter_orders(count, items, max_quantity, seed=None, start=0, batch_size=ORDER_BATCH_SIZE, dataset_size=None):
+    """
+    Lazily generates random orders, one batch at a time.
+
+    Args:
+        count (int): Number of orders.
+        items (list): Item templates with "id_prefix" and "description" keys.
+        max_quantity (int): Largest quantity per order.
+        seed (int, optional): Dataset seed (default ORDER_SEED, or a new random seed).
+        start (int): Position of the first order in the dataset (e.g. of a producer shard).
+        batch_size (int): Orders generated per batch.
+        dataset_size (int, optional): Orders in the whole dataset, of which these are a
+            shard (default `count`). It selects the backend, so all shards draw alike.
+
+    Yields:
+        dict: An order dictionary.
+    """
+    if seed is None:
+        seed = ORDER_SEED if ORDER_SEED is not None else new_seed()
+    end = start + count
+    # Decided for the whole dataset, so all its batches and shards are drawn alike
+    use_numpy = (count if dataset_size is None else dataset_size) >= NUMPY_MIN_ORDERS
+    for batch_start in range(start, end, batch_size):
+        yield from generate_order_batch(min(batch_size, end - batch_start), items, max_quantity, seed, batch_start,
+                                        use_numpy=use_numpy)
+
+
+def encode_orders(orders, codec):
+    """
+    Encodes orders into complete AMQP messages ahead of sending.
+
+    The messages carry no creation_time, so the consumer does not measure
+    end-to-end latency for them.
+
+    Args:
+        orders (iterable): The order dictionaries.
+        codec (order_codecs.OrderCodec): The codec used for the message bodies.
+
+    Returns:
+        list: One EncodedMessage per order.
+    """
+    return [EncodedMessage(codec.message(order).encode()) for order in orders]
+
+
+if __name__ == "__main__":
+    from producer import MAX_QUANTITY, POSSIBLE_ITEMS
+
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    print(f"Order generation: {total} orders in batches of {ORDER_BATCH_SIZE}")
+    for backend in ("numpy", "random"):
+        if backend == "numpy" and load_numpy() is None:
+            print("numpy: not installed")
+            continue
+        started = time.perf_counter()
+        for batch_start in range(0, total, ORDER_BATCH_SIZE):
+            generate_order_batch(min(ORDER_BATCH_SIZE, total - batch_start), POSSIBLE_ITEMS, MAX_QUANTITY,
+                                 seed=1, start=batch_start, use_numpy=backend == "numpy")
+        elapsed = time.perf_counter() - started
+        print(f"{backend:<8}{elapsed / total * 1e6:>8.2f} us/order{total / elapsed:>14,.0f} orders/s")
@@ -0,0 +1,142 @@
+"""
+Per-order routing of the producer's messages to several AMQP target addresses.
+
+By default every order goes to TARGET_NODE. With ROUTE_BY set, the producer
+picks a target address for each order and sends it on a sender link to that
+address; all links share the producer's single mTLS connection (see
+RoutedOrderProducer in producer.py).
+
+Routing modes (ROUTE_BY):
+- item_prefix: The longest prefix in ROUTES matching the order's "item_id";
+  e.g. ROUTES="ITEM_A=/exchanges/order_exchange/widgets,ITEM_B=/queues/gadgets".
+- module:function: A function importable from the producer's Python path, called
+  with each order dictionary and returning a target address.
+Orders without a match (or for which the function returns None) go to TARGET_NODE.
+
+Environment variables:
+- ROUTE_BY: "item_prefix" or "module:function" (default: unset, no routing).
+- ROUTES: Comma-separated "prefix=address" pairs for item_prefix routing.
+- ROUTE_IDLE_SECONDS: Close the link of a route idle for this long; it is opened
+  again on the next order (default 30).
+- ROUTE_QUEUE_LIMIT: Orders held per route while its link has no credit; reading
+  from the source pauses when a route's queue is full (default 100).
+"""
+import importlib
+import os
+
+ROUTE_BY = os.getenv("ROUTE_BY") or None # None = every order goes to TARGET_NODE
+ROUTES = os.getenv("ROUTES", "")
+ROUTE_IDLE_SECONDS = float(os.getenv("ROUTE_IDLE_SECONDS", 30.0))
+ROUTE_QUEUE_LIMIT = int(os.getenv("ROUTE_QUEUE_LIMIT", 100))
+
+
+class OrderRouter:
+    """
+    Picks the target address of each order.
+
+    Attributes:
+        default_target (str): The address of orders the routing function has no target for.
+        description (str): How orders are routed, for the log.
+    """
+    def __init__(self, function, default_target, description="custom function"):
+        """
+        Args:
+            function (callable): Called with an order dictionary; returns its target address or None.
+            default_target (str): The address used when the function returns None.
+            description (str): How orders are routed, for the log.
+        """
+        self.function = function
+        self.default_target = default_target
+        self.description = description
+
+    def route(self, order):
+        """
+        Returns the target address of an order.
+
+        Args:
+            order (dict): The order dictionary.
+        """
+        return self.function(order) or self.default_target
+
+
+def parse_routes(text):
+    """
+    Parses "prefix=address" pairs separated by commas.
+
+    Args:
+        text (str): The ROUTES setting.
+
+    Returns:
+        dict: Target address by prefix.
+
+    Raises:
+        ValueError: If a pair has no "=", an empty prefix or an empty address.
+    """
+    routes = {}
+    for pair in text.split(","):
+        if not pair.strip():
+            continue
+        prefix, separator, address = pair.partition("=")
+        if not separator or not prefix.strip() or not address.strip():
+            raise ValueError(f"Invalid route '{pair.strip()}', expected prefix=address")
+        routes[prefix.strip()] = address.strip()
+    return routes
+
+
+def item_prefix_router(routes, default_target):
+    """
+    Returns an OrderRouter sending each order to the route with the longest prefix of its item_id.
+
+    Args:
+        routes (dict): Target address by item_id prefix.
+        default_target (str): The address of orders matching no prefix.
+    """
+    prefixes = sorted(routes, key=len, reverse=True)
+
+    def route(order):
+        item_id = str(order.get("item_id", ""))
+        for prefix in prefixes:
+            if item_id.startswith(prefix):
+                return routes[prefix]
+        return None
+
+    return OrderRouter(route, default_target, f"item_id prefix ({len(routes)} route(s))")
+
+
+def load_route_function(spec):
+    """
+    Imports a routing function given as "module:function".
+
+    Raises:
+        ValueError: If the spec is malformed or the function cannot be imported.
+    """
+    module_name, separator, function_name = spec.partition(":")
+    if not separator or not module_name or not function_name:
+        raise ValueError(f"Invalid ROUTE_BY '{spec}', expected 'item_prefix' or 'module:function'")
+    try:
+        function = getattr(importlib.import_module(module_name), function_name)
+    except (ImportError, AttributeError) as e:
+        raise ValueError(f"Cannot load the routing function '{spec}': {e}") from e
+    if not callable(function):
+        raise ValueError(f"The routing function '{spec}' is not callable")
+    return function
+
+
+def create_router(default_target):
+    """
+    Returns the OrderRouter configured through the environment, or None if routing is disabled.
+
+    Args:
+        default_target (str): The address of orders without a route (TARGET_NODE).
+
+    Raises:
+        ValueError: If ROUTE_BY or ROUTES is invalid.
+    """
+    if ROUTE_BY is None:
+        return None
+    if ROUTE_BY == "item_prefix":
+        routes = parse_routes(ROUTES)
+        if not routes:
+            raise ValueError("ROUTE_BY=item_prefix needs at least one prefix=address pair in ROUTES")
+        return item_prefix_router(routes, default_target)
+    return OrderRouter(load_route_function(ROUTE_BY), default_target, ROUTE_BY)
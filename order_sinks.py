@@ -0,0 +1,111 @@
+"""
+Bulk sinks for the consumer's micro-batch pipeline.
+
+Downstream work such as database inserts or HTTP calls costs far less per order
+when done in bulk. With CONSUMER_SINK set, the consumer buffers decoded orders
+into micro-batches of up to SINK_BATCH_SIZE orders, or the orders received
+within SINK_BATCH_TIMEOUT_MS, and hands each batch to the sink in one call. The
+messages of a batch are accepted once the sink has committed it, and released
+if it fails, so they are delivered again (at-least-once).
+
+A sink is any object with:
+- write(orders): Durably stores a list of order dictionaries, or raises.
+- close(): Releases its resources.
+Both are called from the consumer's sink writer thread, one batch at a time.
+
+Sinks (CONSUMER_SINK):
+- sqlite: The reference sink, inserting every batch into the "orders" table of
+  SINK_SQLITE_PATH in one transaction ("{consumer}" in the path is replaced by the
+  consumer index). A redelivered order replaces its earlier row (keyed on order_id).
+- module:factory: A callable importable from the consumer's Python path, called
+  without arguments, that returns a sink.
+
+Environment variables:
+- CONSUMER_SINK: "sqlite" or "module:factory" (default: unset, orders are processed one by one).
+- SINK_BATCH_SIZE: Maximum orders per batch (default 500).
+- SINK_BATCH_TIMEOUT_MS: Maximum time an order waits for its batch to fill (default 50).
+- SINK_SQLITE_PATH: Database file of the sqlite sink (default "orders.db").
+"""
+import importlib
+import json
+import os
+import sqlite3
+import time
+
+CONSUMER_SINK = os.getenv("CONSUMER_SINK") or None # None = no micro-batch pipeline
+SINK_BATCH_SIZE = int(os.getenv("SINK_BATCH_SIZE", 500))
+SINK_BATCH_TIMEOUT_MS = float(os.getenv("SINK_BATCH_TIMEOUT_MS", 50))
+SINK_SQLITE_PATH = os.getenv("SINK_SQLITE_PATH", "orders.db")
+
+
+class SQLiteOrderSink:
+    """
+    Inserts each batch of orders into a SQLite table in a single transaction.
+
+    Attributes:
+        path (str): The database file.
+        rows_written (int): Rows inserted or replaced so far.
+    """
+    def __init__(self, path):
+        """
+        Args:
+            path (str): The database file, created if needed.
+        """
+        self.path = path
+        self.rows_written = 0
+        # Created on the reactor thread, then used by the sink writer thread only
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("PRAGMA busy_timeout=5000") # Supervised consumers may share the file
+        self._db.execute("CREATE TABLE IF NOT EXISTS orders (order_id TEXT PRIMARY KEY, item_id TEXT, "
+                         "quantity INTEGER, payload TEXT NOT NULL, stored_at REAL NOT NULL)")
+        self._db.commit()
+
+    def write(self, orders):
+        """
+        Inserts a batch of orders, replacing the rows of orders already stored.
+
+        Args:
+            orders (list): The order dictionaries.
+
+        Raises:
+            sqlite3.Error: If the batch cannot be committed; nothing of it is stored then.
+        """
+        now = time.time()
+        rows = [(str(order.get("order_id")), order.get("item_id"), order.get("quantity"),
+                 json.dumps(order, separators=(",", ":"), default=str), now) for order in orders]
+        with self._db: # One transaction, rolled back on error
+            self._db.executemany("INSERT OR REPLACE INTO orders (order_id, item_id, quantity, payload, stored_at) "
+                                 "VALUES (?, ?, ?, ?, ?)", rows)
+        self.rows_written += len(rows)
+
+    def close(self):
+        self._db.close()
+
+    def __repr__(self):
+        return f"<SQLiteOrderSink {self.path}>"
+
+
+def create_sink(consumer_index=0):
+    """
+    Returns the sink configured through the environment, or None if the micro-batch pipeline is disabled.
+
+    Args:
+        consumer_index (int): Replaces "{consumer}" in SINK_SQLITE_PATH.
+
+    Raises:
+        ValueError: If CONSUMER_SINK is malformed or the factory cannot be imported.
+    """
+    if CONSUMER_SINK is None:
+        return None
+    if CONSUMER_SINK == "sqlite":
+        return SQLiteOrderSink(SINK_SQLITE_PATH.replace("{consumer}", str(consumer_index)))
+    module_name, separator, factory_name = CONSUMER_SINK.partition(":")
+    if not separator or not module_name or not factory_name:
+        raise ValueError(f"Invalid CONSUMER_SINK '{CONSUMER_SINK}', expected 'sqlite' or 'module:factory'")
+    try:
+        factory = getattr(importlib.import_module(module_name), factory_name)
+    except (ImportError, AttributeError) as e:
+        raise ValueError(f"Cannot load the sink factory '{CONSUMER_SINK}': {e}") from e
+    return factory()
@@ -0,0 +1,336 @@
+"""
+Durable write-ahead spool between the producer's order source and its sender links.
+
+Without a spool, the producer pulls orders from its source only when a link has
+credit, and the orders not yet sent are lost when the connection cannot be
+established or fails. With SPOOL_DIR set, an intake thread encodes every order (or
+batch) into an AMQP message as soon as it is read and appends it to the spool, whether
+or not the broker is reachable. The reactor thread drains the spool in order and
+a message is removed once the broker has settled it. Messages still on disk when
+the producer stops (broker down, connection error, Ctrl+C) are sent first on the
+next run.
+
+The spool is a directory of append-only segment files, each preallocated to
+SPOOL_SEGMENT_BYTES and memory-mapped:
+- A 16-byte header: the magic b"OSP1", 4 reserved bytes and, as a big-endian
+  64-bit integer, the offset up to which every record has been settled.
+- Records, each a 12-byte header (payload length, number of orders and the
+  CRC-32 of the payload, big-endian 32-bit integers) followed by the payload,
+  the encoded AMQP message. A zero length marks the end of the written records.
+Reading a segment back is a sequential scan, and replayed records are streamed
+to the links as they are (see order_generator.EncodedMessage). A segment is
+deleted once it is full and all its records are settled. A record torn by a
+crash fails its CRC check and ends the scan of its segment.
+
+Records are in the page cache as soon as they are appended, so they survive a
+crash of the producer process; they reach the disk when a segment is full, when
+the spool is closed, or when the operating system writes them back.
+Messages settled by the broker just before a crash may be sent again
+(at-least-once); see order_dedup.py for dropping them on the consumer.
+
+Environment variables:
+- SPOOL_DIR: Directory holding the spool segments (default: unset, no spool).
+- SPOOL_SEGMENT_BYTES: Size of each segment file (default 16 MiB); larger messages
+  get a segment of their own.
+"""
+import collections
+import logging
+import mmap
+import os
+import struct
+import threading
+import zlib
+
+from order_generator import EncodedMessage
+
+SPOOL_DIR = os.getenv("SPOOL_DIR") or None # None = no spool
+SPOOL_SEGMENT_BYTES = int(os.getenv("SPOOL_SEGMENT_BYTES", 16 * 1024 * 1024))
+
+SEGMENT_MAGIC = b"OSP1"
+SEGMENT_SUFFIX = ".spool"
+
+_SEGMENT_HEADER = struct.Struct(">4s4xQ") # magic, reserved, settled offset
+_RECORD_HEADER = struct.Struct(">III") # payload length, orders, CRC-32
+
+log = logging.getLogger("producer.spool")
+
+
+class SpoolRecord(EncodedMessage):
+    """
+    A message read back from the spool; sent like any EncodedMessage and passed to `OrderSpool.ack()` once settled.
+    """
+    __slots__ = ("segment", "end")
+
+    def __init__(self, data, orders, segment, end):
+        super().__init__(data, orders)
+        self.segment = segment
+        self.end = end
+
+    def __repr__(self):
+        return f"<SpoolRecord {len(self.data)} bytes, {self.orders} order(s)>"
+
+
+class _Segment:
+    """
+    One memory-mapped segment file and the positions of its writer, reader and settled records.
+    """
+    def __init__(self, path, size=None):
+        """
+        Opens an existing segment or, with `size`, creates one of that size.
+        """
+        self.path = path
+        created = size is not None
+        if created:
+            self.file = open(path, "w+b")
+            self.file.truncate(size)
+        else:
+            self.file = open(path, "r+b")
+            size = os.fstat(self.file.fileno()).st_size
+        self.size = size
+        self.mm = mmap.mmap(self.file.fileno(), size)
+        if created:
+            _SEGMENT_HEADER.pack_into(self.mm, 0, SEGMENT_MAGIC, _SEGMENT_HEADER.size)
+        self.settled = _SEGMENT_HEADER.unpack_from(self.mm, 0)[1] # Every record before this offset is settled
+        self.end = self.settled # End of the written records
+        self.read_offset = self.settled
+        self.sealed = False # No more records will be appended
+        self.unsettled = collections.deque() # End offsets of the records read and not settled yet, in order
+        self.settled_ends = set() # Records settled ahead of an earlier one
+
+    def scan(self):
+        """
+        Finds the end of the records written by a previous run, and seals the segment.
+
+        Returns:
+            tuple: (records, orders) left to send.
+        """
+        records = orders = 0
+        offset = self.settled
+        while offset + _RECORD_HEADER.size <= self.size:
+            length, count, crc = _RECORD_HEADER.unpack_from(self.mm, offset)
+            end = offset + _RECORD_HEADER.size + length
+            if not length or end > self.size or zlib.crc32(self.mm[offset + _RECORD_HEADER.size:end]) != crc:
+                break
+            records += 1
+            orders += count
+            offset = end
+        self.end = offset
+        self.sealed = True
+        return records, orders
+
+    def close(self, flush=True):
+        if flush:
+            self.mm.flush()
+        self.mm.close()
+        self.file.close()
+
+
+class OrderSpool:
+    """
+    Append-only, memory-mapped spool of encoded messages.
+
+    One thread appends (`append()`, `finish()`) while the reactor thread reads
+    (`read()`) and settles (`ack()`); a lock guards the segment list and positions.
+
+    Attributes:
+        appended (int): Messages appended in this run.
+        recovered (int): Messages left by a previous run, found on opening.
+        recovered_orders (int): The orders they carry.
+        acked (int): Messages settled and removed from the spool.
+    """
+    def __init__(self, directory, segment_bytes=SPOOL_SEGMENT_BYTES):
+        """
+        Opens the spool in a directory, creating it if needed, and recovers the
+        messages a previous run did not get settled.
+
+        Args:
+            directory (str): The spool directory.
+            segment_bytes (int): Size of each new segment file.
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.segment_bytes = max(segment_bytes, _SEGMENT_HEADER.size + _RECORD_HEADER.size)
+        self.appended = 0
+        self.acked = 0
+        self.recovered = 0
+        self.recovered_orders = 0
+        self.finished = False # Set once nothing more will be appended
+        self._lock = threading.Lock()
+        self._segments = collections.deque() # Oldest first; the last one is being written unless sealed
+        self._reader = 0 # Index in _segments of the segment being read
+        self._next_number = 0
+        self._waiting = False # The reader found nothing and wants `wakeup` called on the next append
+        self.wakeup = None # Called from the appending thread when a waiting reader has something to read
+        names = sorted(name for name in os.listdir(directory)
+                       if name.endswith(SEGMENT_SUFFIX) and name[:-len(SEGMENT_SUFFIX)].isdigit())
+        for name in names:
+            segment = _Segment(os.path.join(directory, name))
+            if segment.mm[:4] != SEGMENT_MAGIC:
+                log.warning(f"Ignoring {segment.path}: not a spool segment")
+                segment.close(flush=False)
+                continue
+            records, orders = segment.scan()
+            self._next_number = int(name[:-len(SEGMENT_SUFFIX)]) + 1
+            if not records:
+                self._remove(segment)
+                continue
+            self._segments.append(segment)
+            self.recovered += records
+            self.recovered_orders += orders
+
+    def _new_segment(self, size):
+        """
+        Creates the next segment file; called with the lock held.
+        """
+        path = os.path.join(self.directory, f"{self._next_number:010d}{SEGMENT_SUFFIX}")
+        self._next_number += 1
+        segment = _Segment(path, size)
+        self._segments.append(segment)
+        return segment
+
+    @staticmethod
+    def _remove(segment):
+        segment.close(flush=False)
+        os.unlink(segment.path)
+
+    def append(self, data, orders=1):
+        """
+        Appends an encoded message, starting a new segment when the current one is full.
+
+        Args:
+            data (bytes): The encoded AMQP message.
+            orders (int): The number of orders it carries.
+        """
+        needed = _RECORD_HEADER.size + len(data)
+        with self._lock:
+            segment = self._segments[-1] if self._segments and not self._segments[-1].sealed else None
+            if segment is None or segment.end + needed > segment.size:
+                if segment is not None:
+                    segment.sealed = True
+                    segment.mm.flush()
+                    self._drop_settled()
+                segment = self._new_segment(max(self.segment_bytes, _SEGMENT_HEADER.size + needed))
+            offset = segment.end
+            body = offset + _RECORD_HEADER.size
+            segment.mm[body:body + len(data)] = data
+            _RECORD_HEADER.pack_into(segment.mm, offset, len(data), orders, zlib.crc32(data))
+            segment.end = body + len(data)
+            self.appended += 1
+            waiting, self._waiting = self._waiting, False
+        wakeup = self.wakeup # Read once: the reader may clear it at any time
+        if waiting and wakeup:
+            wakeup()
+
+    def finish(self):
+        """
+        Marks the end of the appended messages: once they are read, `read()` reports the spool as exhausted.
+        """
+        with self._lock:
+            self.finished = True
+            if self._segments:
+                self._segments[-1].sealed = True
+            waiting, self._waiting = self._waiting, False
+        wakeup = self.wakeup
+        if waiting and wakeup:
+            wakeup()
+
+    def read(self):
+        """
+        Returns the next message in spool order, or None if there is none yet (or, after `finish()`, none left).
+
+        Returns:
+            SpoolRecord: The message, to be passed to `ack()` once the broker has settled it.
+        """
+        with self._lock:
+            while self._reader < len(self._segments):
+                segment = self._segments[self._reader]
+                if segment.read_offset < segment.end:
+                    offset = segment.read_offset
+                    length, orders, _ = _RECORD_HEADER.unpack_from(segment.mm, offset)
+                    body = offset + _RECORD_HEADER.size
+                    segment.read_offset = body + length
+                    segment.unsettled.append(segment.read_offset)
+                    return SpoolRecord(segment.mm[body:body + length], orders, segment, segment.read_offset)
+                if not segment.sealed:
+                    break
+                self._reader += 1
+            self._waiting = not self.finished
+            return None
+
+    def exhausted(self):
+        """
+        Returns True once `finish()` was called and every appended message has been read.
+        """
+        with self._lock:
+            return self.finished and self._reader >= len(self._segments)
+
+    def ack(self, record):
+        """
+        Marks a message as settled by the broker. Settled messages are removed from
+        the spool in order; a segment whose messages are all settled is deleted.
+
+        Args:
+            record (SpoolRecord): A message returned by `read()`.
+        """
+        segment = record.segment
+        with self._lock:
+            segment.settled_ends.add(record.end)
+            settled = segment.settled
+            while segment.unsettled and segment.unsettled[0] in segment.settled_ends:
+                settled = segment.unsettled.popleft()
+                segment.settled_ends.discard(settled)
+            if settled != segment.settled:
+                segment.settled = settled
+                _SEGMENT_HEADER.pack_into(segment.mm, 0, SEGMENT_MAGIC, settled)
+            self.acked += 1
+            self._drop_settled()
+
+    def _drop_settled(self):
+        """
+        Deletes the oldest segments once they are sealed, fully read and fully settled; called with the lock held.
+        """
+        while self._reader > 0:
+            segment = self._segments[0]
+            if segment.settled < segment.end:
+                return
+            self._segments.popleft()
+            self._reader -= 1
+            self._remove(segment)
+
+    def pending(self):
+        """
+        Returns the number of segment files and the bytes of records not settled yet.
+        """
+        with self._lock:
+            return len(self._segments), sum(segment.end - segment.settled for segment in self._segments)
+
+    def close(self):
+        """
+        Flushes and closes the segments; those whose messages are all settled are deleted.
+
+        Call it once nothing is appended, read or settled any more.
+        """
+        with self._lock:
+            for segment in self._segments:
+                if segment.settled >= segment.end:
+                    self._remove(segment)
+                else:
+                    segment.close()
+            self._segments.clear()
+            self._reader = 0
+
+
+def open_spool(shard_index=0, shard_count=1):
+    """
+    Opens the spool configured through the environment, or returns None if spooling is disabled.
+
+    Producer processes sharing SPOOL_DIR each get a "shard-N" subdirectory.
+
+    Args:
+        shard_index (int): The producer shard (0-based).
+        shard_count (int): The total number of producer shards.
+    """
+    if SPOOL_DIR is None:
+        return None
+    directory = os.path.join(SPOOL_DIR, f"shard-{shard_index}") if shard_count > 1 else SPOOL_DIR
+    return OrderSpool(directory, SPOOL_SEGMENT_BYTES)
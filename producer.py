@@ -12,23 +12,97 @@ Environment variables are used for configuration, with defaults provided.
 - VHOST: The virtual host to connect to, in Proton format (e.g., "vhost:my_vhost").
 - PRODUCER_USER: The username for authentication.
 - PRODUCER_PASSWORD: The password for authentication.
+- SASL_MECHANISMS: SASL mechanisms offered to the broker (default "PLAIN"); "EXTERNAL"
+  authenticates with the client certificate alone (RabbitMQ's rabbitmq_auth_mechanism_ssl).
 - TARGET_NODE: The AMQP target address (e.g., "/exchanges/my_exchange/routing_key").
+- ROUTE_BY, ROUTES, ROUTE_IDLE_SECONDS, ROUTE_QUEUE_LIMIT: Send each order to a target
+  address picked by item_id prefix or by a function, over sender links opened on
+  demand on the same connection and closed when idle (default: unset, every order
+  goes to TARGET_NODE; see order_routing.py).
 - NUM_ORDERS_TO_SEND: Number of random orders to generate and send.
+- ORDERS_SOURCE: Where orders come from: "random" (default) generates NUM_ORDERS_TO_SEND
+  orders lazily, "-" reads JSON Lines from stdin, any other value is a JSON Lines file path.
+- ORDER_SEED, ORDER_BATCH_SIZE: Seed for a reproducible random dataset and the number of
+  orders generated per batch (see order_generator.py).
+- PREENCODE_ORDERS: If "true", all orders are read or generated and encoded into AMQP
+  messages before the connection is opened, so the send loop only streams bytes
+  (default "false"; the messages then carry no creation_time).
+- MESSAGE_BATCH_SIZE, MESSAGE_BATCH_TIMEOUT_MS, MESSAGE_BATCH_FORMAT: Pack up to N orders,
+  or the orders read within T ms, into each AMQP message as a JSON array, an AMQP list or
+  length-prefixed frames (default 1, no batching; see order_batching.py).
+- DELIVERY_MODE: "at-least-once" (default) waits for the broker to accept every message;
+  "at-most-once" sends pre-settled messages (AtMostOnce link option) with no outcome or
+  disposition tracking, so messages can be lost, e.g. when the connection drops. The run
+  then ends once every message is sent, and its throughput counts sent messages.
+- BURST_SEND: If "true", drain all available link credit on each sendable event
+  instead of sending a single message per event (default "false").
+- MAX_SENDS_PER_EVENT: Optional cap on messages sent per sendable event in burst mode,
+  so other reactor work still gets a turn (default 0, no cap).
+- MAX_IN_FLIGHT, MAX_UNSETTLED_BYTES: Bound the messages, and the encoded bytes, sent and
+  not yet settled by the broker; pulling from the order source pauses at the limit and
+  resumes as messages are settled, and the time spent paused is reported (default 0, no
+  limit beyond the broker's link credit).
+- PRODUCER_PROCESSES: Number of producer processes the order stream is split across,
+  each with its own container and mTLS connection (default 1).
+- PRODUCER_LINKS: Number of sender links opened on each connection (default 1).
+- ORDER_CODEC: How orders are serialized: "json" (default), "orjson", "msgpack" or "amqp"
+  (native AMQP map body); the consumer picks the decoder from the message content type.
+- METRICS_PORT, METRICS_JSON_INTERVAL: Expose send-to-accept latency, throughput, credit
+  stall and byte counters as a Prometheus endpoint or periodic JSON snapshots (see metrics.py).
+- LOG_LEVEL, LOG_MESSAGE_RATE, LOG_SUMMARY_INTERVAL, LOG_ASYNC: Log level, per-message log
+  rate limit, interval of the "N sent in the last 5s" summaries and background log
+  writing (see log_setup.py).
+- SPOOL_DIR, SPOOL_SEGMENT_BYTES: Append every order to a memory-mapped write-ahead spool
+  as soon as it is read, drain the spool in order and remove messages once the broker
+  settles them; messages left on disk are sent first on the next run (default: unset,
+  no spool; see order_spool.py).
+- PRODUCER_RECONNECT: If "true", reconnect with exponential backoff when the connection
+  drops and resend only the messages the broker had not confirmed (default "false").
+  Authentication, SASL and certificate errors stop the run instead of being retried.
+- RABBITMQ_URLS: Optional comma-separated list of broker URLs tried in turn on each
+  (re)connect attempt (default: the URL built from RABBITMQ_HOST and RABBITMQ_PORT).
+- RECONNECT_INITIAL_DELAY, RECONNECT_MAX_DELAY: First and largest delay in seconds
+  between reconnect attempts; the delay doubles on each failed attempt (default 0.5, 30).
+- RECONNECT_MAX_ATTEMPTS: Give up after this many failed attempts in a row (default 0, never).
 - Certificate paths (CA_CERT_PATH, PRODUCER_CLIENT_CERT_PATH, PRODUCER_CLIENT_KEY_PATH)
   are derived relative to this script's location, assuming a 'certs/' subdirectory.
+  The SSL domain is loaded once per process and TLS sessions are resumed on later
+  connections when the broker allows it (see tls_context.py, TLS_SESSION_RESUMPTION).
+- STARTUP_PROFILE: If "true", log how long each startup phase took, from the imports to
+  the first message sent (default "false"; see startup_profile.py). Optional modules such
+  as NumPy and the metrics HTTP server are only imported when used.
 """
+from startup_profile import startup # Imported first, so the profile's import phase covers the others
+
+import itertools
 import json
+import logging
 import os
-import random
-import uuid # To generate unique order_ids
+import sys
+import threading
+import time
+from collections import Counter, deque
 from dotenv import load_dotenv
 
-from proton import Message, SSLDomain
+from proton import Endpoint
 from proton.handlers import MessagingHandler
-from proton.reactor import Container
+from proton.reactor import ApplicationEvent, AtMostOnce, Backoff, Container, EventInjector
+
+from log_setup import LogSummary, configure_logging, flush_logging, get_message_logger
+from metrics import ProducerMetrics, metrics_enabled, start_exporters
+from order_batching import BATCH_COUNT_PROPERTY, OrderFeed, create_batcher, encode_batches
+from order_codecs import ORDER_CODEC, get_codec
+from order_generator import ORDER_SEED, EncodedMessage, encode_orders, iter_orders, new_seed
+from order_routing import ROUTE_IDLE_SECONDS, ROUTE_QUEUE_LIMIT, create_router
+from order_spool import SpoolRecord, open_spool
+from tls_context import defer_default_ssl_domains, get_tls_context
 
+startup.mark("import")
 load_dotenv()
 
+log = logging.getLogger("producer")
+message_log = get_message_logger("producer.messages") # Per-message lines, rate-limited
+
 RABBITMQ_HOST = os.getenv("RABBITMQ_HOST", "rabbitmq.labs.dontesta.it")
 RABBITMQ_PORT = int(os.getenv("RABBITMQ_PORT", 5671))
 VHOST_NAME_ONLY = "logistics_vhost" # Pure vhost name
@@ -36,6 +110,7 @@ VHOST_PROTON_FORMAT = f"vhost:{VHOST_NAME_ONLY}" # Format for Proton
 VHOST = os.getenv("VHOST", VHOST_PROTON_FORMAT) # Use the correct format
 PRODUCER_USER = os.getenv("PRODUCER_USER", "order_sender")
 PRODUCER_PASSWORD = os.getenv("PRODUCER_PASSWORD", "OrderSenderP@ssw0rd")
+SASL_MECHANISMS = os.getenv("SASL_MECHANISMS", "PLAIN") # "EXTERNAL" authenticates with the client certificate
 
 # Certificate paths for mTLS
 # Ensure these paths are correct or use absolute paths
@@ -50,6 +125,8 @@ CONNECTION_URL = f"amqps://{RABBITMQ_HOST}:{RABBITMQ_PORT}/"
 
 # --- Configuration for random order generation ---
 NUM_ORDERS_TO_SEND = int(os.getenv("NUM_ORDERS_TO_SEND", 5)) # Number of orders to generate
+ORDERS_SOURCE = os.getenv("ORDERS_SOURCE", "random") # "random", "-" (stdin) or a JSONL file path
+PREENCODE_ORDERS = os.getenv("PREENCODE_ORDERS", "false").lower() in ("1", "true", "yes")
 POSSIBLE_ITEMS = [
     {"id_prefix": "ITEM_A", "description": "Amazing Widget"},
     {"id_prefix": "ITEM_B", "description": "Brilliant Gadget"},
@@ -60,6 +137,65 @@ POSSIBLE_ITEMS = [
 MAX_QUANTITY = 10
 # --- End of order generation configuration ---
 
+# --- Configuration for the send loop ---
+DELIVERY_MODE = os.getenv("DELIVERY_MODE", "at-least-once") # "at-least-once" or "at-most-once"
+BURST_SEND = os.getenv("BURST_SEND", "false").lower() in ("1", "true", "yes")
+MAX_SENDS_PER_EVENT = int(os.getenv("MAX_SENDS_PER_EVENT", 0)) # 0 = drain all available credit
+PRODUCER_PROCESSES = int(os.getenv("PRODUCER_PROCESSES", 1)) # Processes sharing the order stream
+PRODUCER_LINKS = int(os.getenv("PRODUCER_LINKS", 1)) # Sender links per connection
+MAX_IN_FLIGHT = int(os.getenv("MAX_IN_FLIGHT", 0)) # Unsettled messages, 0 = bounded by link credit only
+MAX_UNSETTLED_BYTES = int(os.getenv("MAX_UNSETTLED_BYTES", 0)) # Unsettled encoded bytes, 0 = no limit
+# --- End of send loop configuration ---
+
+# --- Configuration for reconnect ---
+PRODUCER_RECONNECT = os.getenv("PRODUCER_RECONNECT", "false").lower() in ("1", "true", "yes")
+RABBITMQ_URLS = [url.strip() for url in os.getenv("RABBITMQ_URLS", "").split(",") if url.strip()]
+RECONNECT_INITIAL_DELAY = float(os.getenv("RECONNECT_INITIAL_DELAY", 0.5)) # Seconds
+RECONNECT_MAX_DELAY = float(os.getenv("RECONNECT_MAX_DELAY", 30.0)) # Seconds
+RECONNECT_MAX_ATTEMPTS = int(os.getenv("RECONNECT_MAX_ATTEMPTS", 0)) # 0 = retry forever
+# Transport errors that reconnecting cannot fix: rejected credentials or certificates
+FATAL_TRANSPORT_CONDITIONS = ("amqp:unauthorized-access",)
+FATAL_TRANSPORT_ERRORS = ("certificate", "unknown ca", "sasl") # Matched in the lowercased description
+# --- End of reconnect configuration ---
+startup.mark("config")
+
+class _ReactorCallback:
+    """
+    Adapts a plain callable to the Qpid Proton timer task interface.
+
+    Instances can be passed to `Container.schedule()`; the callable is invoked
+    with the timer event on the reactor thread.
+    """
+    def __init__(self, callback):
+        self.callback = callback
+
+    def on_timer_task(self, event):
+        self.callback(event)
+
+class ReconnectBackoff:
+    """
+    Exponential backoff between reconnect attempts, for `Container.connect(reconnect=...)`.
+
+    Proton iterates the policy again after every successful connection, so the
+    delay starts over from `initial_delay` for each new outage. Each delay applies
+    to a full pass over the broker URLs.
+    """
+    def __init__(self, initial_delay=0.5, max_delay=30.0, max_attempts=0):
+        """
+        Args:
+            initial_delay (float): Delay in seconds before the second attempt (the first is immediate).
+            max_delay (float): Upper bound in seconds for the doubling delay.
+            max_attempts (int): Attempts per outage before giving up (0 means retry forever).
+        """
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.max_attempts = max_attempts
+
+    def __iter__(self):
+        # A Backoff only yields its delays once, so a fresh one is built for every outage
+        return iter(Backoff(initial=self.initial_delay, factor=2.0, max_delay=self.max_delay,
+                            max_tries=self.max_attempts or None))
+
 class OrderProducer(MessagingHandler):
     """
     A Qpid Proton MessagingHandler for producing order messages to RabbitMQ.
@@ -67,124 +203,675 @@ class OrderProducer(MessagingHandler):
     This class handles AMQP 1.0 events to establish an mTLS connection,
     create a sender link, send messages, and manage message confirmations and errors.
     """
-    def __init__(self, server_url, target_address, orders_to_send):
+    def __init__(self, server_url, target_address, orders_to_send, burst_send=False, max_sends_per_event=0,
+                 total_messages=None, links=1, reconnect=None, failover_urls=(), codec=None,
+                 metrics=False, metrics_port_offset=0, batcher=None, delivery_mode="at-least-once",
+                 max_in_flight=0, max_unsettled_bytes=0, spool=None, startup=None):
         """
         Initializes the OrderProducer.
 
+        Orders are pulled from `orders_to_send` one at a time, only when the link
+        has credit, so lazy sources (generators, file readers) are never materialized.
+
         Args:
             server_url (str): The AMQP connection URL (e.g., "amqps://host:port/").
             target_address (str): The AMQP target node address (e.g., "/exchanges/my_exchange/routing_key").
-            orders_to_send (list): A list of order dictionaries to send.
+            orders_to_send (iterable): A list, iterator or generator of order dictionaries to send,
+                or of EncodedMessage objects encoded ahead of time.
+            burst_send (bool): If True, send as many messages as the link credit allows
+                on each sendable event; otherwise send one message per event.
+            max_sends_per_event (int): In burst mode, the maximum number of messages sent
+                before yielding back to the reactor (0 means no cap).
+            total_messages (int): The number of orders to send, if known. Defaults to
+                `len(orders_to_send)` for sized sources and None (unknown) otherwise; pass it
+                explicitly for EncodedMessage batches.
+            links (int): The number of sender links to open on the connection. All links
+                share the same order source; each is driven by its own credit.
+            reconnect (ReconnectBackoff): If set, the connection is re-established with this
+                backoff when it drops, and messages the broker had not confirmed are resent.
+                If None, any connection failure stops the producer.
+            failover_urls (list): Further broker URLs tried after `server_url` on each
+                connect attempt.
+            codec (OrderCodec): How orders are encoded into message bodies (default JSON).
+            metrics (bool): If True, collect ProducerMetrics and start the exporters
+                configured in the environment.
+            metrics_port_offset (int): Added to METRICS_PORT for this producer's endpoint.
+            batcher (MessageBatcher): If set, orders are packed into batch messages
+                (see order_batching.py); accept, reject and release apply to a whole batch.
+            delivery_mode (str): "at-least-once" to wait for the broker to accept every
+                message, or "at-most-once" to send pre-settled messages and finish once
+                all are sent. Pre-settled messages are not tracked, so they are never resent.
+            max_in_flight (int): Maximum messages sent and not yet settled by the broker,
+                on all links together (0 means no limit beyond the link credit).
+            max_unsettled_bytes (int): Maximum encoded bytes of those messages (0 means no limit).
+                At least one message is always allowed in flight, however large.
+                Neither limit applies at most once, where nothing waits for settlement.
+            spool (order_spool.OrderSpool): If set, messages are read from the spool
+                instead of `orders_to_send`, while another thread appends to it, and
+                each is acknowledged to the spool once the broker has settled it.
+                The run ends once the spool is finished and drained.
+            startup (startup_profile.StartupProfile): If set, the SSL domain, connect, credit
+                and send phases are recorded into it, and it is reported once the first
+                message is sent.
         """
+        if delivery_mode not in ("at-least-once", "at-most-once"):
+            raise ValueError(f"Unsupported delivery mode '{delivery_mode}', expected 'at-least-once' or 'at-most-once'")
         super(OrderProducer, self).__init__()
         self.server_url = server_url
         self.target_address = target_address
-        self.orders_to_send = orders_to_send
-        self.sender = None
+        self.order_source = iter(orders_to_send)
+        self.burst_send = burst_send
+        self.max_sends_per_event = max_sends_per_event
+        self.links = max(1, links)
+        self.connection = None
+        self.senders = []
         self.sent_count = 0
         self.confirmed_count = 0
-        self.total_messages = len(orders_to_send)
+        self.orders_sent = 0 # Equal to the message counts unless orders are batched
+        self.orders_confirmed = 0
+        self.batch_orders = {} # (link name, delivery tag) -> orders, for unsettled batch messages
+        if total_messages is None and hasattr(orders_to_send, "__len__"):
+            total_messages = len(orders_to_send)
+        self.total_messages = total_messages
+        self.source_exhausted = False
+        self.start_time = None # Set when the first message is sent
+        self.end_time = None # Set when the last message is confirmed
+        self._resume_scheduled = set() # Names of the senders with a pending burst continuation
+        self.reconnect = reconnect
+        self.failover_urls = list(failover_urls)
+        self.rejected_count = 0 # Only counted when reconnecting; otherwise a rejection stops the run
+        self.resent_count = 0
+        self.unsettled = {} # (link name, delivery tag) -> (delivery, message) awaiting the broker's outcome
+        self.resend_queue = [] # Unconfirmed messages to send again once a link has credit
+        self.codec = codec or get_codec("json")
+        self.batcher = batcher
+        self.delivery_mode = delivery_mode
+        self.at_most_once = delivery_mode == "at-most-once"
+        self.max_in_flight = max_in_flight
+        self.max_unsettled_bytes = max_unsettled_bytes
+        self.windowed = bool(max_in_flight or max_unsettled_bytes) and not self.at_most_once
+        self.in_flight = {} # (link name, delivery tag) -> encoded bytes, when windowed
+        self.unsettled_bytes = 0
+        self.backpressure_pauses = 0 # Times sending paused on a full window
+        self.backpressure_seconds = 0.0 # Time spent paused, excluding the current pause
+        self._paused_since = None # perf_counter at which the current pause started
+        self.spool = spool
+        self.spool_records = {} # (link name, delivery tag) -> SpoolRecord awaiting the broker's outcome
+        self.injector = None # Wakes the reactor when messages are appended to the spool
+        self.container = None
+        self.metrics = ProducerMetrics(self) if metrics else None
+        self.metrics_port_offset = metrics_port_offset
+        self.metrics_server = None
+        self.metrics_writer = None
+        self.log_summary = LogSummary(log, self._progress_counters, message_log)
+        self.tls_context = None
+        self.startup = startup # Cleared once the first message is sent
 
     def on_start(self, event):
         """
         Called when the Qpid Proton reactor starts.
 
         Configures SSL/TLS for mTLS, establishes a connection to the broker,
-        and creates a sender link to the specified target address.
+        and creates the sender link(s) to the specified target address.
         Stops the container on SSL configuration or connection failure.
 
         Args:
             event: The Qpid Proton event object.
         """
-        print(f"Producer: Starting, connecting to {self.server_url}, target: {self.target_address}")
+        log.info(f"Starting, connecting to {self.server_url}, target: {self.target_address}")
+        self.container = event.container
+        if self.metrics:
+            self.metrics_server, self.metrics_writer = start_exporters(
+                self.metrics.registry, event.container, self.metrics_port_offset
+            )
+        self.log_summary.start(event.container)
+        if self.spool:
+            self.injector = EventInjector()
+            event.container.selectable(self.injector)
+            self.spool.wakeup = self._wake_for_spool
+            if self.spool.recovered:
+                log.info(f"Spool: {self.spool.recovered} message(s) ({self.spool.recovered_orders} order(s)) "
+                         f"left by a previous run are sent first")
 
-        ssl_domain = SSLDomain(SSLDomain.MODE_CLIENT)
         try:
-            ssl_domain.set_peer_authentication(SSLDomain.VERIFY_PEER_NAME)
-            ssl_domain.set_trusted_ca_db(CA_CERT_PATH)
-            ssl_domain.set_credentials(
+            # Credentials are loaded once per process and shared by every connection
+            self.tls_context = get_tls_context(
+                CA_CERT_PATH,
                 PRODUCER_CLIENT_CERT_PATH,
                 PRODUCER_CLIENT_KEY_PATH,
                 None  # Key password, if needed
             )
-            print("Producer: SSL domain configured successfully.")
+            log.info("SSL domain configured successfully.")
+            if self.startup:
+                self.startup.mark("ssl")
         except Exception as e:
-            print(f"Producer: Error during SSL domain configuration: {e}")
+            log.error(f"Error during SSL domain configuration: {e}")
             event.container.stop()
             return
 
 
-        print(f"Producer: Attempting mTLS connection to {self.server_url} with user {PRODUCER_USER} on vhost {VHOST}")
-        conn = event.container.connect(
-            url=self.server_url,
+        urls = [self.server_url] + self.failover_urls
+        log.info(f"Attempting mTLS connection to {', '.join(urls)} with user {PRODUCER_USER} on vhost {VHOST}")
+        if self.reconnect:
+            log.info(f"Reconnect enabled, backoff {self.reconnect.initial_delay}s to {self.reconnect.max_delay}s")
+        if self.at_most_once:
+            log.info("At-most-once delivery: messages are sent pre-settled and may be lost")
+        conn = self.tls_context.connect(
+            event.container,
+            urls=urls,
             user=PRODUCER_USER,
             password=PRODUCER_PASSWORD,
             virtual_host=VHOST,
-            sni=RABBITMQ_HOST,
-            ssl_domain=ssl_domain,
+            sni=RABBITMQ_HOST if not self.failover_urls else None, # None: the host of each URL
             allow_insecure_mechs=False,
-            allowed_mechs="PLAIN"
+            allowed_mechs=SASL_MECHANISMS,
+            reconnect=self.reconnect or False
         )
         if conn:
-            print(f"Producer: mTLS connection initiated, vhost set to {VHOST}")
-            self.sender = event.container.create_sender(conn, self.target_address)
-            if self.sender:
-                print(f"Producer: Sender created for target '{self.target_address}'")
-            else:
-                print(f"Producer: Error: create_sender() returned None for target '{self.target_address}'. Verify that the target exists and is accessible.")
-                if conn: conn.close() # Close the connection if the sender cannot be created
-                event.container.stop()
+            log.info(f"mTLS connection initiated, vhost set to {VHOST}")
+            self.connection = conn
+            self._open_senders(event.container, conn)
         else:
-            print("Producer: Error: connect() returned None.")
+            log.error("connect() returned None.")
             event.container.stop()
 
+    def _open_senders(self, container, conn):
+        """
+        Creates the sender links to the target address on a new connection.
+
+        Args:
+            container: The Qpid Proton container running this handler.
+            conn: The Qpid Proton connection.
+        """
+        for index in range(self.links):
+            # Link names must be unique within a session, so extra links get an explicit one
+            name = f"{conn.container}-{self.target_address}-{index}" if self.links > 1 else None
+            sender = container.create_sender(conn, self.target_address, name=name,
+                                             options=AtMostOnce() if self.at_most_once else None)
+            if not sender:
+                log.error(f"create_sender() returned None for target '{self.target_address}'. Verify that the target exists and is accessible.")
+                conn.close() # Close the connection if the sender cannot be created
+                container.stop()
+                return
+            self.senders.append(sender)
+        log.info(f"{len(self.senders)} sender(s) created for target '{self.target_address}'")
+
     def on_sendable(self, event):
         """
         Called when the sender link has credit and can send messages.
 
-        Sends messages from the `orders_to_send` list until all are sent
-        or the sender runs out of credit.
+        By default sends a single message from the order source per event.
+        In burst mode, sends messages until all are sent, the sender runs out
+        of credit or the per-event cap is reached.
 
         Args:
             event: The Qpid Proton event object.
         """
-        if self.sender and self.sender.credit and self.sent_count < self.total_messages:
-            order_data = self.orders_to_send[self.sent_count]
-            message_body = json.dumps(order_data)
-            message = Message(body=message_body)
-            message.content_type = "application/json"
-            # message.subject = "new_order_event" # Optional, if the target does not include the routing key
-            self.sender.send(message)
-            print(f"Producer: Message sent ({self.sent_count + 1}/{self.total_messages}): {order_data}")
-            self.sent_count += 1
+        sender = event.sender
+        if self.startup:
+            self.startup.mark("credit")
+        if self.metrics:
+            self.metrics.credit_available(sender)
+        if self.burst_send:
+            self._send_burst(event.container, sender)
+        elif self._can_send(sender):
+            self._send_next_order(sender)
+
+    def _can_send(self, sender):
+        """
+        Returns True if the sender has credit, the in-flight window has room and there
+        are messages to resend or orders left.
+
+        A full window starts a backpressure pause, which ends once settlements make room.
+
+        Args:
+            sender: The Qpid Proton sender link.
+        """
+        if not (sender and sender.credit and self._has_work(sender)):
+            return False
+        if self.windowed and self._window_full():
+            if self._paused_since is None:
+                self._paused_since = time.perf_counter()
+                self.backpressure_pauses += 1
+            return False
+        return True
+
+    def _has_work(self, sender):
+        """
+        Returns True if there are messages to resend or orders left to pull for a sender.
+
+        Args:
+            sender: The Qpid Proton sender link.
+        """
+        return bool(self.resend_queue or not self.source_exhausted)
+
+    def _window_full(self):
+        """
+        Returns True if the unsettled messages or bytes have reached their limit.
+        """
+        if self.max_in_flight and len(self.in_flight) >= self.max_in_flight:
+            return True
+        return bool(self.max_unsettled_bytes and self.in_flight and self.unsettled_bytes >= self.max_unsettled_bytes)
+
+    def _release_window(self, container, delivery):
+        """
+        Removes a settled delivery from the in-flight window and, if sending was paused
+        on a full window, ends the pause and resumes sending on every link with credit.
+
+        Args:
+            container: The Qpid Proton container running this handler.
+            delivery: The Qpid Proton delivery settled by the broker.
+        """
+        if not self.windowed or not delivery:
+            return
+        self.unsettled_bytes -= self.in_flight.pop((delivery.link.name, delivery.tag), 0)
+        if self._paused_since is None or self._window_full():
+            return
+        self.backpressure_seconds += time.perf_counter() - self._paused_since
+        self._paused_since = None
+        self._resume_sending(container)
+
+    def _resume_sending(self, container):
+        """
+        Sends on every link with credit, after sending was held up by something other than credit.
+
+        Args:
+            container: The Qpid Proton container running this handler.
+        """
+        for sender in self.senders:
+            if self.burst_send:
+                self._send_burst(container, sender)
+            elif self._can_send(sender):
+                self._send_next_order(sender)
+
+    def _wake_for_spool(self):
+        """
+        Runs in the spool intake thread: tells the reactor that messages were appended.
+
+        Once the run is over the injector is gone and nothing is sent any more, but
+        the intake keeps appending, so every order still reaches the spool.
+        """
+        injector = self.injector
+        if injector:
+            try:
+                injector.trigger(ApplicationEvent("spool_appended"))
+            except OSError:
+                pass # Closed by the reactor thread in the meantime
+
+    def on_spool_appended(self, event):
+        """
+        Called on the reactor thread when messages were appended to a spool the links had drained.
+
+        Args:
+            event: The ApplicationEvent triggered by the spool's wakeup.
+        """
+        self._resume_sending(self.container) # Application events carry no container
+
+    def blocked_seconds(self):
+        """
+        Returns the total time sending was paused on a full in-flight window, including a current pause.
+        """
+        if self._paused_since is None:
+            return self.backpressure_seconds
+        return self.backpressure_seconds + time.perf_counter() - self._paused_since
+
+    def _next_order(self):
+        """
+        Pulls the next order (or batch of orders) from the source, or returns None once it is exhausted
+        (or, with a spool, when it holds no message to send yet).
+        """
+        if self.spool:
+            return self.spool.read()
+        if self.total_messages is not None and self.orders_sent >= self.total_messages:
+            return None
+        if self.batcher:
+            limit = None if self.total_messages is None else self.total_messages - self.orders_sent
+            return self.batcher.collect(self.order_source, limit) or None
+        return next(self.order_source, None)
+
+    def _send_next_order(self, sender):
+        """
+        Encodes the next order (or batch of orders) with the producer's codec and sends it on the given sender link.
+
+        Messages waiting to be resent after a reconnect or a release go first.
+
+        Args:
+            sender: The Qpid Proton sender link.
+
+        Returns:
+            bool: True if a message was sent, False if the order source is exhausted
+            (or the spool is waiting for the next message).
+        """
+        if self.resend_queue:
+            message = self.resend_queue.pop(0)
+            self._track(sender, sender.send(message), message, self._message_orders(message))
+            self.resent_count += 1
+            message_log.info("Message resent (%d left to resend): %s", len(self.resend_queue), getattr(message, "body", message))
+            return True
+        order_data = self._next_order()
+        if order_data is None:
+            if self.spool and not self.spool.exhausted():
+                return False # Resumed by on_spool_appended
+            self.source_exhausted = True
+            self._check_completion(self.connection)
+            return False
+        self._send_order(sender, order_data)
+        return True
+
+    def _send_order(self, sender, order_data):
+        """
+        Encodes an order (or batch of orders) and sends it on a sender link, updating the counters.
+
+        Args:
+            sender: The Qpid Proton sender link.
+            order_data: An order dictionary, a list of orders (when batching) or an EncodedMessage.
+        """
+        if self.start_time is None:
+            self.start_time = time.perf_counter()
+        if isinstance(order_data, EncodedMessage):
+            message, orders = order_data, order_data.orders # Encoded ahead of time, streamed as is
+        else:
+            if self.batcher:
+                message, orders = self.batcher.message(order_data), len(order_data)
+            else:
+                message, orders = self.codec.message(order_data), 1
+            message.creation_time = time.time() # Lets the consumer measure end-to-end latency
+        # message.subject = "new_order_event" # Optional, if the target does not include the routing key
+        self._track(sender, sender.send(message), message, orders)
+        if orders == 1:
+            message_log.info("Message sent (%d/%s): %s", self.orders_sent + 1, self._total_label(), order_data)
+        else:
+            message_log.info("Batch of %d orders sent (%d/%s orders)", orders, self.orders_sent + orders, self._total_label())
+        self.sent_count += 1
+        self.orders_sent += orders
+        if self.startup:
+            self.startup.finish("send", log)
+            self.startup = None
+        if self.total_messages is not None and self.orders_sent >= self.total_messages:
+            self.source_exhausted = True
+            if self.at_most_once:
+                self._check_completion(self.connection) # No outcome will arrive to trigger it
+
+    def _track(self, sender, delivery, message, orders=1):
+        """
+        Remembers a sent message until the broker settles it, so it can be resent after a reconnect.
+        Pre-settled (at-most-once) messages are not remembered.
+
+        Also feeds the metrics and notes a credit stall if the sender has just
+        used its last credit while there is more to send.
+
+        Args:
+            sender: The Qpid Proton sender link the message was sent on.
+            delivery: The Qpid Proton delivery returned by `sender.send()`.
+            message: The sent Qpid Proton message.
+            orders (int): The number of orders the message carries.
+        """
+        if self.reconnect and not self.at_most_once:
+            self.unsettled[(sender.name, delivery.tag)] = (delivery, message)
+        if isinstance(message, SpoolRecord):
+            if self.at_most_once:
+                self.spool.ack(message)
+            else:
+                self.spool_records[(sender.name, delivery.tag)] = message
+        if orders != 1 and not self.at_most_once:
+            self.batch_orders[(sender.name, delivery.tag)] = orders
+        if self.windowed:
+            size = delivery.pending # Still fully buffered: the transport writes it later
+            self.in_flight[(sender.name, delivery.tag)] = size
+            self.unsettled_bytes += size
+        if self.metrics:
+            self.metrics.message_sent(sender, delivery, settled=self.at_most_once)
+            if not sender.credit and self._has_work(sender):
+                self.metrics.credit_exhausted(sender)
+
+    def _untrack(self, delivery):
+        """
+        Forgets a message once the broker has settled it.
+
+        Args:
+            delivery: The Qpid Proton delivery settled by the broker.
+
+        Returns:
+            The tracked Qpid Proton message, or None if it was not tracked.
+        """
+        if not delivery:
+            return None
+        _, message = self.unsettled.pop((delivery.link.name, delivery.tag), (None, None))
+        return message
+
+    def _settle_spooled(self, delivery, remove):
+        """
+        Forgets the spool record of a delivery the broker has settled and, if `remove`
+        is True, removes it from the spool; otherwise it stays there for the next run.
+
+        Args:
+            delivery: The Qpid Proton delivery settled by the broker.
+            remove (bool): True if the outcome is final (accepted or rejected).
+        """
+        if not self.spool_records or not delivery:
+            return
+        record = self.spool_records.pop((delivery.link.name, delivery.tag), None)
+        if record is not None and remove:
+            self.spool.ack(record)
+
+    def _settled_orders(self, delivery):
+        """
+        Returns the number of orders carried by a delivery the broker has settled, and forgets it.
+
+        Args:
+            delivery: The Qpid Proton delivery settled by the broker.
+        """
+        if not self.batch_orders or not delivery:
+            return 1
+        return self.batch_orders.pop((delivery.link.name, delivery.tag), 1)
+
+    @staticmethod
+    def _message_orders(message):
+        """
+        Returns the number of orders carried by a message, from its batch header.
+
+        Args:
+            message: A Qpid Proton message or an EncodedMessage.
+        """
+        if isinstance(message, EncodedMessage):
+            return message.orders
+        properties = message.properties
+        return properties.get(BATCH_COUNT_PROPERTY, 1) if properties else 1
+
+    def _total_label(self):
+        """
+        Returns the total number of messages for progress output ("?" if unknown).
+        """
+        return self.total_messages if self.total_messages is not None else "?"
+
+    def _check_completion(self, connection):
+        """
+        Closes the connection once the source is exhausted and every sent message is confirmed
+        (or, at most once, as soon as every message is sent).
+
+        Args:
+            connection: The Qpid Proton connection to close on completion.
+        """
+        settled_count = self.confirmed_count + self.rejected_count
+        if self.source_exhausted and (self.at_most_once or settled_count == self.sent_count) and self.end_time is None:
+            self.end_time = time.perf_counter()
+            log.info("All messages have been sent." if self.at_most_once else "All messages have been confirmed.")
+            self._stop_timers()
+            if connection: connection.close()
+            # The container stops on its own after closing the connection
+
+    def _stop_timers(self):
+        """
+        Cancels the periodic snapshot and summary timers and closes the spool's event injector,
+        which would otherwise keep the container running.
+        """
+        if self.metrics_writer:
+            self.metrics_writer.stop()
+        self.log_summary.stop()
+        if self.spool:
+            self.spool.wakeup = None # The intake keeps spooling; nothing reads the spool any more
+        if self.injector:
+            self.injector.close()
+            self.injector = None
+
+    def _progress_counters(self):
+        """
+        Returns the running totals shown in the periodic log summary.
+        """
+        counters = {"sent": self.sent_count, "accepted": self.confirmed_count}
+        if self.batcher:
+            counters["orders accepted"] = self.orders_confirmed
+        if self.reconnect:
+            counters["resent"] = self.resent_count
+        if self.spool:
+            counters["spooled"] = self.spool.appended
+        return counters
+
+    def _send_burst(self, container, sender):
+        """
+        Sends orders while the sender has credit, up to `max_sends_per_event` messages.
+
+        If the cap is reached while credit remains, a zero-delay timer is scheduled
+        so that sending resumes after the reactor has processed other pending events.
+
+        Args:
+            container: The Qpid Proton container running this handler.
+            sender: The Qpid Proton sender link.
+        """
+        sent_in_burst = 0
+        while self._can_send(sender):
+            if self.max_sends_per_event and sent_in_burst >= self.max_sends_per_event:
+                if sender.name not in self._resume_scheduled:
+                    self._resume_scheduled.add(sender.name)
+                    container.schedule(0, _ReactorCallback(lambda event, s=sender: self._resume_burst(event, s)))
+                return
+            if not self._send_next_order(sender):
+                return
+            sent_in_burst += 1
+
+    def _resume_burst(self, event, sender):
+        """
+        Timer callback that continues a burst interrupted by the per-event cap.
+
+        Args:
+            event: The Qpid Proton timer event object.
+            sender: The Qpid Proton sender link.
+        """
+        self._resume_scheduled.discard(sender.name)
+        if sender.state & Endpoint.LOCAL_ACTIVE: # Not closed meanwhile
+            self._send_burst(event.container, sender)
+
+    def delivered_counts(self):
+        """
+        Returns the messages and orders counted as delivered: those confirmed by the broker
+        or, at most once, those sent.
+
+        Returns:
+            tuple: (messages, orders).
+        """
+        if self.at_most_once:
+            return self.sent_count, self.orders_sent
+        return self.confirmed_count, self.orders_confirmed
+
+    def throughput(self, orders=False):
+        """
+        Returns the delivered messages (or orders) per second, or None if nothing was delivered.
+
+        The rate is measured from the first send to the last confirmation
+        (or to now, if the run did not complete). At most once, it is measured
+        up to the broker closing the connection, after reading every message.
+
+        Args:
+            orders (bool): If True, count the orders carried by batch messages.
+        """
+        messages, delivered_orders = self.delivered_counts()
+        if self.start_time is None or not messages:
+            return None
+        end_time = self.end_time if self.end_time is not None else time.perf_counter()
+        elapsed = end_time - self.start_time
+        return (delivered_orders if orders else messages) / elapsed if elapsed > 0 else None
+
+    def report_throughput(self):
+        """
+        Logs a summary line with the delivered count, elapsed time and messages per second.
+        """
+        rate = self.throughput()
+        outcome = "sent pre-settled" if self.at_most_once else "confirmed"
+        if rate is None:
+            log.info(f"Throughput ({self.delivery_mode}): no messages {outcome}.")
+            return
+        end_time = self.end_time if self.end_time is not None else time.perf_counter()
+        mode = "burst" if self.burst_send else "one-per-event"
+        messages, orders = self.delivered_counts()
+        log.info(f"Throughput ({mode}, {self.delivery_mode}): {messages} message(s) {outcome} "
+              f"in {end_time - self.start_time:.3f}s ({rate:.1f} msg/s)")
+        if orders != messages:
+            log.info(f"Batching: {orders} order(s) {outcome} ({self.throughput(orders=True):.1f} orders/s, "
+                  f"{orders / messages:.1f} per message)")
+        if self.reconnect:
+            log.info(f"Resent {self.resent_count} message(s), rejected {self.rejected_count}, "
+                  f"unconfirmed {len(self.unsettled) + len(self.resend_queue)}")
+        if self.windowed:
+            limits = ", ".join(limit for limit in (
+                f"{self.max_in_flight} message(s)" if self.max_in_flight else "",
+                f"{self.max_unsettled_bytes} byte(s)" if self.max_unsettled_bytes else "") if limit)
+            log.info(f"Backpressure (window {limits}): paused {self.backpressure_pauses} time(s), "
+                  f"{self.blocked_seconds():.3f}s blocked")
+        if self.metrics:
+            latency = self.metrics.send_to_accept.summary()
+            if latency["count"]:
+                log.info(f"Send-to-accept latency: p50 {latency['p50'] * 1000:.2f} ms, "
+                      f"p99 {latency['p99'] * 1000:.2f} ms, max {latency['max'] * 1000:.2f} ms")
+            log.info(f"Bytes sent {self.metrics.bytes_sent.value}, credit stalls {self.metrics.stalls.value} "
+                  f"({self.metrics.stall_seconds.value:.3f}s waiting for credit)")
 
     def on_accepted(self, event):
         """
         Called when a sent message is accepted by the broker.
 
-        Increments the confirmed message count. If all messages are confirmed,
-        closes the connection.
+        Increments the confirmed message count. If the order source is exhausted
+        and all messages are confirmed, closes the connection.
 
         Args:
             event: The Qpid Proton event object.
         """
+        self._untrack(event.delivery)
+        self._settle_spooled(event.delivery, remove=True)
+        if self.metrics:
+            self.metrics.message_settled(event.delivery, event.delivery.ACCEPTED)
         self.confirmed_count += 1
-        print(f"Producer: Message accepted by broker. Confirmed: {self.confirmed_count}/{self.total_messages}")
-        if self.confirmed_count == self.total_messages:
-            print("Producer: All messages have been confirmed.")
-            if event.connection: event.connection.close()
-            # The container stops on its own after closing the connection
+        self.orders_confirmed += self._settled_orders(event.delivery)
+        message_log.info("Message accepted by broker. Confirmed: %d/%s", self.confirmed_count, self._total_label())
+        self._release_window(event.container, event.delivery)
+        if self.source_exhausted:
+            self._check_completion(event.connection)
+        elif self.confirmed_count + self.rejected_count == self.sent_count and self._can_send(event.sender):
+            # For sources of unknown length, exhaustion is only discovered on the next pull.
+            # Pulling here ensures the run completes even if no further sendable event arrives.
+            self._send_next_order(event.sender)
 
     def on_rejected(self, event):
         """
         Called when a sent message is rejected by the broker.
 
-        Logs the rejection and closes the connection.
+        Logs the rejection and closes the connection. When reconnecting, the
+        rejected message is counted and dropped instead, as resending it would
+        be rejected again. Either way a rejected message is removed from the spool.
 
         Args:
             event: The Qpid Proton event object.
         """
-        print(f"Producer: Message rejected: {event.delivery.remote_state if event.delivery else 'N/A'}")
+        message_log.warning("Message rejected: %s", event.delivery.remote_state if event.delivery else "N/A")
+        self._settle_spooled(event.delivery, remove=True)
+        if self.metrics:
+            self.metrics.message_settled(event.delivery, event.delivery.REJECTED)
+        if self.reconnect:
+            self._untrack(event.delivery)
+            self._settled_orders(event.delivery)
+            self.rejected_count += 1
+            self._release_window(event.container, event.delivery)
+            self._check_completion(event.connection)
+            return
         if event.connection: event.connection.close()
         # event.container.stop() # Container stops when connection closes
 
@@ -192,12 +879,25 @@ class OrderProducer(MessagingHandler):
         """
         Called when a sent message is released by the broker.
 
-        Logs the release and closes the connection.
+        Logs the release and closes the connection. When reconnecting, the
+        message is queued to be sent again instead.
 
         Args:
             event: The Qpid Proton event object.
         """
-        print(f"Producer: Message released: {event.delivery.remote_state if event.delivery else 'N/A'}")
+        message_log.warning("Message released: %s", event.delivery.remote_state if event.delivery else "N/A")
+        self._settle_spooled(event.delivery, remove=False)
+        if self.metrics:
+            self.metrics.message_settled(event.delivery, event.delivery.RELEASED)
+        if self.reconnect:
+            message = self._untrack(event.delivery)
+            self._settled_orders(event.delivery)
+            self._release_window(event.container, event.delivery)
+            if message is not None:
+                self.resend_queue.append(message)
+                if self._can_send(event.sender):
+                    self._send_next_order(event.sender)
+            return
         if event.connection: event.connection.close()
         # event.container.stop() # Container stops when connection closes
 
@@ -207,28 +907,88 @@ class OrderProducer(MessagingHandler):
 
         Logs a warning if not all sent messages were confirmed.
         The container usually stops automatically when the connection is closed.
+        When reconnecting, the unconfirmed messages are queued to be resent once
+        the connection is re-established.
 
         Args:
             event: The Qpid Proton event object.
         """
-        print(f"Producer: Disconnected from {self.server_url}")
-        if self.confirmed_count < self.sent_count:
-             print(f"Producer: WARNING - Disconnected before confirmation. Sent: {self.sent_count}, Confirmed: {self.confirmed_count}")
+        log.warning(f"Disconnected from {event.connection.url if event.connection else self.server_url}")
+        if self.reconnect:
+            if self.unsettled:
+                # Their outcome is unknown, so the messages are resent. The old deliveries are
+                # left alone: settling them would make Proton replay them on the new transport.
+                self.resend_queue[:0] = [message for _, message in self.unsettled.values()]
+                self.unsettled.clear()
+                self.batch_orders.clear()
+                self.spool_records.clear() # Tracked again when resent
+            self.in_flight.clear() # The window reopens for the resent messages
+            self.unsettled_bytes = 0
+            if self._paused_since is not None: # Waiting for a reconnect is not backpressure
+                self.backpressure_seconds += time.perf_counter() - self._paused_since
+                self._paused_since = None
+            if self.metrics:
+                self.metrics.connection_lost()
+            log.info(f"{len(self.resend_queue)} unconfirmed message(s) will be resent after reconnecting")
+            return
+        if self.confirmed_count < self.sent_count and not self.at_most_once:
+            log.warning(f"Disconnected before confirmation. Sent: {self.sent_count}, Confirmed: {self.confirmed_count}")
+        self._stop_timers()
         # Do not call event.container.stop() here if the connection closes normally
         # after on_accepted or in case of a handled error.
         # The container will stop when there are no more active handles or explicit calls.
 
+    def on_connection_closed(self, event):
+        """
+        Called when the broker has closed its end of the connection.
+
+        At most once, the run ends here rather than when the last message was
+        handed to the link: the broker answers the close after reading every message.
+
+        Args:
+            event: The Qpid Proton event object.
+        """
+        if self.at_most_once and self.end_time is not None:
+            # Replaces the time the last message was handed to the link (see _check_completion):
+            # only this close confirms the broker has read them. None means the run was not complete
+            self.end_time = time.perf_counter()
+
+    def on_connection_opened(self, event):
+        """
+        Called when the broker has opened the AMQP connection.
+
+        Reports how long the TLS handshake and AMQP open took and whether
+        the TLS session was resumed.
+
+        Args:
+            event: The Qpid Proton event object.
+        """
+        if self.startup:
+            self.startup.mark("connect")
+        handshake = self.tls_context.handshake_completed(event.connection) if self.tls_context else None
+        if handshake:
+            latency, resume_status = handshake
+            log.info(f"mTLS connection established in {latency * 1000:.1f} ms (TLS session: {resume_status})")
+
     def on_transport_error(self, event):
         """
         Called when a transport-level error occurs (e.g., SSL/TLS handshake failure).
 
-        Logs the error and stops the Qpid Proton container.
+        Logs the error and stops the Qpid Proton container. When reconnecting,
+        the connection is left open so that Proton retries with the configured backoff,
+        unless the error is one a retry cannot fix (see is_fatal_transport_error).
 
         Args:
             event: The Qpid Proton event object.
         """
         condition = event.transport.condition
-        print(f"Producer: Transport error (mTLS?): {condition if condition else 'N/A'}")
+        log.error(f"Transport error (mTLS?): {condition if condition else 'N/A'}")
+        if self.tls_context and event.connection:
+            self.tls_context.handshake_failed(event.connection, condition)
+        if self.reconnect:
+            if not is_fatal_transport_error(condition):
+                return
+            log.error("Not reconnecting: the broker rejected the credentials or a certificate is not trusted")
         if event.connection: event.connection.close()
         event.container.stop() # Stop the container in case of a transport error
 
@@ -242,7 +1002,7 @@ class OrderProducer(MessagingHandler):
             event: The Qpid Proton event object.
         """
         condition = event.connection.remote_condition if event.connection else None
-        print(f"Producer: AMQP connection error (mTLS?): {condition if condition else 'N/A'}")
+        log.error(f"AMQP connection error (mTLS?): {condition if condition else 'N/A'}")
         if event.connection: event.connection.close()
         event.container.stop() # Stop the container in case of an AMQP connection error
 
@@ -258,62 +1018,578 @@ class OrderProducer(MessagingHandler):
         condition = None
         if event.sender and event.sender.remote_condition:
             condition = event.sender.remote_condition
-        print(f"Producer: AMQP link error (sender): {condition if condition else 'N/A'}")
+        log.error(f"AMQP link error (sender): {condition if condition else 'N/A'}")
         if event.connection: event.connection.close()
         event.container.stop() # Stop the container in case of a link error
 
-def generate_random_orders(num_orders):
+class _Route:
+    """
+    The sender link of one target address and the orders waiting for its credit.
+    """
+    __slots__ = ("address", "sender", "pending", "last_used")
+
+    def __init__(self, address, sender):
+        self.address = address
+        self.sender = sender
+        self.pending = deque() # Orders pulled from the source, waiting for credit on this link
+        self.last_used = time.monotonic()
+
+class RoutedOrderProducer(OrderProducer):
+    """
+    An OrderProducer that sends each order to the target address picked by an OrderRouter.
+
+    Sender links are opened on the shared connection the first time an order is
+    routed to their address and closed once they have been idle, with nothing
+    unsettled, for `idle_seconds`. Each link is driven by its own credit: orders
+    for a link without credit wait in that route's queue while orders for other
+    routes keep flowing, and reading from the source only pauses when a route's
+    queue holds `queue_limit` orders.
+
+    Orders are sent one per message; batching, pre-encoding, the spool and
+    reconnect are not supported with routing.
+    """
+    def __init__(self, server_url, router, orders_to_send, idle_seconds=30.0, queue_limit=100, **kwargs):
+        """
+        Args:
+            server_url (str): The AMQP connection URL (e.g., "amqps://host:port/").
+            router (order_routing.OrderRouter): Picks the target address of each order.
+            orders_to_send (iterable): A list, iterator or generator of order dictionaries to send.
+            idle_seconds (float): Close a route's link after this long without sends or unsettled messages.
+            queue_limit (int): Orders held per route while its link has no credit.
+            **kwargs: Further OrderProducer arguments; `links` is ignored (one link per route).
+
+        Raises:
+            ValueError: If batching, the spool or reconnect is requested, or the delivery mode is unsupported.
+        """
+        for option in ("batcher", "spool", "reconnect"):
+            if kwargs.get(option):
+                raise ValueError(f"Routing orders to several targets cannot be combined with the {option} option")
+        kwargs.pop("links", None)
+        super().__init__(server_url, router.default_target, orders_to_send, **kwargs)
+        self.router = router
+        self.idle_seconds = idle_seconds
+        self.queue_limit = max(1, queue_limit)
+        self.routes = {} # Target address -> _Route with an open link
+        self.routes_by_link = {} # Link name -> _Route
+        self.held = None # (order, address) pulled while the queue of its route was full
+        self.links_opened = 0
+        self.sent_by_target = Counter()
+        self.links_evicted = 0
+        self._evict_task = None
+
+    def _open_senders(self, container, conn):
+        """
+        Opens no link up front: routes open theirs on demand. Starts the idle link eviction timer.
+        """
+        log.info(f"Routing orders by {self.router.description}, default target '{self.router.default_target}'; "
+                 f"links are opened on demand and closed after {self.idle_seconds:g}s idle")
+        self._container = container
+        self._schedule_eviction(container)
+
+    def _schedule_eviction(self, container):
+        self._evict_task = container.schedule(max(self.idle_seconds / 2, 0.1), _ReactorCallback(self._evict_idle_links))
+
+    def _evict_idle_links(self, event):
+        """
+        Timer callback that closes the links of the routes idle for `idle_seconds`.
+
+        Args:
+            event: The Qpid Proton timer event object.
+        """
+        now = time.monotonic()
+        held_address = self.held[1] if self.held else None
+        for address, route in list(self.routes.items()):
+            if route.pending or route.sender.unsettled or address == held_address:
+                continue
+            if now - route.last_used >= self.idle_seconds:
+                self._close_route(route)
+                message_log.info("Closed the idle link to '%s'", address)
+        self._schedule_eviction(event.container)
+
+    def _close_route(self, route):
+        del self.routes[route.address]
+        del self.routes_by_link[route.sender.name]
+        self.senders.remove(route.sender)
+        route.sender.close()
+        self.links_evicted += 1
+
+    def _route(self, address):
+        """
+        Returns the route of a target address, opening its sender link if it has none.
+
+        Args:
+            address (str): The target address.
+        """
+        route = self.routes.get(address)
+        if route is None:
+            self.links_opened += 1
+            # Link names must be unique within a session, and a route can be reopened after eviction
+            name = f"{self.connection.container}-{address}-{self.links_opened}"
+            sender = self._container.create_sender(self.connection, address, name=name,
+                                                   options=AtMostOnce() if self.at_most_once else None)
+            route = _Route(address, sender)
+            self.routes[address] = route
+            self.routes_by_link[sender.name] = route
+            self.senders.append(sender)
+            message_log.info("Opened a link to '%s' (%d open)", address, len(self.routes))
+        return route
+
+    def _has_work(self, sender):
+        """
+        Returns True if the sender's route has queued orders, or the source may have orders left.
+        """
+        route = self.routes_by_link.get(sender.name)
+        return bool(route and route.pending) or not self.source_exhausted
+
+    def _send_next_order(self, sender):
+        """
+        Sends the next order queued for the sender's route or, if there is none, pulls
+        orders from the source until one can be sent on a link with credit; the others
+        are queued on their routes.
+
+        Args:
+            sender: The Qpid Proton sender link with credit.
+
+        Returns:
+            bool: True if a message was sent, False if the source is exhausted or a route's queue is full.
+        """
+        route = self.routes_by_link.get(sender.name)
+        if route and route.pending:
+            self._send_routed(route, route.pending.popleft())
+            return True
+        return self._pull_orders()
+
+    def _pull_orders(self):
+        """
+        Pulls orders from the source, opening the links of new routes, until one is sent
+        on a link with credit, a route's queue is full or the source is exhausted.
+
+        Returns:
+            bool: True if a message was sent.
+        """
+        while True:
+            if self.held:
+                (order_data, address), self.held = self.held, None
+            else:
+                order_data = self._next_order()
+                if order_data is None:
+                    self.source_exhausted = True
+                    self._check_completion(self.connection)
+                    return False
+                address = self.router.route(order_data)
+            route = self._route(address)
+            if route.sender.credit and not route.pending:
+                self._send_routed(route, order_data)
+                return True
+            if len(route.pending) >= self.queue_limit:
+                self.held = (order_data, address) # Resumed when the route drains
+                return False
+            route.pending.append(order_data)
+
+    def on_connection_opened(self, event):
+        """
+        Called when the broker has opened the AMQP connection; starts pulling orders,
+        which opens the links of their routes.
+
+        Args:
+            event: The Qpid Proton event object.
+        """
+        super().on_connection_opened(event)
+        self._pull_orders()
+
+    def _send_routed(self, route, order_data):
+        route.last_used = time.monotonic()
+        self.sent_by_target[route.address] += 1
+        self._send_order(route.sender, order_data)
+
+    def _check_completion(self, connection):
+        """
+        Completes the run as OrderProducer does, once no route has orders waiting for credit.
+        """
+        if self.held or any(route.pending for route in self.routes.values()):
+            return
+        super()._check_completion(connection)
+
+    def _stop_timers(self):
+        super()._stop_timers()
+        if self._evict_task:
+            self._evict_task.cancel()
+            self._evict_task = None
+
+    def report_throughput(self):
+        """
+        Logs the OrderProducer summary, then the orders sent per target address and the links opened and evicted.
+        """
+        super().report_throughput()
+        log.info(f"Routing: {self.links_opened} link(s) opened, {self.links_evicted} closed when idle")
+        for address, count in self.sent_by_target.most_common():
+            log.info(f"  {address}: {count} order(s) sent")
+
+def iter_random_orders(num_orders, seed=None, start=0, dataset_size=None):
+    """
+    Lazily generates random order dictionaries, in batches (see order_generator.py).
+
+    Order ids are unique within the dataset of a seed, across all its shards.
+
+    Args:
+        num_orders (int): The number of orders to generate.
+        seed (int, optional): The dataset seed (default ORDER_SEED, or a new random seed).
+        start (int): Position of the first order in the dataset, for producer shards.
+        dataset_size (int, optional): Orders in the whole dataset, for producer shards (default `num_orders`).
+
+    Yields:
+        dict: An order dictionary.
+    """
+    return iter_orders(num_orders, POSSIBLE_ITEMS, MAX_QUANTITY, seed=seed, start=start, dataset_size=dataset_size)
+
+def generate_random_orders(num_orders, seed=None):
     """
     Generates a list of random order dictionaries.
 
+    Prefer `iter_random_orders` for large runs: the list is fully materialized in memory.
+
     Args:
         num_orders (int): The number of orders to generate.
+        seed (int, optional): The dataset seed (default ORDER_SEED, or a new random seed).
 
     Returns:
         list: A list of order dictionaries.
     """
-    orders = []
-    for i in range(num_orders):
-        item_template = random.choice(POSSIBLE_ITEMS)
-        order = {
-            "order_id": f"ORD_MTLS_{str(uuid.uuid4())[:8].upper()}", # Unique and shorter order ID
-            "item_id": f"{item_template['id_prefix']}_{random.randint(100, 999)}",
-            "description": item_template['description'],
-            "quantity": random.randint(1, MAX_QUANTITY)
-        }
-        orders.append(order)
-    return orders
+    return list(iter_random_orders(num_orders, seed))
+
+def read_orders_jsonl(path, shard_index=0, shard_count=1):
+    """
+    Lazily reads order dictionaries from a JSON Lines file, one order per line.
+
+    Blank lines are skipped; lines that are not valid JSON objects are reported and skipped.
+    With `shard_count` > 1, only every `shard_count`-th line starting at `shard_index`
+    is parsed, so several producer processes can split the same file.
+
+    Args:
+        path (str): The file path, or "-" to read from stdin.
+        shard_index (int): The shard of the file to read (0-based).
+        shard_count (int): The total number of shards.
+
+    Yields:
+        dict: An order dictionary.
+    """
+    stream = sys.stdin if path == "-" else open(path, "r", encoding="utf-8")
+    try:
+        for line_number, line in enumerate(stream, start=1):
+            if shard_count > 1 and (line_number - 1) % shard_count != shard_index:
+                continue
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                order = json.loads(line)
+            except json.JSONDecodeError as e:
+                log.warning(f"Skipping invalid JSON on line {line_number} of {path}: {e}")
+                continue
+            if not isinstance(order, dict):
+                log.warning(f"Skipping non-object JSON on line {line_number} of {path}")
+                continue
+            yield order
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+
+def open_order_source(source, num_orders, shard_index=0, shard_count=1, seed=None):
+    """
+    Returns a lazy order source for the given ORDERS_SOURCE setting.
+
+    With `shard_count` > 1, returns only the `shard_index`-th part of the source:
+    an even share of the random orders, or every `shard_count`-th line of a file.
+
+    Args:
+        source (str): "random", "-" for stdin, or a JSON Lines file path.
+        num_orders (int): The number of orders to generate for the "random" source.
+        shard_index (int): The shard to return (0-based).
+        shard_count (int): The total number of shards.
+        seed (int, optional): The random dataset seed; shards of the same dataset must share it.
+
+    Returns:
+        tuple: (iterator of order dictionaries, expected total or None if unknown).
+
+    Raises:
+        ValueError: If stdin is asked to be split into several shards.
+    """
+    if source == "random":
+        shard_size = num_orders // shard_count + (1 if shard_index < num_orders % shard_count else 0)
+        shard_start = shard_index * (num_orders // shard_count) + min(shard_index, num_orders % shard_count)
+        return iter_random_orders(shard_size, seed, shard_start, dataset_size=num_orders), shard_size
+    if source == "-" and shard_count > 1:
+        raise ValueError("Orders read from stdin cannot be split across producer processes")
+    return read_orders_jsonl(source, shard_index, shard_count), None
+
+def is_fatal_transport_error(condition):
+    """
+    Returns True if a transport error cannot be fixed by reconnecting: an authentication
+    or SASL failure, or a certificate that failed verification on either side.
+
+    Args:
+        condition (proton.Condition): The transport error condition, or None.
+    """
+    if condition is None:
+        return False
+    if condition.name in FATAL_TRANSPORT_CONDITIONS:
+        return True
+    description = (condition.description or "").lower()
+    return any(error in description for error in FATAL_TRANSPORT_ERRORS)
+
+def create_reconnect_policy():
+    """
+    Returns the reconnect backoff configured through the environment, or None if reconnect is disabled.
+    """
+    if not PRODUCER_RECONNECT:
+        return None
+    return ReconnectBackoff(RECONNECT_INITIAL_DELAY, RECONNECT_MAX_DELAY, RECONNECT_MAX_ATTEMPTS)
+
+def _spool_orders(spool, orders, codec, batcher):
+    """
+    Encodes orders (or batches of orders) into AMQP messages and appends them to the spool,
+    independently of the broker. Runs in the spool intake thread.
+
+    Args:
+        spool (order_spool.OrderSpool): The spool to append to; finished on return.
+        orders (iterable): Order dictionaries, or EncodedMessage objects encoded ahead of time.
+        codec (OrderCodec): How single orders are encoded.
+        batcher (MessageBatcher): If set, how orders are packed into batch messages.
+    """
+    try:
+        # Read in a thread of its own, so a batch times out while the source waits
+        source = OrderFeed(orders) if batcher and batcher.timeout else iter(orders)
+        while True:
+            if batcher:
+                batch = batcher.collect(source)
+                if not batch:
+                    break
+                message, count = batcher.message(batch), len(batch)
+            else:
+                order_data = next(source, None)
+                if order_data is None:
+                    break
+                if isinstance(order_data, EncodedMessage):
+                    spool.append(order_data.data, order_data.orders)
+                    continue
+                message, count = codec.message(order_data), 1
+            message.creation_time = time.time() # Time of intake: the latency includes the wait in the spool
+            spool.append(message.encode(), count)
+    except Exception as e:
+        log.error(f"Spooling stopped, the orders not yet read are not sent: {e}")
+    finally:
+        spool.finish()
 
-def send_order_messages_proton(orders):
+def send_order_messages_proton(orders, total_messages=None, links=1, metrics_port_offset=0, shard_index=0, shard_count=1):
     """
     Sets up and runs the Qpid Proton container for the OrderProducer.
 
     Initializes the OrderProducer handler with the provided orders
     and starts the Proton reactor to send them.
 
+    With SPOOL_DIR set, an intake thread appends the orders to the spool while the
+    reactor drains it, and the function returns once the whole source is spooled,
+    even if the broker could not be reached.
+
     Args:
-        orders (list): A list of order dictionaries to send.
+        orders (iterable): A list, iterator or generator of order dictionaries to send.
+        total_messages (int): The number of orders to send, if known (see OrderProducer).
+        links (int): The number of sender links to open on the connection.
+        metrics_port_offset (int): Added to METRICS_PORT for this producer's metrics endpoint.
+        shard_index (int): This producer's shard, which selects its spool directory.
+        shard_count (int): The total number of producer shards.
+
+    Returns:
+        OrderProducer: The handler used for the run (None if there was nothing to send),
+        so callers can inspect its counters and throughput.
     """
-    if not orders:
-        print("Producer: No orders to send.")
-        return
-    handler = OrderProducer(CONNECTION_URL, TARGET_NODE, orders)
+    try:
+        codec = get_codec(ORDER_CODEC)
+    except ValueError as e:
+        log.error("%s", e)
+        return None
+    try:
+        batcher = create_batcher(codec)
+        router = create_router(TARGET_NODE)
+    except ValueError as e:
+        log.error("%s", e)
+        return None
+    if router and PREENCODE_ORDERS:
+        log.error("Routing orders to several targets cannot be combined with PREENCODE_ORDERS")
+        return None
+    # Opened once the configuration is known to be valid, so the returns above leak nothing
+    try:
+        spool = open_spool(shard_index, shard_count)
+    except (OSError, ValueError) as e:
+        log.error(f"Cannot open the spool: {e}")
+        return None
+    if not isinstance(orders, (list, tuple)) and not (spool and spool.recovered):
+        # A lazy source is always truthy: read its first order to find out, before connecting
+        orders = iter(orders)
+        try:
+            first = next(orders, None)
+        except OSError as e:
+            log.error(f"Cannot read the orders: {e}")
+            if spool:
+                spool.close()
+            return None
+        orders = [] if first is None else itertools.chain([first], orders)
+    if not orders and not (spool and spool.recovered):
+        log.info("No orders to send.")
+        if spool:
+            spool.close()
+        return None
+    if batcher:
+        log.info(f"Batching up to {batcher.size} orders per message ({batcher.batch_format} format"
+                 f"{f', {batcher.timeout * 1000:g} ms timeout' if batcher.timeout else ''})")
+    if PREENCODE_ORDERS:
+        started = time.perf_counter()
+        if batcher:
+            orders = encode_batches(orders, batcher)
+            total_messages = sum(message.orders for message in orders)
+            batcher = None # The batches are already packed
+        else:
+            orders = encode_orders(orders, codec)
+            total_messages = len(orders)
+        log.info(f"Pre-encoded {total_messages} order(s) into {len(orders)} message(s) with the {codec.name} codec "
+                 f"in {time.perf_counter() - started:.3f}s")
+    intake = None
+    if spool:
+        intake = threading.Thread(target=_spool_orders, args=(spool, orders or (), codec, batcher),
+                                  name="spool-intake", daemon=True)
+        orders, total_messages, batcher = iter(()), None, None # The handler reads encoded messages from the spool
+    elif batcher and batcher.timeout and not isinstance(orders, (list, tuple)):
+        orders = OrderFeed(orders) # Read in a thread of its own, so a batch times out while the source waits
+    urls = RABBITMQ_URLS or [CONNECTION_URL]
+    options = dict(burst_send=BURST_SEND, max_sends_per_event=MAX_SENDS_PER_EVENT,
+                   total_messages=total_messages, links=links,
+                   reconnect=create_reconnect_policy(), failover_urls=urls[1:], codec=codec,
+                   metrics=metrics_enabled(), metrics_port_offset=metrics_port_offset, batcher=batcher,
+                   delivery_mode=DELIVERY_MODE, max_in_flight=MAX_IN_FLIGHT,
+                   max_unsettled_bytes=MAX_UNSETTLED_BYTES, spool=spool, startup=startup)
+    try:
+        if router:
+            handler = RoutedOrderProducer(urls[0], router, orders, idle_seconds=ROUTE_IDLE_SECONDS,
+                                          queue_limit=ROUTE_QUEUE_LIMIT, **options)
+        else:
+            handler = OrderProducer(urls[0], TARGET_NODE, orders, **options)
+    except ValueError as e:
+        log.error("%s", e)
+        if spool:
+            spool.close()
+        return None
     container = Container(handler)
     try:
-        print(f"Producer: Starting container to send {len(orders)} message(s)...")
+        if intake:
+            log.info(f"Spooling orders to {spool.directory} while sending...")
+            intake.start()
+        log.info(f"Starting container to send {handler._total_label()} order(s)...")
+        startup.mark("setup")
         container.run()
-        print("Producer: Container execution finished.")
+        log.info("Container execution finished.")
     except Exception as e:
-        print(f"Producer: Error during container execution: {e}")
-        import traceback
-        traceback.print_exc()
+        log.exception(f"Error during container execution: {e}")
+    if intake:
+        if intake.is_alive():
+            log.info("Spooling the remaining orders for the next run...")
+        intake.join()
+        segments, pending_bytes = spool.pending()
+        log.info(f"Spool: {spool.appended} message(s) spooled, {spool.recovered} recovered, "
+                 f"{spool.acked} removed on settlement, {pending_bytes} byte(s) in {segments} segment(s) left")
+        spool.close()
+    if handler.metrics_writer:
+        handler.metrics_writer.write() # Final snapshot
+    handler.report_throughput()
+    return handler
+
+def _run_producer_shard(shard_index, shard_count, links, seed=None):
+    """
+    Sends one shard of the configured order source. Runs in a worker process.
+
+    Args:
+        shard_index (int): The shard to send (0-based).
+        shard_count (int): The total number of shards.
+        links (int): The number of sender links to open on the connection.
+        seed (int, optional): The random dataset seed shared by all shards.
+
+    Returns:
+        dict: The shard's sent and confirmed counts and its confirmed messages per second
+        (at most once, every sent message counts as confirmed).
+    """
+    configure_logging(force=True) # The parent's log writer thread does not exist in this process
+    startup.restart() # The imports and configuration happened in the parent
+    orders, expected_total = open_order_source(ORDERS_SOURCE, NUM_ORDERS_TO_SEND, shard_index, shard_count, seed)
+    try:
+        handler = send_order_messages_proton(orders, expected_total, links=links, metrics_port_offset=shard_index,
+                                             shard_index=shard_index, shard_count=shard_count)
+    finally:
+        flush_logging() # Pool workers exit without running atexit handlers
+    if handler is None:
+        return {"shard": shard_index, "sent": 0, "confirmed": 0, "rate": None}
+    return {
+        "shard": shard_index,
+        "sent": handler.sent_count,
+        "confirmed": handler.delivered_counts()[0],
+        "rate": handler.throughput()
+    }
+
+def send_order_messages_parallel(processes, links=1):
+    """
+    Splits the configured order source across several producer processes.
+
+    Each process runs its own Qpid Proton container with its own mTLS connection
+    and `links` sender links, so TLS encryption and message encoding scale across cores.
+    Logs a per-process report and an aggregate one once all processes have finished.
+
+    Args:
+        processes (int): The number of producer processes.
+        links (int): The number of sender links per connection.
+
+    Returns:
+        list: The per-shard result dictionaries (see `_run_producer_shard`).
+    """
+    if ORDERS_SOURCE == "-":
+        log.error("Orders read from stdin cannot be split across producer processes.")
+        return []
+    log.info(f"Starting {processes} producer process(es) with {links} sender link(s) each...")
+    started = time.perf_counter()
+    seed = ORDER_SEED if ORDER_SEED is not None else new_seed() # One dataset, so order ids stay unique across shards
+    results = []
+    from concurrent.futures import ProcessPoolExecutor # Imported here: single-process runs do not need multiprocessing
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        futures = [executor.submit(_run_producer_shard, index, processes, links, seed) for index in range(processes)]
+        for index, future in enumerate(futures):
+            try:
+                results.append(future.result())
+            except Exception as e:
+                log.error(f"Process {index} failed: {e}")
+    elapsed = time.perf_counter() - started
+
+    for result in results:
+        rate = f"{result['rate']:.1f} msg/s" if result["rate"] else "n/a"
+        log.info(f"Process {result['shard']}: sent {result['sent']}, confirmed {result['confirmed']} ({rate})")
+    total_sent = sum(result["sent"] for result in results)
+    total_confirmed = sum(result["confirmed"] for result in results)
+    combined_rate = sum(result["rate"] or 0 for result in results)
+    log.info(f"Aggregate: sent {total_sent}, confirmed {total_confirmed} in {elapsed:.3f}s "
+          f"({total_confirmed / elapsed:.1f} msg/s wall clock, {combined_rate:.1f} msg/s combined send rate)")
+    return results
 
 if __name__ == "__main__":
     """
     Main execution block.
-    Generates random orders and then sends them using the AMQP 1.0 producer.
+    Opens the configured order source and streams its orders through the AMQP 1.0 producer,
+    optionally split across several producer processes.
     """
-    print(f"Producer: Generating {NUM_ORDERS_TO_SEND} random orders...")
-    orders_to_send = generate_random_orders(NUM_ORDERS_TO_SEND)
-    # print(f"Producer: Orders generated: {orders_to_send}") # Uncomment for debugging
-    send_order_messages_proton(orders_to_send)
\ No newline at end of file
+    configure_logging()
+    if not defer_default_ssl_domains():
+        log.warning("Cannot defer Proton's default SSL domains, containers create them up front")
+    if ORDERS_SOURCE == "random":
+        log.info(f"Generating {NUM_ORDERS_TO_SEND} random orders on demand...")
+    else:
+        log.info(f"Reading orders from {'stdin' if ORDERS_SOURCE == '-' else ORDERS_SOURCE}...")
+    if PRODUCER_PROCESSES > 1:
+        send_order_messages_parallel(PRODUCER_PROCESSES, PRODUCER_LINKS)
+    else:
+        orders_to_send, expected_total = open_order_source(ORDERS_SOURCE, NUM_ORDERS_TO_SEND)
+        send_order_messages_proton(orders_to_send, expected_total, links=PRODUCER_LINKS)
\ No newline at end of file
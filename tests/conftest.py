@@ -0,0 +1,22 @@
+"""
+Shared pytest setup: the modules under test are scripts at the repository root.
+"""
+import os
+import sys
+
+import pytest
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CERTS_DIR = os.path.join(ROOT_DIR, "certs")
+
+sys.path.insert(0, ROOT_DIR)
+
+
+@pytest.fixture
+def certs_dir():
+    """
+    The certificates generated by `make certs`; tests needing them are skipped without them.
+    """
+    if not os.path.exists(os.path.join(CERTS_DIR, "server.pem")):
+        pytest.skip("No certificates, run `make certs` first")
+    return CERTS_DIR
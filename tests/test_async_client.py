@@ -0,0 +1,88 @@
+"""
+The asyncio bridge: calls queued in both directions with one wakeup per burst, and closing.
+"""
+import asyncio
+
+import pytest
+
+from async_client import _LoopBridge
+
+
+class _CountingInjector:
+    """
+    Stands in for the EventInjector; counts the wakeups of the reactor.
+    """
+    def __init__(self):
+        self.triggered = 0
+        self.closed = False
+
+    def trigger(self, event):
+        if self.closed:
+            raise OSError("injector closed")
+        self.triggered += 1
+
+    def close(self):
+        self.closed = True
+
+
+def _bridge(loop=None):
+    bridge = _LoopBridge(loop)
+    bridge.injector.close()
+    bridge.injector = _CountingInjector()
+    return bridge
+
+
+def test_reactor_calls_wake_the_reactor_once_per_burst():
+    bridge = _bridge()
+    calls = []
+    for i in range(3):
+        bridge.call_in_reactor(calls.append, i)
+    assert bridge.injector.triggered == 1
+    bridge.run_commands()
+    assert calls == [0, 1, 2]
+    bridge.call_in_reactor(calls.append, 3)
+    assert bridge.injector.triggered == 2
+
+
+def test_closed_bridge_refuses_calls():
+    bridge = _bridge()
+    bridge.close()
+    assert bridge.injector.closed
+    with pytest.raises(ConnectionError, match="closed"):
+        bridge.call_in_reactor(print)
+
+
+def test_injector_failure_is_a_connection_error():
+    bridge = _bridge()
+    bridge.injector.close() # Closed by the reactor, not through the bridge
+    with pytest.raises(ConnectionError, match="closed"):
+        bridge.call_in_reactor(print)
+    assert not bridge._commands
+    bridge.injector.closed = False
+    bridge.call_in_reactor(print) # The failed call left no wakeup pending
+    assert bridge.injector.triggered == 1
+
+
+def test_loop_calls_run_in_order_with_one_callback():
+    async def main():
+        loop = asyncio.get_running_loop()
+        bridge = _bridge(loop)
+        calls = []
+        scheduled = []
+        call_soon_threadsafe = loop.call_soon_threadsafe
+        loop.call_soon_threadsafe = lambda *args: scheduled.append(call_soon_threadsafe(*args))
+        try:
+            for i in range(3):
+                bridge.call_in_loop(calls.append, i)
+            await asyncio.sleep(0)
+        finally:
+            del loop.call_soon_threadsafe
+        assert (calls, len(scheduled)) == ([0, 1, 2], 1)
+
+    asyncio.run(main())
+
+
+def test_loop_calls_after_the_loop_closed_are_dropped():
+    loop = asyncio.new_event_loop()
+    loop.close()
+    _bridge(loop).call_in_loop(print, "never")
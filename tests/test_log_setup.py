@@ -0,0 +1,60 @@
+"""
+Logging helpers: the per-message rate limit and the periodic summary line.
+"""
+import logging
+from types import SimpleNamespace
+
+import pytest
+
+import log_setup
+from log_setup import LogSummary, RateLimitFilter, get_message_logger
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """
+    A settable time.monotonic() for the logging helpers.
+    """
+    now = SimpleNamespace(value=100.0)
+    monkeypatch.setattr(log_setup.time, "monotonic", lambda: now.value)
+    return now
+
+
+def _record():
+    return logging.LogRecord("test.messages", logging.INFO, __file__, 1, "message", None, None)
+
+
+def test_rate_limit_allows_a_burst_then_the_rate(clock):
+    rate_limit = RateLimitFilter(rate=2, burst=3)
+    assert [rate_limit.filter(_record()) for _ in range(5)] == [True, True, True, False, False]
+    clock.value += 1 # Two more tokens
+    assert [rate_limit.filter(_record()) for _ in range(3)] == [True, True, False]
+    assert rate_limit.take_suppressed() == 3
+    assert rate_limit.take_suppressed() == 0
+
+
+def test_message_logger_gets_one_filter():
+    logger = get_message_logger("test.rate_limited", rate=5)
+    assert get_message_logger("test.rate_limited", rate=5).filters == [logger.rate_limit]
+    assert getattr(get_message_logger("test.unlimited", rate=0), "rate_limit", None) is None
+
+
+def test_summary_reports_deltas_rate_and_suppressed_lines(clock, caplog):
+    totals = {"sent": 10, "accepted": 8}
+    message_logger = get_message_logger("test.summary.messages", rate=1)
+    message_logger.rate_limit.suppressed = 4
+    summary = LogSummary(logging.getLogger("test.summary"), lambda: dict(totals), message_logger, interval=5)
+    summary.start(SimpleNamespace(schedule=lambda delay, task: None))
+    clock.value += 5
+    totals.update(sent=60, accepted=50)
+    with caplog.at_level(logging.INFO, logger="test.summary"):
+        summary.log()
+    assert caplog.messages == [
+        "50 sent, 42 accepted in the last 5.0s (10.0 msg/s); 4 per-message log line(s) suppressed"]
+
+
+def test_summary_disabled():
+    scheduled = []
+    LogSummary(logging.getLogger("test"), dict, interval=0).start(
+        SimpleNamespace(schedule=lambda delay, task: scheduled.append(task)))
+    assert scheduled == []
@@ -0,0 +1,102 @@
+"""
+Metrics: histogram quantiles, the Prometheus text format and JSON snapshots.
+"""
+import json
+import urllib.request
+
+import pytest
+
+from metrics import Histogram, JsonSnapshotWriter, MetricsRegistry, start_prometheus_server
+
+
+def test_quantiles_interpolate_inside_buckets():
+    histogram = Histogram("latency", "Latency", buckets=(1.0, 2.0, 4.0))
+    for value in (0.5, 1.5, 1.5, 3.0):
+        histogram.observe(value)
+    assert histogram.counts == [1, 2, 1, 0]
+    assert histogram.quantile(0.25) == pytest.approx(1.0) # Top of the first bucket
+    assert histogram.quantile(0.5) == pytest.approx(1.5) # Halfway through the second
+    assert histogram.quantile(1.0) == pytest.approx(3.0) # Capped at the largest value seen
+    assert histogram.summary() == {"count": 4, "mean": 1.625, "p50": pytest.approx(1.5),
+                                   "p90": pytest.approx(3.0), "p99": pytest.approx(3.0), "max": 3.0}
+
+
+def test_values_above_the_largest_bucket():
+    histogram = Histogram("latency", "Latency", buckets=(1.0,))
+    histogram.observe(5.0)
+    histogram.observe(9.0)
+    assert histogram.counts == [0, 2]
+    assert histogram.quantile(0.5) == pytest.approx(5.0) # Interpolated between 1.0 and the maximum
+    assert histogram.quantile(0.99) <= 9.0
+
+
+def test_empty_histogram():
+    histogram = Histogram("latency", "Latency")
+    assert histogram.quantile(0.5) is None
+    assert histogram.summary()["mean"] is None
+
+
+def test_merge():
+    first, second = Histogram("a", "A", (1.0, 2.0)), Histogram("b", "B", (1.0, 2.0))
+    first.observe(0.5)
+    second.observe(1.5)
+    second.observe(3.0)
+    first.merge(second)
+    assert (first.counts, first.count, first.sum, first.max) == ([1, 1, 1], 3, 5.0, 3.0)
+    with pytest.raises(ValueError, match="different buckets"):
+        first.merge(Histogram("c", "C", (1.0,)))
+
+
+def _registry():
+    registry = MetricsRegistry("order_test")
+    sent = registry.counter("messages_sent_total", "Messages sent")
+    registry.gauge("in_flight", "Messages in flight", lambda: 3)
+    latency = registry.histogram("latency_seconds", "Latency", buckets=(0.1, 1.0))
+    sent.inc(5)
+    latency.observe(0.05)
+    latency.observe(0.5)
+    return registry
+
+
+def test_prometheus_text_format():
+    assert _registry().prometheus_text() == "\n".join([
+        "# HELP order_test_messages_sent_total Messages sent",
+        "# TYPE order_test_messages_sent_total counter",
+        "order_test_messages_sent_total 5",
+        "# HELP order_test_in_flight Messages in flight",
+        "# TYPE order_test_in_flight gauge",
+        "order_test_in_flight 3",
+        "# HELP order_test_latency_seconds Latency",
+        "# TYPE order_test_latency_seconds histogram",
+        'order_test_latency_seconds_bucket{le="0.1"} 1',
+        'order_test_latency_seconds_bucket{le="1.0"} 2',
+        'order_test_latency_seconds_bucket{le="+Inf"} 2',
+        "order_test_latency_seconds_sum 0.55",
+        "order_test_latency_seconds_count 2",
+    ]) + "\n"
+
+
+def test_prometheus_server():
+    server = start_prometheus_server(_registry(), 0)
+    try:
+        url = f"http://127.0.0.1:{server.server_address[1]}/metrics"
+        with urllib.request.urlopen(url, timeout=5) as response:
+            assert response.headers["Content-Type"].startswith("text/plain; version=0.0.4")
+            assert "order_test_messages_sent_total 5" in response.read().decode()
+    finally:
+        server.shutdown()
+
+
+def test_json_snapshots(tmp_path):
+    registry = _registry()
+    path = tmp_path / "metrics.jsonl"
+    writer = JsonSnapshotWriter(registry, 1, str(path))
+    writer.write()
+    registry.metrics[0].inc(2)
+    writer.write()
+    first, second = (json.loads(line) for line in path.read_text().splitlines())
+    assert first["metrics"] == "order_test"
+    assert first["values"] == {"order_test_messages_sent_total": 5, "order_test_in_flight": 3}
+    assert second["values"]["order_test_messages_sent_total"] == 7
+    assert set(second["rates_per_second"]) == {"order_test_messages_sent_total"} # Gauges have no rate
+    assert second["histograms"]["order_test_latency_seconds"]["count"] == 2
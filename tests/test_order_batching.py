@@ -0,0 +1,102 @@
+"""
+Order batching: batch encode/decode round trips, batch collection and the OrderFeed thread.
+"""
+import threading
+import time
+
+import pytest
+from proton import Message
+
+from order_batching import BATCH_COUNT_PROPERTY, MessageBatcher, OrderFeed, decode_orders, encode_batches
+from order_codecs import CODECS, PayloadError
+
+ORDERS = [{"order_id": str(i), "amount": i * 1.5} for i in range(5)]
+
+FORMATS = [("json", "json"), ("amqp", "json"), ("frames", "json")]
+if CODECS["msgpack"].available:
+    FORMATS.append(("frames", "msgpack"))
+if CODECS["orjson"].available:
+    FORMATS.append(("json", "orjson"))
+
+
+def _wire(message):
+    received = Message()
+    received.decode(message.encode())
+    return received
+
+
+@pytest.mark.parametrize("batch_format,codec", FORMATS)
+def test_round_trip(batch_format, codec):
+    batcher = MessageBatcher(10, batch_format=batch_format, codec=CODECS[codec])
+    assert decode_orders(_wire(batcher.message(ORDERS))) == ORDERS
+
+
+def test_single_order_messages_are_not_batches():
+    message = CODECS["json"].message(ORDERS[0])
+    assert decode_orders(_wire(message)) == [ORDERS[0]]
+
+
+def test_count_mismatch_is_rejected():
+    message = MessageBatcher(10).message(ORDERS)
+    message.properties[BATCH_COUNT_PROPERTY] = 4
+    with pytest.raises(PayloadError, match="announces 4"):
+        decode_orders(_wire(message))
+
+
+def test_truncated_frame_is_rejected():
+    message = MessageBatcher(10, batch_format="frames").message(ORDERS)
+    message.body = message.body[:-3]
+    with pytest.raises(PayloadError, match="truncated frame"):
+        decode_orders(_wire(message))
+
+
+def test_frames_need_a_serializing_codec():
+    with pytest.raises(ValueError, match="serializing codec"):
+        MessageBatcher(10, batch_format="frames", codec=CODECS["amqp"])
+
+
+def test_collect_by_size_and_limit():
+    batcher = MessageBatcher(2)
+    source = iter(ORDERS)
+    assert batcher.collect(source, limit=1) == ORDERS[:1]
+    assert batcher.collect(source) == ORDERS[1:3]
+    assert batcher.collect(source) == ORDERS[3:5]
+    assert batcher.collect(source) == []
+
+
+def test_encode_batches():
+    messages = encode_batches(ORDERS, MessageBatcher(2))
+    assert [message.orders for message in messages] == [2, 2, 1]
+
+
+def test_feed_closes_the_batch_at_its_deadline():
+    release = threading.Event()
+
+    def slow_source():
+        yield ORDERS[0]
+        release.wait(5)
+        yield ORDERS[1]
+
+    feed = OrderFeed(slow_source())
+    started = time.monotonic()
+    assert MessageBatcher(10, timeout_ms=50).collect(feed) == ORDERS[:1]
+    assert time.monotonic() - started < 2
+    release.set()
+    assert MessageBatcher(10, timeout_ms=50).collect(feed) == ORDERS[1:2]
+    assert feed.get() is None
+
+
+def test_feed_raises_source_errors_after_the_orders_read():
+    def failing_source():
+        yield ORDERS[0]
+        raise RuntimeError("source failed")
+
+    feed = OrderFeed(failing_source())
+    assert MessageBatcher(10).collect(feed) == ORDERS[:1]
+    with pytest.raises(RuntimeError, match="source failed"):
+        feed.get()
+    assert feed.get() is None
+
+
+def test_feed_iterates():
+    assert list(OrderFeed(iter(ORDERS))) == ORDERS
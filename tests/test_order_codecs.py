@@ -0,0 +1,58 @@
+"""
+Order codecs: round trips through bodies and complete AMQP messages, and content type dispatch.
+"""
+import pytest
+from proton import Message
+
+from order_codecs import CODECS, PayloadError, codec_for_content_type, decode_order, get_codec
+
+ORDER = {"order_id": "a1b2", "customer_id": 7, "amount": 12.5, "items": ["x", "y"]}
+
+AVAILABLE = [name for name, codec in CODECS.items() if codec.available]
+
+
+def _wire(message):
+    received = Message()
+    received.decode(message.encode())
+    return received
+
+
+@pytest.mark.parametrize("name", AVAILABLE)
+def test_round_trip(name):
+    codec = get_codec(name)
+    assert codec.decode(codec.encode(ORDER)) == ORDER
+    assert decode_order(_wire(codec.message(ORDER))) == ORDER
+
+
+@pytest.mark.parametrize("name", AVAILABLE)
+def test_batch_round_trip(name):
+    codec = get_codec(name)
+    if name == "amqp":
+        pytest.skip("Native AMQP batches are lists of maps, not an encoded body")
+    assert codec.decode_batch(codec.encode([ORDER, ORDER])) == [ORDER, ORDER]
+    with pytest.raises(PayloadError):
+        codec.decode_batch(codec.encode(ORDER))
+
+
+def test_message_without_content_type():
+    assert decode_order(_wire(Message(body='{"order_id": 1}'))) == {"order_id": 1}
+    assert decode_order(_wire(Message(body={"order_id": 1}))) == {"order_id": 1}
+
+
+def test_content_type_parameters_are_ignored():
+    assert codec_for_content_type("Application/JSON; charset=utf-8") is CODECS["json"]
+    with pytest.raises(PayloadError, match="Unsupported content type"):
+        codec_for_content_type("text/plain")
+
+
+def test_invalid_payloads():
+    json_codec = get_codec("json")
+    with pytest.raises(PayloadError, match="Invalid json payload"):
+        json_codec.decode("{not json")
+    with pytest.raises(PayloadError, match="expected an object"):
+        json_codec.decode("[1, 2]")
+
+
+def test_unknown_codec():
+    with pytest.raises(ValueError, match="Unknown order codec"):
+        get_codec("xml")
@@ -0,0 +1,109 @@
+"""
+Deduplication cache: LRU and time-window eviction, and persistence across reopening.
+"""
+from types import SimpleNamespace
+
+import pytest
+
+import order_dedup
+from order_dedup import DedupCache
+
+NO_ID = SimpleNamespace(id=None)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """
+    A settable time.time() for the cache.
+    """
+    now = SimpleNamespace(value=1000.0)
+    monkeypatch.setattr(order_dedup.time, "time", lambda: now.value)
+    return now
+
+
+def _process(cache, *order_ids):
+    """
+    Filters orders as the consumer does and remembers the fresh ones; returns their ids.
+    """
+    fresh, keys = cache.filter(NO_ID, [{"order_id": order_id} for order_id in order_ids])
+    cache.add(keys)
+    cache.commit()
+    return [order["order_id"] for order in fresh]
+
+
+def test_duplicates_are_dropped():
+    cache = DedupCache()
+    assert _process(cache, 1, 2) == [1, 2]
+    assert _process(cache, 2, 3) == [3]
+    fresh, _ = cache.filter(NO_ID, [{"amount": 1}]) # No order_id: always processed
+    assert fresh == [{"amount": 1}]
+    assert cache.stats() == {"hits": 1, "misses": 3, "hit_rate": 0.25, "entries": 3}
+
+
+def test_message_id_key():
+    cache = DedupCache("message_id")
+    message = SimpleNamespace(id="m-1")
+    orders = [{"order_id": 1}, {"order_id": 2}]
+    fresh, keys = cache.filter(message, orders)
+    cache.add(keys)
+    assert fresh == orders
+    assert cache.filter(message, orders) == ([], [])
+
+
+def test_least_recently_seen_keys_are_evicted():
+    cache = DedupCache(max_entries=2)
+    _process(cache, 1, 2)
+    _process(cache, 1) # Refreshes 1, so 2 is evicted next
+    _process(cache, 3)
+    assert _process(cache, 1, 2) == [2]
+
+
+def test_keys_expire_after_the_time_window(clock):
+    cache = DedupCache(ttl_seconds=10)
+    _process(cache, 1)
+    clock.value += 5
+    _process(cache, 2)
+    clock.value += 6
+    assert _process(cache, 1, 2) == [1]
+    assert cache.size == 2
+
+
+def test_unsupported_key():
+    with pytest.raises(ValueError, match="Unsupported deduplication key"):
+        DedupCache("customer_id")
+
+
+def test_keys_persist_across_reopening(tmp_path, clock):
+    path = str(tmp_path / "keys.db")
+    cache = DedupCache(max_entries=2, path=path)
+    _process(cache, 1, 2, 3)
+    cache.close()
+    cache = DedupCache(max_entries=2, path=path)
+    assert cache.size == 2 # Only the most recently seen keys are loaded
+    assert _process(cache, 1, 2, 3) == [1]
+    cache.close()
+
+
+def test_refreshed_keys_survive_pruning(tmp_path, clock):
+    path = str(tmp_path / "keys.db")
+    cache = DedupCache(max_entries=2, path=path)
+    _process(cache, 1)
+    clock.value += 1
+    _process(cache, 2)
+    clock.value += 1
+    _process(cache, 1) # Seen again: now more recent than 2
+    clock.value += 1
+    _process(cache, 3) # Evicts 2 and prunes the database by the oldest key in memory
+    cache.close()
+    cache = DedupCache(max_entries=2, path=path)
+    assert _process(cache, 1, 3) == []
+    cache.close()
+
+
+def test_expired_keys_are_not_loaded(tmp_path, clock):
+    path = str(tmp_path / "keys.db")
+    cache = DedupCache(ttl_seconds=10, path=path)
+    _process(cache, 1)
+    cache.close()
+    clock.value += 11
+    assert DedupCache(ttl_seconds=10, path=path).size == 0
@@ -0,0 +1,47 @@
+"""
+Order generation: reproducible datasets, shards and order ids.
+"""
+import pytest
+from proton import Message
+
+from order_codecs import CODECS
+from order_generator import encode_orders, generate_order_batch, iter_orders, load_numpy
+
+ITEMS = [{"id_prefix": "ITEM_A", "description": "Widget"}, {"id_prefix": "ITEM_B", "description": "Gadget"}]
+
+BACKENDS = [False] + ([True] if load_numpy() is not None else [])
+
+
+@pytest.mark.parametrize("use_numpy", BACKENDS)
+def test_orders_are_valid(use_numpy):
+    orders = generate_order_batch(500, ITEMS, 5, seed=1, use_numpy=use_numpy)
+    assert len({order["order_id"] for order in orders}) == 500
+    for order in orders:
+        assert order["order_id"].startswith("ORD_MTLS_") and len(order["order_id"]) == 17
+        assert order["item_id"][:7] in ("ITEM_A_", "ITEM_B_") and 100 <= int(order["item_id"][7:]) < 1000
+        assert order["description"] == {"ITEM_A": "Widget", "ITEM_B": "Gadget"}[order["item_id"][:6]]
+        assert 1 <= order["quantity"] <= 5
+
+
+@pytest.mark.parametrize("use_numpy", BACKENDS)
+def test_seed_fixes_the_dataset(use_numpy):
+    first = generate_order_batch(100, ITEMS, 5, seed=7, use_numpy=use_numpy)
+    assert generate_order_batch(100, ITEMS, 5, seed=7, use_numpy=use_numpy) == first
+    assert generate_order_batch(100, ITEMS, 5, seed=8, use_numpy=use_numpy) != first
+
+
+def test_shards_cover_the_dataset():
+    whole = list(iter_orders(250, ITEMS, 5, seed=3, batch_size=50))
+    shards = [list(iter_orders(125, ITEMS, 5, seed=3, start=start, batch_size=50, dataset_size=250))
+              for start in (0, 125)]
+    assert [order["order_id"] for order in shards[0] + shards[1]] == [order["order_id"] for order in whole]
+    assert shards[0][:100] == whole[:100] # Batches starting at the same position are drawn alike
+
+
+def test_encode_orders():
+    orders = generate_order_batch(3, ITEMS, 5, seed=1)
+    for encoded, order in zip(encode_orders(orders, CODECS["json"]), orders):
+        message = Message()
+        message.decode(encoded.data)
+        assert CODECS["json"].decode(message.body) == order
+        assert encoded.orders == 1
@@ -0,0 +1,51 @@
+"""
+Order routing: ROUTES parsing, longest-prefix routing and routing functions.
+"""
+import pytest
+
+import order_routing
+from order_routing import item_prefix_router, load_route_function, parse_routes
+
+DEFAULT = "/queues/orders"
+
+
+def test_parse_routes():
+    assert parse_routes(" ITEM_A = /queues/a ,, ITEM_B=/exchanges/x/b ") == {
+        "ITEM_A": "/queues/a", "ITEM_B": "/exchanges/x/b"}
+    assert parse_routes("") == {}
+
+
+@pytest.mark.parametrize("text", ["ITEM_A", "=/queues/a", "ITEM_A= "])
+def test_parse_routes_rejects_invalid_pairs(text):
+    with pytest.raises(ValueError, match="expected prefix=address"):
+        parse_routes(text)
+
+
+def test_longest_prefix_wins():
+    router = item_prefix_router({"ITEM": "/queues/items", "ITEM_A": "/queues/a", "ITEM_AB": "/queues/ab"}, DEFAULT)
+    assert router.route({"item_id": "ITEM_AB1"}) == "/queues/ab"
+    assert router.route({"item_id": "ITEM_A9"}) == "/queues/a"
+    assert router.route({"item_id": "ITEM_C"}) == "/queues/items"
+    assert router.route({"item_id": "OTHER"}) == DEFAULT
+    assert router.route({}) == DEFAULT
+
+
+def test_load_route_function():
+    assert load_route_function("os.path:basename")("/queues/a") == "a"
+    with pytest.raises(ValueError, match="expected 'item_prefix' or 'module:function'"):
+        load_route_function("os.path")
+    with pytest.raises(ValueError, match="Cannot load"):
+        load_route_function("os.path:missing")
+    with pytest.raises(ValueError, match="not callable"):
+        load_route_function("os:sep")
+
+
+def test_create_router(monkeypatch):
+    monkeypatch.setattr(order_routing, "ROUTE_BY", None)
+    assert order_routing.create_router(DEFAULT) is None
+    monkeypatch.setattr(order_routing, "ROUTE_BY", "item_prefix")
+    monkeypatch.setattr(order_routing, "ROUTES", "")
+    with pytest.raises(ValueError, match="at least one"):
+        order_routing.create_router(DEFAULT)
+    monkeypatch.setattr(order_routing, "ROUTES", "ITEM_A=/queues/a")
+    assert order_routing.create_router(DEFAULT).route({"item_id": "ITEM_A1"}) == "/queues/a"
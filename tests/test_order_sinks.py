@@ -0,0 +1,53 @@
+"""
+Order sinks: the SQLite reference sink and sink selection through the environment.
+"""
+import json
+import sqlite3
+
+import pytest
+
+import order_sinks
+from order_sinks import SQLiteOrderSink
+
+
+def _rows(path):
+    with sqlite3.connect(path) as db:
+        return db.execute("SELECT order_id, item_id, quantity, payload FROM orders ORDER BY order_id").fetchall()
+
+
+def test_sqlite_sink_writes_batches(tmp_path):
+    path = str(tmp_path / "orders.db")
+    sink = SQLiteOrderSink(path)
+    sink.write([{"order_id": 1, "item_id": "ITEM_A", "quantity": 2}, {"order_id": 2, "item_id": "ITEM_B", "quantity": 1}])
+    sink.write([{"order_id": 1, "item_id": "ITEM_A", "quantity": 5}]) # A redelivered order replaces its row
+    sink.close()
+    rows = _rows(path)
+    assert [row[:3] for row in rows] == [("1", "ITEM_A", 5), ("2", "ITEM_B", 1)]
+    assert json.loads(rows[0][3]) == {"order_id": 1, "item_id": "ITEM_A", "quantity": 5}
+    assert sink.rows_written == 3
+
+
+def test_sqlite_sink_failed_batch_stores_nothing(tmp_path):
+    path = str(tmp_path / "orders.db")
+    sink = SQLiteOrderSink(path)
+    with pytest.raises(sqlite3.Error):
+        sink.write([{"order_id": 1}, {"order_id": 2, "quantity": object()}]) # Not bindable
+    sink.close()
+    assert _rows(path) == []
+    assert sink.rows_written == 0
+
+
+def test_create_sink(monkeypatch, tmp_path):
+    monkeypatch.setattr(order_sinks, "CONSUMER_SINK", None)
+    assert order_sinks.create_sink() is None
+    monkeypatch.setattr(order_sinks, "CONSUMER_SINK", "sqlite")
+    monkeypatch.setattr(order_sinks, "SINK_SQLITE_PATH", str(tmp_path / "orders-{consumer}.db"))
+    sink = order_sinks.create_sink(3)
+    assert sink.path == str(tmp_path / "orders-3.db")
+    sink.close()
+    monkeypatch.setattr(order_sinks, "CONSUMER_SINK", "collections:deque")
+    assert order_sinks.create_sink() is not None
+    for spec, error in (("collections", "expected 'sqlite'"), ("collections:missing", "Cannot load")):
+        monkeypatch.setattr(order_sinks, "CONSUMER_SINK", spec)
+        with pytest.raises(ValueError, match=error):
+            order_sinks.create_sink()
@@ -0,0 +1,120 @@
+"""
+Order spool: recovery of unsettled records across reopening, torn records and segment deletion.
+"""
+import os
+
+from order_spool import SEGMENT_SUFFIX, OrderSpool
+
+SEGMENT_BYTES = 256
+
+
+def _payload(i):
+    return f"message-{i:03d}".encode() * 3
+
+
+def _segments(directory):
+    return sorted(name for name in os.listdir(directory) if name.endswith(SEGMENT_SUFFIX))
+
+
+def _read_all(spool):
+    records = []
+    while (record := spool.read()) is not None:
+        records.append(record)
+    return records
+
+
+def test_records_are_read_in_order(tmp_path):
+    spool = OrderSpool(str(tmp_path), SEGMENT_BYTES)
+    for i in range(10):
+        spool.append(_payload(i), orders=i + 1)
+    spool.finish()
+    records = _read_all(spool)
+    assert [record.data for record in records] == [_payload(i) for i in range(10)]
+    assert [record.orders for record in records] == list(range(1, 11))
+    assert spool.exhausted()
+    spool.close()
+
+
+def test_unsettled_records_are_recovered(tmp_path):
+    spool = OrderSpool(str(tmp_path), SEGMENT_BYTES)
+    for i in range(10):
+        spool.append(_payload(i), orders=2)
+    spool.finish()
+    records = _read_all(spool)
+    for record in records[:4]:
+        spool.ack(record)
+    spool.close()
+
+    spool = OrderSpool(str(tmp_path), SEGMENT_BYTES)
+    assert (spool.recovered, spool.recovered_orders) == (6, 12)
+    spool.finish()
+    assert [record.data for record in _read_all(spool)] == [_payload(i) for i in range(4, 10)]
+    spool.close()
+
+
+def test_out_of_order_acks_settle_up_to_the_first_gap(tmp_path):
+    spool = OrderSpool(str(tmp_path), 4096)
+    for i in range(3):
+        spool.append(_payload(i))
+    spool.finish()
+    _, second, third = _read_all(spool)
+    spool.ack(second)
+    spool.ack(third)
+    spool.close()
+
+    spool = OrderSpool(str(tmp_path), 4096)
+    assert spool.recovered == 3 # Nothing settled before the first record
+    spool.finish()
+    assert _read_all(spool)[0].data == _payload(0)
+    spool.close()
+
+
+def test_torn_record_ends_the_scan(tmp_path):
+    spool = OrderSpool(str(tmp_path), 4096)
+    for i in range(3):
+        spool.append(_payload(i))
+    segment = spool._segments[-1]
+    last = segment.end - len(_payload(2))
+    segment.mm[last:last + 4] = b"torn" # A crash in the middle of the last record
+    spool.close()
+
+    spool = OrderSpool(str(tmp_path), 4096)
+    assert spool.recovered == 2
+    spool.finish()
+    assert [record.data for record in _read_all(spool)] == [_payload(0), _payload(1)]
+    spool.close()
+
+
+def test_settled_segments_are_deleted(tmp_path):
+    spool = OrderSpool(str(tmp_path), SEGMENT_BYTES)
+    for i in range(10):
+        spool.append(_payload(i))
+    assert len(_segments(tmp_path)) > 1
+    spool.finish()
+    records = _read_all(spool)
+    for record in records[:-1]:
+        spool.ack(record)
+    assert _segments(tmp_path) == [os.path.basename(records[-1].segment.path)]
+    spool.ack(records[-1])
+    assert _segments(tmp_path) == []
+    assert spool.pending() == (0, 0)
+    spool.close()
+
+
+def test_empty_segments_are_removed_on_opening(tmp_path):
+    spool = OrderSpool(str(tmp_path), SEGMENT_BYTES)
+    spool.append(_payload(0))
+    spool.finish()
+    spool.ack(_read_all(spool)[0])
+    spool.close()
+    assert OrderSpool(str(tmp_path), SEGMENT_BYTES).recovered == 0
+    assert _segments(tmp_path) == []
+
+
+def test_oversized_message_gets_its_own_segment(tmp_path):
+    spool = OrderSpool(str(tmp_path), SEGMENT_BYTES)
+    data = b"x" * (SEGMENT_BYTES * 2)
+    spool.append(data)
+    spool.finish()
+    assert _read_all(spool)[0].data == data
+    spool.close()
@@ -0,0 +1,130 @@
+"""
+TLSContext against the local broker: session resumption goes through Proton internals
+(the connector's _connect and the transport's SSL layer), so a Proton upgrade that
+changes them must fail here.
+
+Proton servers cannot resume TLS sessions of clients with certificates (they set no
+session id context), so the broker listens on plain AMQP behind a Python TLS front end.
+"""
+import select
+import socket
+import ssl
+import threading
+
+import pytest
+from proton.handlers import MessagingHandler
+from proton.reactor import Container
+
+from local_broker import start_broker_process
+from tls_context import TLSContext
+
+
+def _relay(tls, backend):
+    # One thread per connection: an SSL socket must not be read and written concurrently
+    peers = {tls: backend, backend: tls}
+    try:
+        while True:
+            readable = [tls] if tls.pending() else select.select(list(peers), [], [])[0]
+            for source in readable:
+                data = source.recv(65536)
+                if not data:
+                    return
+                peers[source].sendall(data)
+    except OSError:
+        pass
+    finally:
+        tls.close()
+        backend.close()
+
+
+def _serve_tls(listener, context, backend_port):
+    while True:
+        try:
+            raw, _ = listener.accept()
+        except OSError:
+            return # Listener closed
+        try:
+            tls = context.wrap_socket(raw, server_side=True)
+        except OSError:
+            raw.close()
+            continue
+        backend = socket.create_connection(("localhost", backend_port))
+        threading.Thread(target=_relay, args=(tls, backend), daemon=True).start()
+
+
+def _free_port():
+    with socket.socket() as probe:
+        probe.bind(("localhost", 0))
+        return probe.getsockname()[1]
+
+
+@pytest.fixture(params=[ssl.TLSVersion.TLSv1_3, ssl.TLSVersion.TLSv1_2], ids=["tls1.3", "tls1.2"])
+def broker_url(request, certs_dir):
+    """
+    amqps URL of a TLS front end, requiring client certificates, to a local broker.
+    """
+    backend_port = _free_port()
+    broker = start_broker_process(f"amqp://localhost:{backend_port}")
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(f"{certs_dir}/server.pem", f"{certs_dir}/server.key")
+    context.load_verify_locations(f"{certs_dir}/ca.pem")
+    context.verify_mode = ssl.CERT_REQUIRED
+    context.maximum_version = request.param
+    listener = socket.socket()
+    listener.bind(("localhost", 0))
+    listener.listen()
+    threading.Thread(target=_serve_tls, args=(listener, context, backend_port), daemon=True).start()
+    yield f"amqps://localhost:{listener.getsockname()[1]}"
+    listener.close()
+    broker.terminate()
+    broker.join(5)
+
+
+class _Reconnector(MessagingHandler):
+    """
+    Opens `connections` connections one after the other through a TLSContext.
+    """
+    def __init__(self, context, url, connections):
+        super().__init__()
+        self.context = context
+        self.url = url
+        self.remaining = connections
+        self.errors = []
+
+    def on_start(self, event):
+        self._open(event.container)
+
+    def _open(self, container):
+        self.context.connect(container, self.url, allowed_mechs="ANONYMOUS", reconnect=False)
+
+    def on_connection_opened(self, event):
+        self.context.handshake_completed(event.connection)
+        event.connection.close()
+
+    def on_transport_error(self, event):
+        self.errors.append(str(event.transport.condition))
+
+    def on_transport_closed(self, event):
+        event.transport.unbind() # Stores the TLS session for the next connection
+        self.remaining -= 1
+        if self.remaining and not self.errors:
+            self._open(event.container)
+        else:
+            event.container.stop()
+
+
+def _connect(certs_dir, url, connections, session_resumption=True):
+    context = TLSContext(f"{certs_dir}/ca.pem", f"{certs_dir}/order_sender_client.pem",
+                         f"{certs_dir}/order_sender_client.key", session_resumption=session_resumption)
+    handler = _Reconnector(context, url, connections)
+    Container(handler).run()
+    assert handler.errors == []
+    return [status for _, status in context.handshakes]
+
+
+def test_second_connection_resumes_the_tls_session(certs_dir, broker_url):
+    assert _connect(certs_dir, broker_url, 3) == ["new", "reused", "reused"]
+
+
+def test_no_resumption_when_disabled(certs_dir, broker_url):
+    assert _connect(certs_dir, broker_url, 2, session_resumption=False) == ["new", "new"]
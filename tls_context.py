@@ -0,0 +1,351 @@
+"""
+Shared mTLS client context for the AMQP 1.0 producer and consumer.
+
+Loading the CA and the client certificate/key into an SSLDomain is done once
+per (CA, cert, key) triple and the domain is reused by every connection the
+process opens. Each connection also carries an SSLSessionDetails session id,
+so Proton can resume the TLS session of a previous connection to the same
+broker (reconnects, sequential runs in the same process) instead of doing a
+full handshake with certificate exchange.
+
+The time from socket connect to the AMQP open frame is measured per
+connection together with the TLS resume status, so the gain is visible.
+
+Creating an SSLDomain loads the system CA store, which takes tens of
+milliseconds. Proton's Container creates a client and a server domain of its
+own up front, which connections made through a TLSContext never use; the producer
+and consumer call defer_default_ssl_domains() so Container creates them on first
+use instead, and they no longer delay the startup (see startup_profile.py).
+
+Environment variables:
+- TLS_SESSION_RESUMPTION: If "true" (default), offer TLS session resumption on
+  every connection made through a TLSContext.
+
+Running this module directly opens a number of sequential connections with the
+producer credentials and prints the handshake latency with and without
+session resumption:
+
+    python tls_context.py [CONNECTIONS]
+"""
+import logging
+import os
+import sys
+import time
+
+from proton import SSL, SSLDomain, SSLSessionDetails, SSLUnavailable, Url
+from proton import _reactor
+
+log = logging.getLogger("tls_context")
+
+TLS_SESSION_RESUMPTION = os.getenv("TLS_SESSION_RESUMPTION", "true").lower() in ("1", "true", "yes")
+
+_RESUME_STATUS = {
+    SSL.RESUME_NEW: "new",
+    SSL.RESUME_REUSED: "reused",
+    SSL.RESUME_UNKNOWN: "unknown",
+}
+
+_contexts = {} # (CA, cert, key) -> TLSContext
+
+
+class _LazySSLConfig:
+    """
+    Container.ssl, with its default client and server SSLDomains created on first use rather than by Container().
+    """
+    def __init__(self):
+        if not SSL.present():
+            raise SSLUnavailable() # As SSLDomain() would, so Container sets ssl to None
+        self._client = None
+        self._server = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = SSLDomain(SSLDomain.MODE_CLIENT)
+        return self._client
+
+    @property
+    def server(self):
+        if self._server is None:
+            self._server = SSLDomain(SSLDomain.MODE_SERVER)
+        return self._server
+
+    def set_credentials(self, cert_file, key_file, password):
+        self.client.set_credentials(cert_file, key_file, password)
+        self.server.set_credentials(cert_file, key_file, password)
+
+    def set_trusted_ca_db(self, certificate_db):
+        self.client.set_trusted_ca_db(certificate_db)
+        self.server.set_trusted_ca_db(certificate_db)
+
+
+def defer_default_ssl_domains():
+    """
+    Makes every later Container() of the process create its default client and server
+    SSLDomains on first use. Connections made through a TLSContext never use them.
+
+    Replaces Proton's internal `proton._reactor.SSLConfig`, so it is called explicitly
+    by the producer and consumer scripts rather than on import.
+
+    Returns:
+        bool: True if applied, False if this Proton version has no SSLConfig to replace
+        (the containers then create the domains up front, as before).
+    """
+    if not isinstance(getattr(_reactor, "SSLConfig", None), type):
+        return False
+    _reactor.SSLConfig = _LazySSLConfig # Looked up by Container() on each call
+    return True
+
+
+class TLSContext:
+    """
+    Client mTLS credentials loaded once and shared by all connections.
+
+    Wraps a single SSLDomain configured for peer name verification. Connections
+    opened through connect() get a session id so their TLS sessions can be
+    resumed, and their handshake latency is recorded.
+    """
+    def __init__(self, ca_cert_path, cert_path, key_path, key_password=None, session_resumption=True):
+        """
+        Loads the CA and client credentials into a new SSLDomain.
+
+        Args:
+            ca_cert_path (str): Path of the trusted CA certificate.
+            cert_path (str): Path of the client certificate.
+            key_path (str): Path of the client private key.
+            key_password (str, optional): Password of the client key, if any.
+            session_resumption (bool): Whether to offer TLS session resumption.
+        """
+        self.ca_cert_path = ca_cert_path
+        self.cert_path = cert_path
+        self.key_path = key_path
+        self.session_resumption = session_resumption
+        self.domain = SSLDomain(SSLDomain.MODE_CLIENT)
+        self.domain.set_peer_authentication(SSLDomain.VERIFY_PEER_NAME)
+        self.domain.set_trusted_ca_db(ca_cert_path)
+        self.domain.set_credentials(cert_path, key_path, key_password)
+        self.handshakes = [] # (latency in seconds, resume status) per opened connection
+        self._started = {} # Connection -> (perf_counter at socket connect, SSL object, session id)
+        self._resumable = set() # Session ids with at least one completed handshake
+        self._not_resumable = set() # Session ids whose resumed handshake failed
+
+    def session_id(self, url):
+        """
+        Returns the TLS session id used for connections to the given URL.
+
+        Sessions are only resumed against the broker that issued them, so the
+        id is derived from the client certificate and the broker address.
+
+        Args:
+            url (proton.Url): The broker URL.
+
+        Returns:
+            str: The session id.
+        """
+        return f"{os.path.basename(self.cert_path)}@{url.host}:{url.port}"
+
+    def connect(self, container, url=None, sni=None, **kwargs):
+        """
+        Opens a connection using the shared SSL domain.
+
+        Takes the same arguments as Container.connect() (except ssl_domain).
+        Every transport Proton creates for the connection, including the ones
+        created on reconnect, is timed and, when session resumption is enabled,
+        gets an SSL layer bound to this context's session id. If this Proton
+        version does not expose the connector, the connection uses the shared
+        domain without session resumption or handshake timing.
+
+        Args:
+            container (proton.reactor.Container): The container to connect from.
+            url (str, optional): The broker URL (or pass `urls` for a failover list).
+            sni (str, optional): Host name sent in the TLS SNI extension and
+                checked against the server certificate. Defaults to the host
+                of the URL being connected to.
+            **kwargs: Further keyword arguments for Container.connect().
+
+        Returns:
+            proton.Connection: The connection, or None if connect() failed.
+        """
+        conn = container.connect(url=url, sni=sni, ssl_domain=self.domain, **kwargs)
+        if conn:
+            self._instrument(conn)
+        return conn
+
+    def _instrument(self, conn):
+        """
+        Wraps the connector Proton attaches to the connection.
+
+        Proton builds the transport and its SSL layer inside the connector and
+        does not let callers pass SSLSessionDetails, so amqps URLs are handed to
+        it as plain amqp and the SSL layer is added here with the session id.
+
+        Args:
+            conn (proton.Connection): A connection returned by Container.connect().
+        """
+        connector = getattr(conn, "_overrides", None) # Proton internals, checked before use
+        connect = getattr(connector, "_connect", None)
+        if connect is None or not all(hasattr(connector, name) for name in ("ssl_domain", "ssl_sni")):
+            log.warning("Proton's connector is not accessible, connecting without TLS session resumption")
+            return
+
+        def _connect(connection, url):
+            tls = url.scheme == "amqps"
+            session_id = self.session_id(url) if tls and self.session_resumption else None
+            if session_id and session_id not in self._not_resumable:
+                plain_url = Url(str(url))
+                plain_url.scheme = "amqp"
+                connect(connection, plain_url)
+                connection.url = url
+                ssl = SSL(connection.transport, self.domain, SSLSessionDetails(session_id))
+            else:
+                connect(connection, url)
+                ssl = connector.ssl if tls else None
+                session_id = None
+            if ssl:
+                # Proton falls back to the AMQP virtual host, which is not a DNS name for RabbitMQ
+                ssl.peer_hostname = connector.ssl_sni or url.host
+            self._started[connection] = (time.perf_counter(), ssl, session_id)
+
+        connector._connect = _connect
+
+    def handshake_completed(self, connection):
+        """
+        Records the handshake of a connection that has just been opened.
+
+        Call from the handler's on_connection_opened().
+
+        Args:
+            connection (proton.Connection): The opened connection.
+
+        Returns:
+            tuple: (latency in seconds, resume status) or None if the
+                connection was not opened through this context.
+        """
+        started = self._started.pop(connection, None)
+        if started is None:
+            return None
+        start, ssl, session_id = started
+        if session_id:
+            self._resumable.add(session_id)
+        latency = time.perf_counter() - start
+        status = _RESUME_STATUS.get(ssl.resume_status(), "unknown") if ssl else "none"
+        self.handshakes.append((latency, status))
+        return latency, status
+
+    def handshake_failed(self, connection, condition=None):
+        """
+        Forgets a connection attempt that failed before the connection was opened.
+
+        Some brokers reject TLS session resumption, so if the attempt offered a
+        session that had been established before and failed with an SSL error,
+        later connections to that broker go back to full handshakes.
+        Call from the handler's on_transport_error().
+
+        Args:
+            connection (proton.Connection): The connection whose attempt failed.
+            condition (proton.Condition, optional): The transport error condition.
+        """
+        started = self._started.pop(connection, None)
+        ssl_failure = condition is not None and "SSL" in (condition.description or "")
+        if started and ssl_failure and started[2] in self._resumable:
+            self._not_resumable.add(started[2])
+
+    def handshake_summary(self):
+        """
+        Summarizes the recorded handshake latencies by resume status.
+
+        Returns:
+            str: One "status: count, avg ms" entry per resume status seen.
+        """
+        by_status = {}
+        for latency, status in self.handshakes:
+            by_status.setdefault(status, []).append(latency)
+        return ", ".join(
+            f"{status}: {len(latencies)} x {sum(latencies) / len(latencies) * 1000:.1f} ms avg"
+            for status, latencies in sorted(by_status.items())
+        )
+
+
+def get_tls_context(ca_cert_path, cert_path, key_path, key_password=None):
+    """
+    Returns the TLSContext for a (CA, cert, key) triple, creating it on first use.
+
+    Args:
+        ca_cert_path (str): Path of the trusted CA certificate.
+        cert_path (str): Path of the client certificate.
+        key_path (str): Path of the client private key.
+        key_password (str, optional): Password of the client key, if any.
+
+    Returns:
+        TLSContext: The cached context.
+    """
+    key = (os.path.abspath(ca_cert_path), os.path.abspath(cert_path), os.path.abspath(key_path))
+    context = _contexts.get(key)
+    if context is None:
+        context = TLSContext(ca_cert_path, cert_path, key_path, key_password,
+                             session_resumption=TLS_SESSION_RESUMPTION)
+        _contexts[key] = context
+    return context
+
+
+def measure_handshakes(connections, session_resumption):
+    """
+    Opens and closes connections one after the other and records their handshakes.
+
+    Uses the producer's broker settings and client certificate.
+
+    Args:
+        connections (int): Number of sequential connections.
+        session_resumption (bool): Whether to offer TLS session resumption.
+
+    Returns:
+        TLSContext: The context holding the recorded handshakes.
+    """
+    from proton.handlers import MessagingHandler
+    from proton.reactor import Container
+    import producer
+
+    context = TLSContext(producer.CA_CERT_PATH, producer.PRODUCER_CLIENT_CERT_PATH,
+                         producer.PRODUCER_CLIENT_KEY_PATH, session_resumption=session_resumption)
+
+    class _HandshakeProbe(MessagingHandler):
+        def __init__(self):
+            super().__init__()
+            self.remaining = connections
+
+        def on_start(self, event):
+            self._open(event.container)
+
+        def _open(self, container):
+            context.connect(container, producer.CONNECTION_URL, user=producer.PRODUCER_USER,
+                            password=producer.PRODUCER_PASSWORD, virtual_host=producer.VHOST,
+                            sni=producer.RABBITMQ_HOST, allow_insecure_mechs=False, allowed_mechs=producer.SASL_MECHANISMS,
+                            reconnect=False)
+
+        def on_connection_opened(self, event):
+            context.handshake_completed(event.connection)
+            event.connection.close()
+
+        def on_transport_error(self, event):
+            log.error(f"Handshake probe: Transport error: {event.transport.condition}")
+            context.handshake_failed(event.connection, event.transport.condition)
+
+        def on_transport_closed(self, event):
+            # Free the transport so its TLS session is stored for the next connection
+            event.transport.unbind()
+            self.remaining -= 1
+            if self.remaining > 0:
+                self._open(event.container)
+            else:
+                event.container.stop()
+
+    Container(_HandshakeProbe()).run()
+    return context
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    for resumption in (False, True):
+        context = measure_handshakes(count, resumption)
+        label = "with" if resumption else "without"
+        print(f"Handshake latency {label} session resumption: {context.handshake_summary()}")